@@ -1,16 +1,19 @@
-import requests
-from requests import RequestException, HTTPError
-
-from utils import get_config, get_logger
+from api.http_transport import get_transport, release_stream
+from deadlines import api_deadline
+from records import BikeStation
+from config import get_compiled_config
+from utils import get_logger
 import xml.etree.ElementTree as ET
 import time
 
 logger = get_logger(__name__)
 
+FEED_URL = 'http://dynamisch.citybikewien.at/citybike_xml.php'
+
 
 class CitybikeWienApi:
     """
-    Get updates to stations from citybikewien.at API and parse to an `array` of `dict`s,
+    Get updates to stations from citybikewien.at API and parse to an `array` of `BikeStation`s,
     then cache the `array` as `self.data`
 
     Input:
@@ -22,16 +25,16 @@ class CitybikeWienApi:
                 rename (str, optional):     do not use the api name of the station and use this value instead
 
     Output:
-    self.data: `None` or `array` with items of `dict` with the following keys:
+    self.data: `None` or `array` of `records.BikeStation` with the following fields:
         id (int):       id of the station
-        status (str):   status code of station from citybikewien.at API
         name (str):     name of station, used to merge with other traffic data
         bikes (int):    number of available bikes at station
+        status (str):   status code of station from citybikewien.at API
 
     Example self.data:
     [
-        {'id': '2005', 'status': 'aktiv', 'name': 'Handelskai', 'bikes': '2'},
-        {'id': '2004', 'status': 'aktiv', 'name': 'Traisengasse', 'bikes': '0'}
+        BikeStation(id=2005, name='Handelskai', bikes=2, status='aktiv'),
+        BikeStation(id=2004, name='Traisengasse', bikes=0, status='aktiv')
     ]
     """
 
@@ -48,43 +51,82 @@ class CitybikeWienApi:
         Updates self.data iff an update is needed, else does nothing
         """
         try:
-            conf = get_config()
             if self.nextUpdate <= time.time():  # only update when needed
                 self._get_data()
-                self.nextUpdate = time.time() + conf['api']['citybikewien']['updateInterval']
+                self.nextUpdate = time.time() + get_compiled_config().update_intervals['citybikewien']
         except Exception as err:
             import sys
             self.exc_info = sys.exc_info()
 
     def _get_data(self):
+        wanted = get_compiled_config().citybikewien_stations  # ids and renames are compiled once per config
+        citybikewien_data = get_transport().fetch('citybikewien', FEED_URL,
+                                                  lambda res: self._parse(res, wanted), stream=True, variant=wanted,
+                                                  deadline=api_deadline('citybikewien'),
+                                                  hedge=get_compiled_config().hedges['citybikewien'])
+        logger.debug("updated data: %s" % citybikewien_data)
+        self.data = citybikewien_data
+
+    @staticmethod
+    def _parse(res, wanted):
+        res.raw.decode_content = True  # let urllib3 undo gzip/deflate while streaming
         try:
-            res = requests.get('http://dynamisch.citybikewien.at/citybike_xml.php')
-        except RequestException or HTTPError:  # retry on error
-            logger.error("Caught RequestException")
-            res = requests.get('http://dynamisch.citybikewien.at/citybike_xml.php')
-        res.raise_for_status()
-        root = ET.fromstring(res.text)
+            return CitybikeWienApi._parse_stream(res.raw, wanted)
+        finally:
+            release_stream(res.raw)
+
+    @staticmethod
+    def _parse_stream(stream, wanted):
+        """
+        Streams the citybikewien XML and extracts only the wanted stations. Parsed `<station>` elements are cleared
+        right away and parsing stops as soon as every wanted station has been found, so memory and time scale with
+        the number of wanted stations instead of the size of the feed. Stopping early leaves the rest of the body
+        unread, `http_transport.release_stream()` drains a small rest to keep the connection, else it reconnects.
+
+        :param stream: file-like object of the XML document
+        :param wanted: `dict` of station id (str) to rename value or `None`
+        :return: `array` of `BikeStation`s in feed order
+        """
         citybikewien_data = []
+        missing = set(wanted)
+        root = None
+        for event, elem in ET.iterparse(stream, events=('start', 'end')):
+            if root is None:
+                root = elem  # keep a reference to the root, so parsed stations can be dropped from it
+            if event != 'end' or elem.tag != 'station':
+                continue
 
-        # extract only wanted stations and parse to citybikewien dict
-        conf = get_config()
-        stations = conf['api']['citybikewien']['stations']
-        for station_xml in root.findall('station'):
-            if station_xml.find('id').text in list(map(lambda s: str(s['id']), stations)):
-                citybikewien_data.append({
-                    'id': station_xml.find('id').text,
-                    'name': station_xml.find('name').text,
-                    'bikes': station_xml.find('free_bikes').text,
-                    'status': station_xml.find('status').text
-                })
-
-        # rename stations to names from config, so they can be mapped with other api data by name
-        for conf_station in stations:
-            if 'rename' in conf_station:
-                for station in citybikewien_data:
-                    if station['id'] == str(conf_station['id']):
-                        station['name'] = conf_station['rename']
-                        break
+            station_id = elem.findtext('id')
+            if station_id in missing:
+                missing.discard(station_id)
+                citybikewien_data.append(BikeStation(
+                    id=int(station_id),
+                    # rename stations to names from config, so they can be mapped with other api data by name
+                    name=wanted[station_id] or elem.findtext('name'),
+                    bikes=int(elem.findtext('free_bikes')),
+                    status=elem.findtext('status')
+                ))
+            root.clear()  # drop parsed stations
+            if not missing:  # stop early, every wanted station was found
+                break
 
-        logger.debug("updated data: %s" % citybikewien_data)
-        self.data = citybikewien_data
+        return citybikewien_data
+
+
+class FleetCitybikeWienApi(CitybikeWienApi):
+    """
+    `CitybikeWienApi` of a fleet, see `fleet.py`. Reads the stations of all displays from one download of the feed,
+    with their names from the feed, every display gets its own stations with its own renames, see `view()`
+    """
+
+    @staticmethod
+    def view(data, config):
+        """
+        :param data: `self.data`
+        :param config: `Config` of a display
+        :return: `array` of the display's `BikeStation`s renamed by the display, like `CitybikeWienApi` would have
+                 fetched them
+        """
+        wanted = config.citybikewien_stations
+        return [station.replace(name=wanted[str(station.id)]) if wanted[str(station.id)] else station
+                for station in data if str(station.id) in wanted]
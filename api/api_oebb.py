@@ -1,8 +1,16 @@
 import time
 import subprocess
 import json
-import os
-
+from datetime import datetime
+
+from deadlines import api_deadline, get_latency_stats, remaining, DeadlineExceededException
+from departures import next_update
+from metrics import get_metrics
+from merge import merge_stations, line_by_direction
+from api.http_transport import get_transport
+from api.oebb_sidecar import get_sidecar, journeys_script, OeBBSidecarException
+from records import Line, Station
+from config import get_compiled_config
 from utils import get_config, get_logger
 
 logger = get_logger(__name__)
@@ -10,40 +18,44 @@ logger = get_logger(__name__)
 
 class OeBBApi:
     """
-    Get updates to stations from tickets.oebb.at API and parse to an `array` of `dict`s,
-    then cache the `array` as `self.data`
+    Get updates to stations from tickets.oebb.at API and parse to a `tuple` of `Station`s,
+    then cache the `tuple` as `self.data`
 
     Input:
     Uses data from `config.json` with the following keys:
         oebb (json):                            oebb json with the following keys:
             updateInterval (number):            minimum of how long until the next API call should be made in seconds
+            maxAge (number, optional):          max seconds until real-time data is fetched again, as long as there
+                                                are enough departures left to display. Default `updateInterval`
             connections (array[json]):          array of train connections
                 from (int):                     id of the departure station
                 to (int):                       id of the destination station
             rename (array[json], optional):     array of stations to be renamed
                 old (str):                      old name to be renamed
                 new (str):                      old name station renamed to this value
+            sidecar (bool, optional):           use a long-lived node process for all connections, default `True`
+            sidecarTimeout (number, optional):  seconds to wait for the node sidecar, default 30
 
     Output:
-    self.data: `None` or `array` with items of `dict` with the following keys:
-        name (str):                    name of station, used to merge with other traffic data
-        lines (array[dict]):            array of transport lines of type `dict` with the following keys:
-            direction (str):            displayed name of direction/destination the train is heading
-            departures (array[int]):    array of departure countdowns in minutes of type `int`
-            barrierFree (bool):         `True` if the coming train is barrier free accessible
+    self.data: `None` or `tuple` of `records.Station` with the following fields:
+        name (str):                     name of station, used to merge with other traffic data
+        lines (tuple[Line]):            transport lines of the station
             name (str):                 lines name in a 3`char` long representation
-            trafficJam (bool):          `True` if the coming train is delayed
+            direction (str):            displayed name of direction/destination the train is heading
+            departures (tuple[float]):  sorted departure times in seconds since the Epoch
+            barrier_free (bool):        always `False`, no data from api
+            traffic_jam (bool):         always `False`, no data from api
 
     Example self.data:
-    [
-        {'name': 'Handelskai', 'lines': [
-            {'direction': 'nach Floridsdorf', 'departures': [8, 11], 'barrierFree': True, 'name': '  S', 'trafficJam': False}
-        ]},
-        {'name': 'Traisengasse', 'lines': [
-            {'direction': 'nach Meidling', 'departures': [2, 14, 17, 17, 24], 'barrierFree': True, 'name': '  S', 'trafficJam': False},
-            {'direction': 'nach Flughafen', 'departures': [8], 'barrierFree': True, 'name': '  S', 'trafficJam': False}
-        ]}
-    ]
+    (
+        Station(name='Handelskai', lines=(
+            Line(name='  S', direction='nach Floridsdorf', departures=(1546333680.0, 1546333860.0), barrier_free=False, traffic_jam=False),
+        ), citybikewien=None, walking_time=None),
+        Station(name='Traisengasse', lines=(
+            Line(name='  S', direction='nach Meidling', departures=(1546333320.0, 1546334040.0, 1546334220.0), barrier_free=False, traffic_jam=False),
+            Line(name='  S', direction='nach Flughafen', departures=(1546333680.0,), barrier_free=False, traffic_jam=False)
+        ), citybikewien=None, walking_time=None)
+    )
     """
 
     def __init__(self):
@@ -63,92 +75,135 @@ class OeBBApi:
         try:
             if self.nextUpdate <= time.time():  # only update when needed
                 self._get_data()
-                conf = get_config()
-                self.nextUpdate = time.time() + conf['api']['oebb']['updateInterval']
+                config = get_compiled_config()
+                # countdowns are recomputed from the departure times, fetch only when they run out or get old
+                self.nextUpdate = next_update(time.time(), self._stations(), config.update_intervals['oebb'],
+                                              config.max_ages['oebb'], config.render_offset * 60)
         except Exception as err:
             import sys
             self.exc_info = sys.exc_info()
 
-    @staticmethod
-    def _replace_station_and_direction_names(stations):
-        conf = get_config()
-        if 'rename' in conf['api']['oebb']:
-            for station in stations:
-                for rename in conf['api']['oebb']['rename']:
-                    for line in station['lines']:
-                        if line['direction'] == rename['old']:
-                            line['direction'] = rename['new']
-                    if station['name'] == rename['old']:
-                        station['name'] = rename['new']
-        return stations
-
-    @staticmethod
-    def _merge_stations_by_name(unmerged_stations):
-        stations = []
-        for unmerged_station in unmerged_stations:
-            exists = False
-            for station in stations:
-                if unmerged_station['name'] == station['name']:
-                    station['lines'].extend(unmerged_station['lines'])
-                    exists = True
-            if exists is False:
-                stations.append(unmerged_station)
-        return stations
+    def _stations(self):
+        """
+        :return: fetched `Station`s, the next update is planned by their departures
+        """
+        return self.data
 
     @staticmethod
-    def _merge_lines_by_direction(unmerged_stations):
-        stations = []
-        for unmerged_station in unmerged_stations:
-            lines = []
-            for unmerged_line in unmerged_station['lines']:
-                exists = False
-                for line in lines:
-                    # if unmerged_line['name'] == line['name'] and
-                    #   unmerged_line['direction'] == line['direction']:  # merge trains by name and direction
-                    if unmerged_line['direction'] == line['direction']:  # merge trains by direction only
-                        line['departures'].extend(unmerged_line['departures'])
-                        exists = True
-                if exists is False:
-                    lines.append(unmerged_line)
-            for line in lines:
-                line['departures'].sort()
-            stations.append({'lines': lines, 'name': unmerged_station['name']})
-        return stations
+    def _get_journeys_from_subprocess(connection, deadline):
+        get_metrics().counter('oebb_node_spawns_total', mode='subprocess').inc()
+        try:  # the node process is killed if it does not finish in time
+            with get_metrics().timer('oebb_node_seconds', mode='subprocess'):
+                res_bytes = subprocess.check_output(["node", journeys_script(), str(connection['from']),
+                                                     str(connection['to'])], shell=False,
+                                                    timeout=remaining('oebb', deadline))
+        except subprocess.TimeoutExpired:
+            get_latency_stats('oebb').record_miss()
+            raise DeadlineExceededException("node did not answer connection %s -> %s within the deadline"
+                                            % (connection['from'], connection['to']))
+        return json.loads(res_bytes.decode("utf-8").replace("'", '"'))
+
+    def _get_journeys_from_sidecar(self, connections, timeout, deadline):
+        try:
+            with get_metrics().timer('oebb_node_seconds', mode='sidecar'):
+                results = get_sidecar().journeys(connections, min(timeout, remaining('oebb', deadline)))
+        except OeBBSidecarException as err:  # fall back to one node process per connection
+            logger.error("Caught OeBBSidecarException: %s, falling back to subprocess" % err)
+            return [self._get_journeys_from_subprocess(c, deadline) for c in connections]
+
+        journeys = []
+        for connection, result in zip(connections, results):
+            if 'journeys' in result:
+                journeys.append(result['journeys'])
+            else:  # retry only the failed connection
+                logger.error("sidecar failed for connection %s -> %s: %s, falling back to subprocess"
+                             % (connection['from'], connection['to'], result.get('error')))
+                journeys.append(self._get_journeys_from_subprocess(connection, deadline))
+        return journeys
 
     def _get_data(self):
         self.data = None
         conf = get_config()
 
-        res_stations = []
-        for c in conf['api']['oebb']['connections']:
-            res_bytes = subprocess.check_output(
-                ["node", os.path.dirname(os.path.abspath(__file__)) + "/../lib/node/oebb-journeys.js", str(c['from']), str(c['to'])],
-                shell=False)
-            journey_data = json.loads(res_bytes.decode("utf-8").replace("'", '"'))
-            res_stations.append(journey_data)
+        connections = conf['api']['oebb']['connections']
+        start = time.time()
+        deadline = api_deadline('oebb', start)
+        if conf['api']['oebb'].get('sidecar', True):
+            res_stations = self._get_journeys_from_sidecar(connections, conf['api']['oebb'].get('sidecarTimeout', 30),
+                                                           deadline)
+        else:
+            res_stations = [self._get_journeys_from_subprocess(c, deadline) for c in connections]
+        get_latency_stats('oebb').record(time.time() - start)
+        record_journeys = getattr(get_transport(), 'record_journeys', None)  # only while recording, see `api.replay`
+        if record_journeys is not None:
+            record_journeys(connections, res_stations)
+
+        oebb_data = self._to_data(connections, res_stations)
+        logger.debug("retrieved data: %s" % (oebb_data,))
+        self.data = oebb_data
 
+    def _to_data(self, connections, res_stations):
+        """
+        :param connections: fetched connections
+        :param res_stations: `array` of the journeys json of every connection
+        :return: `self.data`
+        """
+        return self._parse(res_stations, get_compiled_config().oebb_rename)
+
+    @staticmethod
+    def _parse(res_stations, rename):
+        """
+        :param res_stations: `array` of the journeys json of every connection
+        :param rename: `dict` of old to new station and direction name
+        :return: `tuple` of `Station`s, trains merged by direction only
+        """
         oebb_data = []
         for r_s in res_stations:
-            station = {'name': r_s[0]['legs'][0]['origin']['name'], 'lines': []}
+            lines = []
             for l in r_s:
                 l = l['legs'][0]
                 if l['mode'].lower() == 'train':  # only count trains
-                    departure_time = time.strptime(l['departure'], "%Y-%m-%dT%H:%M:%S%z")
-                    countdown = round((time.mktime(departure_time) + 3600 - time.mktime(time.localtime())) / 60)
-                    line = {
-                        'departures': [max(0, countdown)],
-                        'direction': l['destination']['name'],
-                        'name': l['line']['product']['shortName'].rjust(3),
-                        'trafficJam': False,  # no data from api
-                        'barrierFree': False  # no data from api
-                    }
-                    station['lines'].append(line)
-
-            oebb_data.append(station)
-
-        renamed_stations = self._replace_station_and_direction_names(oebb_data)
-        premerged_stations = self._merge_stations_by_name(renamed_stations)
-        oebb_data = self._merge_lines_by_direction(premerged_stations)
-
-        logger.debug("retrieved data: %s" % oebb_data)
-        self.data = oebb_data
+                    departure_time = datetime.strptime(l['departure'], "%Y-%m-%dT%H:%M:%S%z").timestamp()
+                    direction = l['destination']['name']
+                    lines.append(Line(l['line']['product']['shortName'].rjust(3), rename.get(direction, direction),
+                                      [departure_time]))  # no jam/barrier data from api
+            name = r_s[0]['legs'][0]['origin']['name']
+            oebb_data.append(Station(rename.get(name, name), lines))
+
+        return tuple(merge_stations([oebb_data], line_key=line_by_direction))  # merge trains by direction only
+
+
+class FleetOeBBApi(OeBBApi):
+    """
+    `OeBBApi` of a fleet, see `fleet.py`. Fetches the connections of all displays at once and keeps the stations of
+    every connection apart and not renamed, so every display gets its own connections with its own renames, see
+    `view()`
+
+    Output:
+    self.data: `None` or `dict` of `(from, to)` station ids as `str`s -> `tuple` of the connection's `Station`s
+    """
+
+    def _stations(self):
+        return [station for stations in self.data.values() for station in stations]
+
+    def _to_data(self, connections, res_stations):
+        return {(str(c['from']), str(c['to'])): self._parse([journeys], {})
+                for c, journeys in zip(connections, res_stations)}
+
+    @staticmethod
+    def view(data, config):
+        """
+        :param data: `self.data`
+        :param config: `Config` of a display
+        :return: `tuple` of the `Station`s of the display's connections renamed by the display, like `OeBBApi` would
+                 have fetched them
+        """
+        rename = config.oebb_rename
+        stations = []
+        for connection in config.raw['api']['oebb']['connections']:
+            for station in data.get((str(connection['from']), str(connection['to'])), ()):
+                stations.append(station.replace(
+                    name=rename.get(station.name, station.name),
+                    lines=tuple(line.replace(direction=rename.get(line.direction, line.direction))
+                                for line in station.lines)))
+        return tuple(merge_stations([stations], line_key=line_by_direction))
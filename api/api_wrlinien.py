@@ -1,11 +1,37 @@
-import requests
-from requests import RequestException, HTTPError
-
+from api.http_transport import get_transport
+from deadlines import api_deadline
+from departures import next_update
+from merge import merge_stations
+from records import Line, Station, Transport
+from config import get_compiled_config
 from utils import get_config, get_logger
+from datetime import datetime
 import time
 
 logger = get_logger(__name__)
 
+MONITOR_URL = 'https://www.wienerlinien.at/ogd_realtime/monitor'
+
+
+def _parse_time(text):
+    """
+    :return: Wiener Linien timestamp in seconds since the Epoch
+    """
+    return datetime.strptime(text, '%Y-%m-%dT%H:%M:%S.%f%z').timestamp()
+
+
+def _departure_time(departure_time, server_time):
+    """
+    :param departure_time: `departureTime` json of a departure
+    :param server_time: server time of the response in seconds since the Epoch
+    :return: real time of departure, else the planned time, else the countdown from `server_time`
+    """
+    if departure_time.get('timeReal'):
+        return _parse_time(departure_time['timeReal'])
+    if departure_time.get('timePlanned'):
+        return _parse_time(departure_time['timePlanned'])
+    return server_time + departure_time['countdown'] * 60
+
 
 class WrLinienApiException(Exception):
     pass
@@ -13,52 +39,51 @@ class WrLinienApiException(Exception):
 
 class WrLinienApi:
     """
-    Get updates to stations from wienerlinien.at API and parse to a `dict`, then cache the `dict` as `self.data`
+    Get updates to stations from wienerlinien.at API and parse to a `Transport` record, then cache it as `self.data`
 
     Input:
     Uses data from `config.json` with the following keys:
         wrlinien (json):                        wrlinien json with the following keys:
             updateInterval (number):            minimum of how long until the next API call should be made in seconds
+            maxAge (number, optional):          max seconds until real-time data is fetched again, as long as there
+                                                are enough departures left to display. Default `updateInterval`
             key (str):                          Wiener Linien API key
             rbls (array[number]):               rbls (ids) of stations
+            chunkSize (number, optional):       max rbls per request, the requests are sent concurrently.
+                                                Default 50
+            chunkTimeout (number, optional):    seconds to wait for the server to connect or send data per request.
+                                                A request that fails keeps its last data. Default 10
 
     Output:
-    self.data: `None` or `dict` with the following keys:
-        stations (array[dict]):             array with data to stations
-            name (str):                    name of station, used to merge with other traffic data
-            lines (array[dict]):            array of transport lines of type `dict` with the following keys:
-                direction (str):            displayed name of direction/destination the train is heading
-                departures (array[int]):    array of departure countdowns in minutes of type `int`
-                barrierFree (bool):         `True` if the coming transport is barrier free accessible
-                name (str):                 lines name abbreviated to 3 `char`s
-                trafficJam (bool):          `True` if the coming transport is delayed
-        lastUpdate (time.struct_time):  server timestamp of update
+    self.data: `None` or `records.Transport` with the following fields:
+        stations (tuple[Station]):              stations, merged by name
+            name (str):                         name of station, used to merge with other traffic data
+            lines (tuple[Line]):                transport lines of the station
+                name (str):                     lines name abbreviated to 3 `char`s
+                direction (str):                displayed name of direction/destination the train is heading
+                departures (tuple[float]):      sorted departure times in seconds since the Epoch, real time if known
+                barrier_free (bool):            `True` if the coming transport is barrier free accessible
+                traffic_jam (bool):             `True` if the coming transport is delayed
+        last_update (float):                    server timestamp of update in seconds since the Epoch
 
     Example self.data:
-    {
-        'stations': [
-            {
-                'name': 'Engerthstraße/Traisengasse',
-                'lines': [
-                    {'direction': 'Friedrich-Engels-Platz', 'departures': [0, 9, 18, 28, 38, 48, 58, 68], 'barrierFree': True, 'name': '11B', 'trafficJam': False},
-                    {'direction': 'Bhf. Heiligenstadt S U', 'departures': [6, 13, 22, 32, 42, 52, 62], 'barrierFree': True, 'name': '11A', 'trafficJam': False},
-                    {'direction': 'Griegstraße', 'departures': [2, 12, 21, 31, 41, 51, 61], 'barrierFree': True, 'name': ' 5A', 'trafficJam': False},
-                ]
-            }, {
-                'name': 'Traisengasse',
-                'lines': [
-                    {'direction': 'Dornbach', 'departures': [4, 15, 25, 35, 45, 55, 65], 'barrierFree': True, 'name': '  2', 'trafficJam': False}
-                ]
-            }
-        ],
-        'lastUpdate': time.struct_time(...)
-    }
+    Transport(stations=(
+        Station(name='Engerthstraße/Traisengasse', lines=(
+            Line(name='11B', direction='Friedrich-Engels-Platz', departures=(1546333200.0, 1546333740.0, 1546334280.0), barrier_free=True, traffic_jam=False),
+            Line(name='11A', direction='Bhf. Heiligenstadt S U', departures=(1546333560.0, 1546333980.0, 1546334520.0), barrier_free=True, traffic_jam=False),
+            Line(name=' 5A', direction='Griegstraße', departures=(1546333320.0, 1546333920.0, 1546334460.0), barrier_free=True, traffic_jam=False),
+        ), citybikewien=None, walking_time=None),
+        Station(name='Traisengasse', lines=(
+            Line(name='  2', direction='Dornbach', departures=(1546333440.0, 1546334100.0, 1546334700.0), barrier_free=True, traffic_jam=False),
+        ), citybikewien=None, walking_time=None)
+    ), last_update=1546300800.0)
     """
 
     def __init__(self):
         self.exc_info = None  # exception for main thread
         self.data = None  # fetched data
         self.nextUpdate = 0  # time when next update can be done in seconds since the Epoch
+        self.chunk_data = {}  # tuple of rbls -> last good `Transport` of the chunk
 
     def reset(self):
         self.__init__()
@@ -70,36 +95,70 @@ class WrLinienApi:
         try:
             if self.nextUpdate <= time.time():
                 self._get_data()
-                conf = get_config()
-                self.nextUpdate = time.time() + conf['api']['wrlinien']['updateInterval']
+                config = get_compiled_config()
+                # countdowns are recomputed from the departure times, fetch only when they run out or get old
+                self.nextUpdate = next_update(time.time(), self._stations(), config.update_intervals['wrlinien'],
+                                              config.max_ages['wrlinien'], config.render_offset * 60)
         except Exception as err:
             import sys
             self.exc_info = sys.exc_info()
 
-    @staticmethod
-    def _merge_stations_by_name(result):
-        stations = []
-        for s in result:
-            exists = False
-            for d in stations:
-                if s['name'] == d['name']:
-                    d['lines'].extend(s['lines'])
-                    exists = True
-            if exists is False:
-                stations.append(s)
-        return stations
+    def _stations(self):
+        """
+        :return: fetched `Station`s, the next update is planned by their departures
+        """
+        return self.data.stations
 
     def _get_data(self):
         self.data = None
         conf = get_config()
-        try:
-            res = requests.get('https://www.wienerlinien.at/ogd_realtime/monitor?rbl=%s&sender=%s'
-                               % (','.join(map(str, conf['api']['wrlinien']['rbls'])), conf['api']['wrlinien']['key']))
-        except RequestException or HTTPError:  # retry on error
-            logger.error("Caught RequestException")
-            res = requests.get('https://www.wienerlinien.at/ogd_realtime/monitor?rbl=%s&sender=%s'
-                               % (','.join(map(str, conf['api']['wrlinien']['rbls'])), conf['api']['wrlinien']['key']))
-        res.raise_for_status()
+        rbls = conf['api']['wrlinien']['rbls']
+        chunk_size = conf['api']['wrlinien'].get('chunkSize', 50)
+        chunks = [tuple(rbls[i:i + chunk_size]) for i in range(0, len(rbls), chunk_size)]
+        urls = ['%s?rbl=%s&sender=%s' % (MONITOR_URL, ','.join(map(str, chunk)), conf['api']['wrlinien']['key'])
+                for chunk in chunks]
+        results = get_transport().fetch_many('wrlinien', urls, self._parse,
+                                             timeout=conf['api']['wrlinien'].get('chunkTimeout', 10),
+                                             deadline=api_deadline('wrlinien'),
+                                             hedge=get_compiled_config().hedges['wrlinien'])
+
+        # a failed chunk keeps its last good data, the api only fails if no chunk has data
+        chunk_data = {}
+        for chunk, result in zip(chunks, results):
+            if not isinstance(result, Exception):
+                chunk_data[chunk] = result
+            elif chunk in self.chunk_data:
+                logger.error("Caught %s fetching rbls %s, keeping last data: %s" % (type(result).__name__, chunk, result))
+                chunk_data[chunk] = self.chunk_data[chunk]
+            else:
+                logger.error("Caught %s fetching rbls %s, no data: %s" % (type(result).__name__, chunk, result))
+        if chunks and not chunk_data:
+            raise next(r for r in results if isinstance(r, Exception))
+        self.chunk_data = chunk_data
+
+        wrlinien_data = self._combine(list(chunk_data.values()))
+        logger.debug("retrieved data: %s" % (wrlinien_data,))
+        self.data = wrlinien_data
+
+    @staticmethod
+    def _combine(results):
+        """
+        :param results: parsed `Transport` of every chunk with data
+        :return: `Transport` of all chunks
+        """
+        return Transport(merge_stations([t.stations for t in results]),
+                         min((t.last_update for t in results), default=time.time()))
+
+    @staticmethod
+    def _parse(res):
+        server_time, monitors = WrLinienApi._parse_monitors(res)
+        return Transport(merge_stations([[station for _, station in monitors]]), server_time)
+
+    @staticmethod
+    def _parse_monitors(res):
+        """
+        :return: server time of the response in seconds since the Epoch and `array` of `(monitor json, Station)`
+        """
         api_data = res.json()
 
         if api_data['message']['value'] != 'OK':  # check if server sends OK
@@ -107,30 +166,59 @@ class WrLinienApi:
             error_msg = "API returns NOK. Please check the message and the API Key."
             raise WrLinienApiException(error_msg)
 
-        # parse to wrlinien dict
+        # parse to records, departures are kept as absolute times, so countdowns can be recomputed until the next fetch
+        server_time = _parse_time(api_data['message']['serverTime'])
         translated_result = []
         for a_s in api_data['data']['monitors']:
-            station = {
-                'lines': [],
-                'name': a_s['locationStop']['properties']['title'],
-            }
+            lines = []
             for a_s_l in a_s['lines']:
-                line = {
-                    'name': a_s_l['name'].rjust(3),
-                    'direction': a_s_l['towards'],
-                    'barrierFree': a_s_l['barrierFree'],
-                    'trafficJam': a_s_l['trafficjam'],
-                    'departures': []
-                }
-                for d in a_s_l['departures']['departure']:
-                    if d['departureTime']:
-                        line['departures'].append(d['departureTime']['countdown'])
-                station['lines'].append(line)
-            translated_result.append(station)
-
-        wrlinien_data = {
-            'stations': self._merge_stations_by_name(translated_result),
-            'lastUpdate': time.strptime(api_data['message']['serverTime'], '%Y-%m-%dT%H:%M:%S.%f%z')
-        }
-        logger.debug("retrieved data: %s" % wrlinien_data)
-        self.data = wrlinien_data
+                departures = sorted(_departure_time(d['departureTime'], server_time)
+                                    for d in a_s_l['departures']['departure'] if d['departureTime'])
+                lines.append(Line(a_s_l['name'].rjust(3), a_s_l['towards'], departures,
+                                  barrier_free=a_s_l['barrierFree'], traffic_jam=a_s_l['trafficjam']))
+            translated_result.append((a_s, Station(a_s['locationStop']['properties']['title'], lines)))
+
+        return server_time, translated_result
+
+
+class FleetWrLinienApi(WrLinienApi):
+    """
+    `WrLinienApi` of a fleet, see `fleet.py`. Fetches the rbls of all displays at once and keeps the stations of
+    every rbl apart, so every display gets the stations of its own rbls, see `view()`
+
+    Output:
+    self.data: `None` or `dict` of rbl (int) -> `records.Transport` of the stations of the rbl
+    """
+
+    def _stations(self):
+        return [station for transport in self.data.values() for station in transport.stations]
+
+    @staticmethod
+    def _combine(results):
+        data = {}
+        for result in results:
+            data.update(result)
+        return data
+
+    @staticmethod
+    def _parse(res):
+        server_time, monitors = WrLinienApi._parse_monitors(res)
+        stations = {}  # rbl -> stations of its monitors
+        for monitor, station in monitors:
+            rbl = monitor['locationStop']['properties'].get('attributes', {}).get('rbl')
+            if rbl is None:
+                raise WrLinienApiException("monitor of %s has no rbl, it cannot be assigned to a display"
+                                           % station.name)
+            stations.setdefault(int(rbl), []).append(station)
+        return {rbl: Transport(merge_stations([rbl_stations]), server_time) for rbl, rbl_stations in stations.items()}
+
+    @staticmethod
+    def view(data, config):
+        """
+        :param data: `self.data`
+        :param config: `Config` of a display
+        :return: `Transport` of the display's rbls, like `WrLinienApi` would have fetched it
+        """
+        transports = [data[int(rbl)] for rbl in config.raw['api']['wrlinien']['rbls'] if int(rbl) in data]
+        return Transport(merge_stations([t.stations for t in transports]),
+                         min((t.last_update for t in transports), default=None))
@@ -1,109 +1,88 @@
 import xml.etree.ElementTree as ET
-import requests
-from requests import RequestException, HTTPError
-
+from api.http_transport import get_transport, release_stream
+from deadlines import api_deadline
+from records import Forecast, Weather, parse_local_time
+from config import get_compiled_config
 from utils import get_config, get_logger
 import time
 
 logger = get_logger(__name__)
-time_format_str = '%Y-%m-%dT%H:%M:%S'
+
+DISPLAYED_SLOTS = 2  # forecasts shown by the renderer, see `bpm_render.WEATHER_COLUMNS`
+FORECAST_SLOTS = DISPLAYED_SLOTS + 2  # the forecast is reused until `nextupdate`, these replace slots that passed
+
+
+class YRNOApiException(Exception):
+    pass
 
 
 class YRNOApi:
     """
-    Get weather updates from yr.no API and parse to a `dict`, then cache the `dict` as `self.data`
+    Get weather updates from yr.no API and parse to a `Weather` record, then cache it as `self.data`
+    A fleet runs one api per weather location, each with the `name` of its json in `api`, see `fleet.py`
 
     Input:
     Uses data from `config.json` with the following keys:
         weather (json):                     weather json with the following keys:
-            updateInterval (number):        minimum of how long until the next API call should be made in seconds
+            updateInterval (number):        how long until the next API call should be made in seconds, if the
+                                            forecast has no `nextupdate` in the future
             city (str):                     name of city
             province (str):                 name of province
             country (str):                  name of country
+            forecastSlots (number, optional):   number of forecasts to parse, default `FORECAST_SLOTS`
 
     Output:
-    self.data: `None` or `dict` with the following keys:
-        country (str):                      name of country
+    self.data: `None` or `records.Weather` with the following fields:
         city (str):                         name of city
-        sun (dict):                         sunset and sunrise data
-            set (time.struct_time):         time of sunset
-            rise (time.struct_time):        time of sunrise
-        forecast (array[dict]):             array of forecasts
-            precipitation (int):            precipitation in mm
+        country (str):                      name of country
+        sun_rise (float):                   time of sunrise in seconds since the Epoch
+        sun_set (float):                    time of sunset in seconds since the Epoch
+        forecast (tuple[Forecast]):         first `forecastSlots` forecasts, the renderer skips the ones that passed
+            time_from_text (str):           lower bound of valid time range, local time
+            time_to_text (str):             upper bound of valid time range, local time
+            time_from (float):              lower bound in seconds since the Epoch, parsed on first access
+            time_to (float):                upper bound in seconds since the Epoch, parsed on first access
+            symbol_id (int):                yr.no id of the weather symbol
+            description (str):              current weather description
+            precipitation (float):          precipitation in mm
             celsius (int):                  degrees celsius
-            time (dict):                    time range of the forecast
-                from (time.struct_time):    lower bound of valid time range
-                to (time.struct_time):      upper bound of valid time range
-            symbol (dict):                  icon symbol and name of the current weather
-                id (number):                yr.no id of the symbol
-                description (str):          current weather description
-            wind (dict):                    wind data
-                direction (str):            wind direction abbreviated to 3 `char`s
-                description (str):          wind type description
-                mps (float):                wind speed in meters per second
-            credit (dict):                  yr.no credits
-                url (str):                  url to yr.no website of requested location
-                text (str):                 yr.no credits text
-        lastUpdate (time.struct_time):  server timestamp of update
+            wind_direction (str):           wind direction abbreviated to 3 `char`s
+            wind_description (str):         wind type description
+            wind_mps (float):               wind speed in meters per second
+        credit_text (str):                  yr.no credits text
+        credit_url (str):                   url to yr.no website of requested location
+        last_update (float):                server timestamp of update in seconds since the Epoch
+        next_update (float):                time of the next server update in seconds since the Epoch or `None`
 
     Example self.data:
-    {
-        'country': 'Austria',
-        'city': 'Vienna',
-        'sun': {
-            'set': time.struct_time(...),
-            'rise': time.struct_time(...)
-        },
-        'forecast': [
-            {
-                'precipitation': '0',
-                'celsius': '8',
-                'time': {
-                    'to': time.struct_time(...),
-                    'from': time.struct_time(...)
-                },
-                'symbol': {
-                    'id': '4',
-                    'description': 'Cloudy'
-                },
-                'wind': {
-                    'direction': 'WNW',
-                    'description': 'Gentle breeze',
-                    'mps': '3.7'
-                }
-            }, {
-                'precipitation': '1.9',
-                'celsius': '8',
-                'time': {
-                    'to': time.struct_time(...),
-                    'from': time.struct_time(...)
-                },
-                'symbol': {
-                    'id': '9',
-                    'description': 'Rain'
-                },
-                'wind': {
-                    'direction': 'WNW',
-                    'description': 'Moderate breeze',
-                    'mps': '6.3'
-                }
-            }
-        ],
-        'credit': {
-            'url': 'http: //www.yr.no/place/Austria/Vienna/Vienna/',
-            'text': 'Weather forecast from Yr, delivered by the Norwegian Meteorological Institute and the NRK'
-        },
-        'lastUpdate': time.struct_time(...)
-    }
+    Weather(
+        city='Vienna',
+        country='Austria',
+        sun_rise=1546325640.0,
+        sun_set=1546355700.0,
+        forecast=(
+            Forecast(time_from_text='2019-01-01T10:00:00', time_to_text='2019-01-01T16:00:00', symbol_id=4, description='Cloudy',
+                     precipitation=0.0, celsius=8, wind_direction='WNW', wind_description='Gentle breeze',
+                     wind_mps=3.7),
+            Forecast(time_from_text='2019-01-01T16:00:00', time_to_text='2019-01-01T22:00:00', symbol_id=9, description='Rain',
+                     precipitation=1.9, celsius=8, wind_direction='WNW', wind_description='Moderate breeze',
+                     wind_mps=6.3)
+        ),
+        credit_text='Weather forecast from Yr, delivered by the Norwegian Meteorological Institute and the NRK',
+        credit_url='http://www.yr.no/place/Austria/Vienna/Vienna/',
+        last_update=1546322400.0,
+        next_update=1546344000.0
+    )
     """
 
-    def __init__(self):
+    def __init__(self, name='yrno'):
+        self.name = name  # name of the api's json in `api`, names its deadline, breaker and transport stats
         self.exc_info = None  # exception for main thread
         self.data = None  # fetched data
         self.nextUpdate = 0  # time when next update can be done in seconds since the Epoch
 
     def reset(self):
-        self.__init__()
+        self.__init__(self.name)
 
     def update(self):
         """
@@ -112,63 +91,106 @@ class YRNOApi:
         try:
             if self.nextUpdate <= time.time():
                 self._get_data()
-                conf = get_config()
-                self.nextUpdate = time.time() + conf['api']['yrno']['updateInterval']
+                # yr.no updates its forecast at `nextupdate`, until then the cached forecast is reused
+                self.nextUpdate = time.time() + get_compiled_config().update_intervals[self.name]
+                if self.data.next_update is not None and self.data.next_update > time.time():
+                    self.nextUpdate = self.data.next_update
+                # fetch again before fewer slots than displayed are left, even if `nextupdate` is later
+                self.nextUpdate = min(self.nextUpdate, self._slots_run_out(self.data.forecast))
         except Exception as err:
             import sys
             self.exc_info = sys.exc_info()
 
+    @staticmethod
+    def _slots_run_out(forecast):
+        """
+        :param forecast: `tuple` of `Forecast`s
+        :return: time in seconds since the Epoch fewer than `DISPLAYED_SLOTS` forecasts are upcoming, infinity if that
+                 is not in the future, e.g. yr.no sent too few slots, so a forecast is not fetched again right away
+        """
+        if len(forecast) < DISPLAYED_SLOTS:
+            return float('inf')
+        run_out = forecast[len(forecast) - DISPLAYED_SLOTS].time_to
+        return run_out if run_out > time.time() else float('inf')
+
     def _get_data(self):
-        conf = get_config()
-        try:
-            res = requests.post('https://www.yr.no/place/%s/%s/%s/forecast.xml'
-                                % (conf['api']['yrno']['country'], conf['api']['yrno']['province'], conf['api']['yrno']['city']))
-        except RequestException or HTTPError:  # retry on error
-            logger.error("Caught RequestException")
-            res = requests.post('https://www.yr.no/place/%s/%s/%s/forecast.xml'
-                                % (conf['api']['yrno']['country'], conf['api']['yrno']['province'], conf['api']['yrno']['city']))
-        res.raise_for_status()
-        root = ET.fromstring(res.text)
-
-        # filter data and parse to weather dict
-        legal_xml = root.find('credit').find('link')
-        location_xml = root.find('location')
-        sun_xml = root.find('sun')
-        weather_data = {
-            'credit': {
-                "text": legal_xml.get('text'),
-                "url": legal_xml.get('url')
-            },
-            'city': location_xml.find('name').text,
-            'country': location_xml.find('country').text,
-            'lastUpdate': time.strptime(root.find('meta').find('lastupdate').text, time_format_str),
-            'sun': {
-                "rise": time.strptime(sun_xml.get('rise'), time_format_str),
-                "set": time.strptime(sun_xml.get('set'), time_format_str)
-            },
-            "forecast": []
-        }
-        tabular_xml = root.find('forecast').find('tabular')
-        for time_xml in tabular_xml.findall('time'):
-            symbol_xml = time_xml.find('symbol')
-            wind_xml = time_xml.find('windSpeed')
-            weather_data['forecast'].append({
-                'time': {
-                    "from": time.strptime(time_xml.get('from'), time_format_str),
-                    "to": time.strptime(time_xml.get('to'), time_format_str)
-                },
-                'symbol': {
-                    "id": symbol_xml.get('number'),
-                    "description": symbol_xml.get('name')
-                },
-                'precipitation': time_xml.find('precipitation').get('value'),
-                'wind': {
-                    "direction": time_xml.find('windDirection').get('code'),
-                    "mps": wind_xml.get('mps'),
-                    "description": wind_xml.get('name')
-                },
-                "celsius": time_xml.find('temperature').get('value')
-            })
-
-        logger.debug("retrieved data: %s" % weather_data)
+        conf = get_config()['api'][self.name]
+        slots = conf.get('forecastSlots', FORECAST_SLOTS)
+        weather_data = get_transport().fetch(
+            self.name,
+            'https://www.yr.no/place/%s/%s/%s/forecast.xml' % (conf['country'], conf['province'], conf['city']),
+            lambda res: self._parse(res, slots), stream=True, variant=slots, deadline=api_deadline(self.name),
+            hedge=get_compiled_config().hedges[self.name])
+        logger.debug("retrieved data: %s" % (weather_data,))
         self.data = weather_data
+
+    @staticmethod
+    def _parse(res, slots):
+        res.raw.decode_content = True  # let urllib3 undo gzip/deflate while streaming
+        try:
+            return YRNOApi._parse_stream(res.raw, slots)
+        finally:
+            release_stream(res.raw)  # the rest of the forecast after the slots is not read
+
+    @staticmethod
+    def _parse_stream(stream, slots):
+        """
+        Streams the forecast XML and stops after the first `slots` forecasts of the tabular forecast, the rest of the
+        document is not parsed, see `http_transport.release_stream()`. Forecast times are only parsed when they are
+        read.
+
+        :param stream: file-like object of the XML document
+        :param slots: number of forecasts to parse
+        :return: `Weather`
+        """
+        header = {}  # tag -> element of `location`, `credit`, `meta` and `sun`
+        forecast = []
+        depth = 0
+        in_tabular = False
+        for event, elem in ET.iterparse(stream, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                in_tabular = in_tabular or elem.tag == 'tabular'
+                continue
+
+            depth -= 1
+            if depth == 1 and elem.tag in ('location', 'credit', 'meta', 'sun'):  # children of the root
+                header[elem.tag] = elem
+            elif elem.tag == 'tabular':
+                break
+            elif in_tabular and depth == 3 and elem.tag == 'time':
+                symbol_xml = elem.find('symbol')
+                wind_xml = elem.find('windSpeed')
+                forecast.append(Forecast(
+                    time_from_text=elem.get('from'),
+                    time_to_text=elem.get('to'),
+                    symbol_id=int(symbol_xml.get('number')),
+                    description=symbol_xml.get('name'),
+                    precipitation=float(elem.find('precipitation').get('value')),
+                    celsius=int(elem.find('temperature').get('value')),
+                    wind_direction=elem.find('windDirection').get('code'),
+                    wind_description=wind_xml.get('name'),
+                    wind_mps=float(wind_xml.get('mps'))
+                ))
+                if len(forecast) >= slots:  # stop early, the window is full
+                    break
+
+        missing = {'location', 'credit', 'meta', 'sun'}.difference(header)
+        if missing:
+            raise YRNOApiException("forecast.xml has no %s before its forecasts" % ', '.join(sorted(missing)))
+
+        # filter data and parse to weather records
+        legal_xml = header['credit'].find('link')
+        meta_xml = header['meta']
+        next_update = meta_xml.findtext('nextupdate')
+        return Weather(
+            city=header['location'].findtext('name'),
+            country=header['location'].findtext('country'),
+            sun_rise=parse_local_time(header['sun'].get('rise')),
+            sun_set=parse_local_time(header['sun'].get('set')),
+            forecast=forecast,
+            credit_text=legal_xml.get('text'),
+            credit_url=legal_xml.get('url'),
+            last_update=parse_local_time(meta_xml.findtext('lastupdate')),
+            next_update=parse_local_time(next_update) if next_update else None
+        )
@@ -0,0 +1,76 @@
+import random
+import threading
+import time
+
+from requests import ConnectionError
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class FaultTransport:
+    """
+    Wraps a transport and injects failures and latency per api, to see how the apis and their `CircuitBreaker`s
+    behave during an outage without a real one. Set it as the shared transport with `http_transport.set_transport()`.
+
+    faults maps an api name to a `dict` with the following keys:
+        failureRate (number, optional):         share of fetches that fail, 0 to 1, default 1
+        error (Exception, optional):            exception raised by failing fetches, default `ConnectionError`
+        latency (number, optional):             seconds every fetch of the api is delayed, default 0
+        until (number, optional):               time in seconds since the Epoch the faults end, default never
+
+    Example:
+    set_transport(FaultTransport(get_transport(), {'citybikewien': {'failureRate': 1, 'until': time.time() + 600}}))
+    """
+
+    def __init__(self, transport, faults=None, seed=None):
+        self.transport = transport  # wrapped transport, e.g. `HttpTransport`
+        self.faults = dict(faults or {})  # api name -> faults of the api
+        self.random = random.Random(seed)
+        self.injected = {}  # api name -> failures injected
+        self.lock = threading.Lock()
+
+    def set_faults(self, api_name, **faults):
+        """
+        Replaces the faults of `api_name`, without keyword arguments the api works again
+        """
+        with self.lock:
+            self.faults[api_name] = faults
+
+    def fetch(self, api_name, url, parse, *args, **kwargs):
+        latency, error = self._faults(api_name, url)
+        time.sleep(latency)
+        if error is not None:
+            raise error
+        return self.transport.fetch(api_name, url, parse, *args, **kwargs)
+
+    def fetch_many(self, api_name, urls, parse, timeout, *args, **kwargs):
+        faults = [self._faults(api_name, url) for url in urls]
+        time.sleep(max([latency for latency, _ in faults], default=0))  # the urls are fetched concurrently
+        working = [url for url, (_, error) in zip(urls, faults) if error is None]
+        fetched = iter(self.transport.fetch_many(api_name, working, parse, timeout, *args, **kwargs) if working else [])
+        return [next(fetched) if error is None else error for _, error in faults]
+
+    def report(self):
+        report = self.transport.report()
+        with self.lock:
+            for api_name, injected in self.injected.items():
+                report.setdefault(api_name, {})['faultsInjected'] = injected
+        return report
+
+    def _faults(self, api_name, url):
+        """
+        :return: seconds to delay the fetch of `url`, and the exception to raise instead of fetching or `None`
+        """
+        with self.lock:
+            faults = self.faults.get(api_name)
+            if not faults or faults.get('until', float('inf')) <= time.time():
+                return 0, None
+            if self.random.random() >= faults.get('failureRate', 1):
+                return faults.get('latency', 0), None
+            self.injected[api_name] = self.injected.get(api_name, 0) + 1
+
+        error = faults.get('error', ConnectionError)
+        logger.debug("injecting %s into %s" % (error.__name__, url))
+        return faults.get('latency', 0), error("injected fault fetching %s" % url)
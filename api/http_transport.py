@@ -0,0 +1,282 @@
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+from requests import ConnectionError, Timeout
+from requests.adapters import HTTPAdapter
+
+from metrics import get_metrics
+from profiler import get_profiler
+from deadlines import DeadlineExceededException, get_latency_stats, remaining
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+transport_cache = None  # caches the shared HttpTransport
+
+POOL_SIZE = 10  # connections kept alive per host, and concurrent fetches of `fetch_many()`
+DEADLINE_GRACE = 0.5  # seconds `fetch_many()` waits past the deadline for `fetch()` to give up on its own
+DRAIN_LIMIT = 64 * 1024  # max bytes of a body read past the parsed part to keep the connection pooled
+
+
+class TransportStats:
+    """
+    Counters of one api, used to show what keep-alive and conditional requests save on metered links
+    """
+
+    def __init__(self):
+        self.requests = 0  # requests sent
+        self.not_modified = 0  # requests answered with `304 Not Modified`
+        self.bytes_received = 0  # payload bytes downloaded
+        self.bytes_saved = 0  # payload bytes not downloaded again thanks to `304 Not Modified`
+        self.handshakes = 0  # new TCP (and TLS) connections opened
+        self.handshakes_saved = 0  # requests sent over a kept-alive connection
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+
+class _CachedResponse:
+    def __init__(self, etag, last_modified, size, result, variant):
+        self.etag = etag  # `ETag` header of the last `200` response
+        self.last_modified = last_modified  # `Last-Modified` header of the last `200` response
+        self.size = size  # payload size of the last `200` response in bytes
+        self.result = result  # parsed result of the last `200` response
+        self.variant = variant  # `variant` the result was parsed with
+
+
+class HttpTransport:
+    """
+    Shared HTTP transport for all HTTP apis
+
+    Pools connections per host and keeps them alive across cycles. Sends `If-None-Match` and `If-Modified-Since`
+    headers when the server sent validators before, and on `304 Not Modified` returns the last parsed result
+    without parsing again.
+
+    Example:
+    data = get_transport().fetch('yrno', 'https://www.yr.no/place/Austria/Vienna/Vienna/forecast.xml', parse)
+    """
+
+    def __init__(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.cache = {}  # url -> _CachedResponse
+        self.stats = {}  # api name -> TransportStats
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix='fetch')
+        # requests with a deadline, every fetch may hedge a second request
+        self.deadline_executor = ThreadPoolExecutor(max_workers=2 * POOL_SIZE, thread_name_prefix='deadline')
+
+    def fetch(self, api_name, url, parse, stream=False, variant=None, timeout=None, deadline=None, hedge=False):
+        """
+        GETs `url` and returns `parse(response)`. On `304 Not Modified` returns the cached result of the last parse.
+        Retries once if the connection broke, e.g. a kept-alive connection the server closed meanwhile. Timeouts and
+        HTTP errors are not retried here, failed apis are retried by their `CircuitBreaker`.
+
+        With a `deadline`, the fetch is abandoned when the deadline passes. The abandoned request is not waited for,
+        the socket timeout, which is lowered to the time left, ends it. With `hedge`, a second request is sent if the
+        first one is slower than the api's p95 latency, the first answer wins.
+
+        :param api_name: name of the api, used for stats
+        :param url: url to get
+        :param parse: function parsing a successful `requests.Response`, the result is cached
+        :param stream: if `True`, the body is not preloaded, so `parse` can stream `response.raw`
+        :param variant: everything besides the response `parse` depends on, e.g. config values. A cached result is
+                        only reused for an equal `variant`
+        :param timeout: seconds to wait for the server to connect or send data, `None` to wait forever
+        :param deadline: time in seconds since the Epoch the result is needed by, `None` to wait as long as it takes
+        :param hedge: send a second request if the first one is slower than usual, needs a `deadline`
+        :return: parsed result
+        :raises DeadlineExceededException: if the deadline passed before a request answered
+        """
+        if deadline is None:
+            return self._fetch(api_name, url, parse, stream, variant, timeout)
+
+        left = remaining(api_name, deadline)
+        timeout = left if timeout is None else min(timeout, left)
+        latency_stats = get_latency_stats(api_name)
+        hedge_after = latency_stats.percentile(95) if hedge else None
+
+        futures = [self.deadline_executor.submit(self._fetch, api_name, url, parse, stream, variant, timeout)]
+        if hedge_after is not None and hedge_after < left and not wait(futures, timeout=hedge_after).done:
+            logger.info("%s slower than p95 of %.2f seconds, hedging %s" % (api_name, hedge_after, url))
+            latency_stats.record_hedge()
+            futures.append(self.deadline_executor.submit(self._fetch, api_name, url, parse, stream, variant, timeout))
+
+        pending = set(futures)
+        while pending and time.time() < deadline:
+            done, pending = wait(pending, timeout=deadline - time.time(), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        latency_stats.record_hedge(won=True)
+                    for other in pending:
+                        other.cancel()
+                    return future.result()
+        if not pending:  # every request failed in time
+            raise futures[0].exception()
+        for future in pending:
+            future.cancel()
+        latency_stats.record_miss()
+        raise DeadlineExceededException("%s not answered within the deadline of %s" % (url, api_name))
+
+    def _fetch(self, api_name, url, parse, stream, variant, timeout):
+        with get_profiler().profile():  # runs on the fetch threads of `fetch_many()` and deadlines, too
+            return self._fetch_unprofiled(api_name, url, parse, stream, variant, timeout)
+
+    def _fetch_unprofiled(self, api_name, url, parse, stream, variant, timeout):
+        start = time.time()
+        with self.lock:
+            cached = self.cache.get(url)
+            if cached is not None and cached.variant != variant:  # parsed for another config, parse again
+                cached = None
+            stats = self.stats.setdefault(api_name, TransportStats())
+
+        headers = {}
+        if cached is not None:
+            if cached.etag:
+                headers['If-None-Match'] = cached.etag
+            if cached.last_modified:
+                headers['If-Modified-Since'] = cached.last_modified
+
+        metrics = get_metrics()
+        try:
+            with metrics.timer('http_request_seconds', api=api_name):  # until the headers arrived
+                res = self._get(url, headers, stream, stats, timeout)
+        except ConnectionError as err:
+            if isinstance(err, Timeout):  # e.g. `ConnectTimeout`, the server would most likely not answer again
+                raise
+            logger.error("Caught ConnectionError, retrying once: %s" % err)
+            res = self._get(url, headers, stream, stats, timeout)
+
+        with res:
+            if res.status_code == 304 and cached is not None:
+                with self.lock:
+                    stats.not_modified += 1
+                    stats.bytes_saved += cached.size
+                logger.debug("%s not modified, reusing %d bytes" % (url, cached.size))
+                get_latency_stats(api_name).record(time.time() - start)
+                return cached.result
+
+            res.raise_for_status()
+            with metrics.timer('parse_seconds', api=api_name):  # streamed bodies are downloaded while parsing
+                result = parse(res)
+            size = res.raw.tell() if stream else len(res.content)
+
+        with self.lock:
+            stats.bytes_received += size
+            self.cache[url] = _CachedResponse(res.headers.get('ETag'), res.headers.get('Last-Modified'), size, result, variant)
+        get_latency_stats(api_name).record(time.time() - start)
+        return result
+
+    def fetch_many(self, api_name, urls, parse, timeout, deadline=None, hedge=False):
+        """
+        `fetch()`es `urls` concurrently over the pooled connections, every response is parsed as soon as it arrives.
+        A url that is not done after its share of the deadline counts as timed out, it may retry once like `fetch()`.
+        With a `deadline`, urls not done by then count as timed out as well.
+
+        :param api_name: name of the api, used for stats
+        :param urls: urls to get
+        :param parse: function parsing a successful `requests.Response`
+        :param timeout: seconds to wait for the server of every url to connect or send data
+        :param deadline: time in seconds since the Epoch the results are needed by, see `fetch()`
+        :param hedge: hedge slow requests, see `fetch()`
+        :return: `array` of parsed result or raised `Exception` of every url, in order of `urls`
+        """
+        futures = [self.executor.submit(self.fetch, api_name, url, parse, timeout=timeout, deadline=deadline,
+                                        hedge=hedge) for url in urls]
+        max_wait = 2 * timeout * math.ceil(len(urls) / POOL_SIZE)  # every fetch may retry once
+        if deadline is not None:  # `fetch()` gives up at the deadline itself, give it a moment to report
+            max_wait = min(max_wait, deadline - time.time() + DEADLINE_GRACE)
+        wait(futures, timeout=max(0, max_wait))
+
+        results = []
+        for url, future in zip(urls, futures):
+            if not future.done():
+                future.cancel()
+                results.append(TimeoutError("%s not done after %d seconds" % (url, max_wait)))
+            elif future.exception() is not None:
+                results.append(future.exception())
+            else:
+                results.append(future.result())
+        return results
+
+    def report(self):
+        """
+        :return: `dict` of api name to `dict` of stats
+        """
+        with self.lock:
+            return {api_name: stats.to_dict() for api_name, stats in self.stats.items()}
+
+    def _get(self, url, headers, stream, stats, timeout):
+        connections_before = self._count_connections(url)
+        res = self.session.get(url, headers=headers, stream=stream, timeout=timeout)
+        with self.lock:
+            stats.requests += 1
+            if self._count_connections(url) > connections_before:
+                stats.handshakes += 1
+            else:
+                stats.handshakes_saved += 1
+        return res
+
+    def _count_connections(self, url):
+        # number of connections ever opened to the host of `url`, counted over all of its pools
+        host = urlsplit(url).hostname
+        pools = self.session.get_adapter(url).poolmanager.pools
+        count = 0
+        for key in pools.keys():  # `keys()` returns a thread safe copy
+            if key.key_host == host:
+                pool = pools.get(key)
+                count += pool.num_connections if pool is not None else 0
+        return count
+
+
+def release_stream(stream):
+    """
+    Releases the connection of a streamed body a parser stopped reading early. A connection with unread body cannot
+    be reused, so a small rest of up to `DRAIN_LIMIT` bytes is read and dropped and the connection goes back to the
+    pool. A larger rest costs more than a new connection, then the stream is closed and the next fetch reconnects.
+
+    Example:
+    try:
+        return parse_stream(res.raw)
+    finally:
+        release_stream(res.raw)
+
+    :param stream: `urllib3.HTTPResponse` of a `fetch()` with `stream=True`
+    """
+    drained = 0
+    while drained <= DRAIN_LIMIT:
+        chunk = stream.read(16 * 1024)
+        if not chunk:
+            return  # fully read, urllib3 put the connection back into the pool
+        drained += len(chunk)
+    logger.debug("more than %d bytes of the body left unread, closing the connection" % DRAIN_LIMIT)
+    stream.close()
+
+
+def set_transport(transport):
+    """
+    Replaces the shared transport, e.g. with a `FaultTransport` to inject failures
+
+    :param transport: object with the interface of `HttpTransport`, `None` to create a new `HttpTransport` on next use
+    """
+    global transport_cache
+    transport_cache = transport
+
+
+def get_transport():
+    """
+    Returns the shared `HttpTransport`, it outlives `reset()` of the apis so connections stay alive
+
+    :return: shared `HttpTransport`, or the transport set with `set_transport()`
+    """
+    global transport_cache
+    if transport_cache is None:
+        transport_cache = HttpTransport()
+    return transport_cache
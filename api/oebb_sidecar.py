@@ -0,0 +1,142 @@
+import json
+import os
+import queue
+import subprocess
+import threading
+
+from metrics import get_metrics
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+JOURNEYS_SCRIPT = os.path.dirname(os.path.abspath(__file__)) + "/../lib/node/oebb-journeys.js"
+# stand-in of `JOURNEYS_SCRIPT` answering with recorded journeys from the replay server in `OEBB_REPLAY_URL`
+REPLAY_SCRIPT = os.path.dirname(os.path.abspath(__file__)) + "/../lib/node/oebb-journeys-replay.js"
+
+sidecar_cache = None  # caches the shared OeBBSidecar
+
+
+class OeBBSidecarException(Exception):
+    pass
+
+
+class OeBBSidecar:
+    """
+    Supervises a long-lived `node oebb-journeys.js --sidecar` process, so `require('oebb')` and the node start up
+    are only paid once instead of once per connection per cycle
+
+    The sidecar speaks line-delimited JSON over stdin/stdout. A batch of connections is sent as one request line
+    and requested concurrently inside node. If the process dies, hangs or answers garbage, it is killed and
+    restarted with the next request.
+
+    Example request:
+    {"id": 1, "connections": [{"from": 1290201, "to": 1292101}, {"from": 1290201, "to": 1291201}]}
+
+    Example response:
+    {"id": 1, "results": [{"journeys": [...]}, {"error": "timeout"}]}
+    """
+
+    def __init__(self, script=None):
+        self.script = script or journeys_script()
+        self.process = None  # running node process
+        self.lines = None  # queue of lines read from the node process' stdout
+        self.request_id = 0  # id of the last request sent
+        self.restarts = 0  # number of times the node process was (re)started
+        self.lock = threading.Lock()  # only one request at a time on stdin/stdout
+
+    def journeys(self, connections, timeout):
+        """
+        Requests the journeys of all `connections` in one batch
+
+        :param connections: `array` of `dict`s with the keys `from` and `to`
+        :param timeout: seconds to wait for node to start up and to answer
+        :return: `array` with one `dict` per connection, either with key `journeys` or key `error`
+        """
+        with self.lock:
+            try:
+                self._ensure_running(timeout)
+                self.request_id += 1
+                request = {'id': self.request_id, 'connections': [{'from': c['from'], 'to': c['to']} for c in connections]}
+                self.process.stdin.write((json.dumps(request) + '\n').encode('utf-8'))
+                self.process.stdin.flush()
+
+                while True:
+                    response = self._read_message(timeout)
+                    if response.get('id') == self.request_id:  # skip answers to previously timed out requests
+                        break
+                if 'results' not in response or len(response['results']) != len(connections):
+                    raise OeBBSidecarException("Sidecar answered with an invalid response: %s" % response)
+                return response['results']
+            except (OSError, ValueError, OeBBSidecarException) as err:
+                self._kill()
+                if isinstance(err, OeBBSidecarException):
+                    raise
+                raise OeBBSidecarException("Sidecar failed: %s" % err) from err
+
+    def stop(self):
+        with self.lock:
+            self._kill()
+
+    def _ensure_running(self, timeout):
+        if self.process is not None and self.process.poll() is None:
+            return
+        if self.process is not None:
+            logger.warning("oebb sidecar exited with code %s, restarting" % self.process.returncode)
+            self._kill()
+
+        self.restarts += 1
+        get_metrics().counter('oebb_node_spawns_total', mode='sidecar').inc()
+        self.process = subprocess.Popen(["node", self.script, "--sidecar"], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, shell=False)
+        self.lines = queue.Queue()
+        threading.Thread(target=self._pump, args=(self.process.stdout, self.lines), daemon=True).start()
+        if not self._read_message(timeout).get('ready'):
+            raise OeBBSidecarException("Sidecar did not report ready")
+        logger.info("oebb sidecar started (pid %d, start #%d)" % (self.process.pid, self.restarts))
+
+    def _read_message(self, timeout):
+        try:
+            line = self.lines.get(timeout=timeout)
+        except queue.Empty:
+            raise OeBBSidecarException("Sidecar did not answer within %d seconds" % timeout)
+        if line is None:
+            raise OeBBSidecarException("Sidecar closed stdout")
+        return json.loads(line.decode('utf-8'))
+
+    @staticmethod
+    def _pump(stdout, lines):
+        # reads stdout on its own thread, so reading can time out
+        for line in iter(stdout.readline, b''):
+            lines.put(line)
+        lines.put(None)
+
+    def _kill(self):
+        if self.process is None:
+            return
+        try:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+        except OSError:
+            pass
+        finally:
+            self.process = None
+
+
+def journeys_script():
+    """
+    :return: path of the node script fetching journeys, `REPLAY_SCRIPT` while replaying, see `api.replay`
+    """
+    return REPLAY_SCRIPT if os.environ.get('OEBB_REPLAY_URL') else JOURNEYS_SCRIPT
+
+
+def get_sidecar():
+    """
+    Returns the shared `OeBBSidecar`, it outlives `OeBBApi.reset()` so resets do not leak node processes
+
+    :return: shared `OeBBSidecar`
+    """
+    global sidecar_cache
+    if sidecar_cache is None:
+        sidecar_cache = OeBBSidecar()
+    return sidecar_cache
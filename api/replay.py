@@ -0,0 +1,198 @@
+import base64
+import gzip
+import hashlib
+import io
+import json
+import threading
+import time
+import zlib
+from collections import namedtuple
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+SECRET_PARAMS = ('sender',)  # query parameters never written to an archive, e.g. the Wiener Linien api key
+RECORDED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+JOURNEYS_URL = 'oebb://journeys?from=%s&to=%s'  # ÖBB journeys are recorded as responses of this pseudo url
+
+Recording = namedtuple('Recording', ['time', 'url', 'status', 'headers', 'body'])
+
+
+def archive_key(url):
+    """
+    :return: host, path and sorted query of `url` without `SECRET_PARAMS`, recorded responses are looked up by it
+    """
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in SECRET_PARAMS)
+    return parts.netloc + parts.path + ('?' + urlencode(query) if query else '')
+
+
+class ResponseArchive:
+    """
+    Compact archive of recorded api responses with the time they were received, a gzip compressed file of json lines.
+    Apis answer the same body over and over, so every body is stored once and referenced by its digest.
+    Responses are appended as they are recorded, an archive cut off by a crash can still be read.
+
+    Example lines:
+    {"body": "3f78...", "text": "{\"data\": {\"monitors\": ...}}"}
+    {"time": 1546340400.0, "url": "https://www.wienerlinien.at/ogd_realtime/monitor?rbl=4110", "status": 200,
+     "headers": {"Content-Type": "application/json"}, "body": "3f78..."}
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None  # opened with the first recording
+        self.digests = set()  # digests of the bodies in the archive
+        self.recorded = 0  # responses recorded
+        self.lock = threading.Lock()
+
+    def record(self, url, status, headers, body, at=None):
+        """
+        Appends a response, query parameters in `SECRET_PARAMS` are dropped from `url`
+
+        :param body: `bytes` of the decoded body
+        :param at: time the response was received in seconds since the Epoch, defaults to now
+        """
+        parts = urlsplit(url)
+        query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in SECRET_PARAMS]
+        url = parts._replace(query=urlencode(query, safe=',')).geturl()
+        digest = hashlib.sha1(body).hexdigest()
+        with self.lock:
+            if self.file is None:
+                self._open()
+            if digest not in self.digests:
+                self.digests.add(digest)
+                try:
+                    line = {'body': digest, 'text': body.decode('utf-8')}
+                except UnicodeDecodeError:
+                    line = {'body': digest, 'base64': base64.b64encode(body).decode('ascii')}
+                self.file.write(json.dumps(line) + '\n')
+            self.file.write(json.dumps({'time': time.time() if at is None else at, 'url': url, 'status': status,
+                                        'headers': headers, 'body': digest}) + '\n')
+            self.file.flush()
+            self.recorded += 1
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def _open(self):
+        try:  # appending to an archive, its bodies are referenced instead of stored again
+            self.digests.update(line['body'] for line in self._lines(self.path) if 'time' not in line)
+        except FileNotFoundError:
+            pass
+        self.file = gzip.open(self.path, 'at', encoding='utf-8')  # every run appends a gzip member
+
+    @staticmethod
+    def _lines(path):
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    yield json.loads(line)
+            except (EOFError, zlib.error, ValueError) as err:  # cut off by a crash, keep what was written
+                logger.warning("Caught %s reading %s, ignoring the rest: %s" % (type(err).__name__, path, err))
+
+    @staticmethod
+    def read(path):
+        """
+        :return: `array` of `Recording`s of the archive at `path`, sorted by time, with `bytes` bodies
+        """
+        bodies = {}
+        recordings = []
+        for line in ResponseArchive._lines(path):
+            if 'time' not in line:
+                text = line.get('text')
+                bodies[line['body']] = text.encode('utf-8') if text is not None else base64.b64decode(line['base64'])
+            elif line['body'] in bodies:
+                recordings.append(Recording(line['time'], line['url'], line['status'], line['headers'],
+                                            bodies[line['body']]))
+        recordings.sort(key=lambda r: r.time)
+        return recordings
+
+
+class RecordingTransport:
+    """
+    Wraps an `HttpTransport` and records every response it receives to a `ResponseArchive`, including hedged
+    requests, retries and error responses. `304 Not Modified` is not recorded, the last recorded body still holds.
+    `OeBBApi` records its journeys with `record_journeys()`. Set it as the shared transport with
+    `http_transport.set_transport()`, or with `transport.record` in `config.json`.
+
+    Example:
+    set_transport(RecordingTransport(get_transport(), ResponseArchive('recordings/day.jsonl.gz')))
+    """
+
+    def __init__(self, transport, archive):
+        self.transport = transport  # wrapped `HttpTransport`
+        self.archive = archive
+        transport.session.hooks['response'].append(self._record)
+
+    def fetch(self, api_name, url, parse, *args, **kwargs):
+        return self.transport.fetch(api_name, url, parse, *args, **kwargs)
+
+    def fetch_many(self, api_name, urls, parse, *args, **kwargs):
+        return self.transport.fetch_many(api_name, urls, parse, *args, **kwargs)
+
+    def report(self):
+        return self.transport.report()
+
+    def record_journeys(self, connections, journeys):
+        """
+        Records the journeys json of every connection, see `JOURNEYS_URL`
+        """
+        for connection, connection_journeys in zip(connections, journeys):
+            self.archive.record(JOURNEYS_URL % (connection['from'], connection['to']), 200,
+                                {'Content-Type': 'application/json'}, json.dumps(connection_journeys).encode('utf-8'))
+
+    def _record(self, res, *args, **kwargs):
+        if res.status_code == 304:
+            return res
+        raw = res.raw
+        try:
+            body = res.content  # reads streamed bodies as well, they are parsed from memory afterwards
+        except Exception as err:  # the fetch fails on its own
+            logger.error("Caught %s recording %s: %s" % (type(err).__name__, res.url, err))
+            return res
+        res.raw = io.BytesIO(body)  # streaming parsers read `raw`, the body is decoded already
+        raw.release_conn()
+        try:
+            self.archive.record(res.url, res.status_code,
+                                {k: res.headers[k] for k in RECORDED_HEADERS if k in res.headers}, body)
+        except Exception as err:  # recording must not break the fetch
+            logger.error("Caught %s recording %s: %s" % (type(err).__name__, res.url, err))
+        return res
+
+
+class ReplayTransport:
+    """
+    Wraps a transport and sends every request to a replay server instead of the live api, e.g.
+    `https://www.yr.no/place/...` is requested as `<replay url>/www.yr.no/place/...`. Set it as the shared transport
+    with `http_transport.set_transport()`, or with `transport.replay` in `config.json`, which also points the ÖBB
+    journeys to the replay server. See `benchmarks/replay_server.py`.
+
+    Example:
+    set_transport(ReplayTransport(get_transport(), 'http://127.0.0.1:8080'))
+    """
+
+    def __init__(self, transport, url):
+        self.transport = transport  # wrapped transport, e.g. `HttpTransport`
+        self.url = url.rstrip('/')  # url of the replay server
+
+    def fetch(self, api_name, url, parse, *args, **kwargs):
+        return self.transport.fetch(api_name, self.replay_url(url), parse, *args, **kwargs)
+
+    def fetch_many(self, api_name, urls, parse, *args, **kwargs):
+        return self.transport.fetch_many(api_name, [self.replay_url(url) for url in urls], parse, *args, **kwargs)
+
+    def report(self):
+        return self.transport.report()
+
+    def replay_url(self, url):
+        """
+        :return: url of the replay server serving the recorded responses of `url`
+        """
+        parts = urlsplit(url)
+        return '%s/%s%s%s' % (self.url, parts.netloc, parts.path, '?' + parts.query if parts.query else '')
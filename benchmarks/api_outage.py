@@ -0,0 +1,92 @@
+"""
+Simulates an outage of the Citybike Wien api with a `FaultTransport` while Wiener Linien is served by a local stand-in
+server, and shows that Wiener Linien keeps updating, that Citybike Wien keeps its last good data marked as stale and
+how often the failing api is called with its circuit breaker compared to a fixed retry delay.
+
+Run from the project root:
+python -m benchmarks.api_outage
+"""
+import json
+import os
+import tempfile
+import time
+
+import config
+from api import api_wrlinien, http_transport
+from api.api_citybikewien import CitybikeWienApi
+from api.api_wrlinien import WrLinienApi
+from api.fault_transport import FaultTransport
+from benchmarks.wrlinien_server import WrLinienStandIn
+from records import BikeStation
+from response_cache import ResponseCache
+from scheduler import ApiScheduler, stale_apis
+
+DURATION = 20  # seconds every scenario runs
+BASE_DELAY = 0.25  # seconds, scaled down from the default 10 seconds so the backoff shows within `DURATION`
+MAX_DELAY = 8
+
+
+def _configure(failure_threshold):
+    breaker = {'failureThreshold': failure_threshold, 'baseDelay': BASE_DELAY, 'maxDelay': MAX_DELAY}
+    conf = {
+        'display': {'updateInterval': 59, 'title': 'Benchmark'},
+        'stations': {'avgWaitingTime': 3, 'walkingTime': []},
+        'api': {
+            'wrlinien': {'updateInterval': 1, 'key': 'BENCHMARK', 'rbls': list(range(4000, 4010)), 'breaker': breaker},
+            'citybikewien': {'updateInterval': 1, 'stations': [{'id': 207}], 'breaker': breaker}
+        }
+    }
+    with open(config.CONFIG_PATH, 'w') as f:
+        json.dump(conf, f)
+    config.reload_config()
+
+
+def run(failure_threshold, cache_directory):
+    """
+    :param failure_threshold: failures in a row until the breaker opens, a huge threshold retries every `BASE_DELAY`
+    :return: `dict` with the outcome of the scenario
+    """
+    _configure(failure_threshold)
+    transport = FaultTransport(http_transport.HttpTransport(), {'citybikewien': {'failureRate': 1}})
+    http_transport.set_transport(transport)
+
+    cache = ResponseCache(cache_directory)  # last good data of citybikewien from before the outage
+    cache.store('citybikewien', (BikeStation(207, 'Messe-Prater', 5, 'aktiv'),), time.time(), time.time())
+    scheduler = ApiScheduler({'wrlinien': WrLinienApi(), 'citybikewien': CitybikeWienApi()}, cache)
+    scheduler.start()
+
+    stale_seen = set()
+    deadline = time.time() + DURATION
+    while time.time() < deadline:
+        stale_seen.update(stale_apis(scheduler.snapshots()))
+        time.sleep(0.05)
+    scheduler.stop()
+
+    snapshots = scheduler.snapshots()
+    return {
+        'wrlinien age': time.time() - snapshots['wrlinien'].fetched_at,
+        'citybikewien calls': transport.report()['citybikewien']['faultsInjected'],
+        'citybikewien data kept': snapshots['citybikewien'].data is not None,
+        'stale': ', '.join(sorted(stale_seen)),
+        'breaker': scheduler.breakers()['citybikewien']['state']
+    }
+
+
+def main():
+    server = WrLinienStandIn()
+    server.start()
+    api_wrlinien.MONITOR_URL = server.url + '/ogd_realtime/monitor'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.CONFIG_PATH = os.path.join(tmp, 'config.json')
+        print('citybikewien fails for %d seconds, retry delay %.2f seconds' % (DURATION, BASE_DELAY))
+        for scenario, failure_threshold in (('fixed retry delay', 10 ** 6), ('circuit breaker', 3)):
+            result = run(failure_threshold, tmp)
+            print('%-18s %s' % (scenario, ', '.join('%s: %s' % (k, '%.1f' % v if isinstance(v, float) else v)
+                                                     for k, v in result.items())))
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""
+Recorded api responses the micro-benchmarks in `benchmarks.suite` parse, merge and render, and functions to scale
+them to more stations.
+
+Recording needs the api key, the connections and the places of `config.json`, the node modules of `lib/node` and
+network access. Without them, synthetic responses in the same format as the recorded ones are written, so the
+benchmarks can run anywhere. Either way the fixtures are committed, so baselines of different commits measure the
+same input.
+
+Run from the project root to record the fixtures from the live apis configured in `config.json`:
+python -m benchmarks.fixtures --record
+or to write the synthetic fixtures:
+python -m benchmarks.fixtures
+"""
+import argparse
+import copy
+import json
+import os
+import subprocess
+from datetime import datetime, timedelta, timezone
+from xml.sax.saxutils import quoteattr
+
+FIXTURES_DIRECTORY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+WRLINIEN_FILE = 'wrlinien_monitor.json'  # monitor response of `SYNTHETIC_RBLS` rbls
+CITYBIKEWIEN_FILE = 'citybikewien.xml'  # full station feed
+YRNO_FILE = 'yrno_forecast.xml'  # full `forecast.xml`
+OEBB_FILE = 'oebb_journeys.json'  # `array` of the journeys json of every connection
+
+SYNTHETIC_TIME = datetime(2019, 1, 1, 12, 0, tzinfo=timezone(timedelta(hours=1)))  # server time of the fixtures
+SYNTHETIC_RBLS = 10
+SYNTHETIC_BIKE_STATIONS = 120  # about the size of the real feed
+SYNTHETIC_FORECASTS = 40  # forecasts of the tabular forecast, yr.no sends 6 hour slots for about 10 days
+SYNTHETIC_CONNECTIONS = 2
+SYNTHETIC_JOURNEYS = 5  # journeys per connection, like `lib/node/oebb-journeys.js` requests
+WANTED_BIKE_STATIONS = 5  # stations of the feed the benchmarks look for, per scale
+
+
+def load():
+    """
+    :return: `dict` with the raw `wrlinien` (bytes), `citybikewien` (bytes), `yrno` (bytes) and `oebb` (json)
+             fixtures, missing fixtures are written synthetically first
+    """
+    if not all(os.path.exists(os.path.join(FIXTURES_DIRECTORY, name))
+               for name in (WRLINIEN_FILE, CITYBIKEWIEN_FILE, YRNO_FILE, OEBB_FILE)):
+        synthesize()
+    fixtures = {}
+    for key, name in (('wrlinien', WRLINIEN_FILE), ('citybikewien', CITYBIKEWIEN_FILE), ('yrno', YRNO_FILE)):
+        with open(os.path.join(FIXTURES_DIRECTORY, name), 'rb') as f:
+            fixtures[key] = f.read()
+    with open(os.path.join(FIXTURES_DIRECTORY, OEBB_FILE), 'r') as f:
+        fixtures['oebb'] = json.load(f)
+    return fixtures
+
+
+def scale_wrlinien(raw, factor):
+    """
+    :return: monitor response as bytes with every monitor repeated `factor` times, each copy at a station of its own
+    """
+    response = json.loads(raw)
+    monitors = response['data']['monitors']
+    scaled = list(monitors)
+    for copy_index in range(1, factor):
+        for monitor in monitors:
+            monitor = copy.deepcopy(monitor)
+            monitor['locationStop']['properties']['title'] += ' %d' % copy_index
+            scaled.append(monitor)
+    response['data']['monitors'] = scaled
+    return json.dumps(response).encode('utf-8')
+
+
+def scale_citybikewien(raw, factor):
+    """
+    :return: feed as bytes with every station repeated `factor` times, copies get new ids and names, and the `dict`
+             of `WANTED_BIKE_STATIONS` wanted station ids per copy to `None`, the last station of the feed is always
+             wanted, so the whole feed is parsed
+    """
+    text = raw.decode('utf-8')
+    head, rest = text.split('<station>', 1)
+    stations, tail = ('<station>' + rest).rsplit('</station>', 1)
+    stations += '</station>'
+    ids = [block.split('<id>', 1)[1].split('</id>', 1)[0] for block in stations.split('</station>')[:-1]]
+
+    copies = [stations]
+    wanted = {}
+    step = max(1, len(ids) // WANTED_BIKE_STATIONS)
+    for copy_index in range(factor):
+        offset = copy_index * 100000
+        if copy_index:
+            block = stations
+            for station_id in ids:
+                block = block.replace('<id>%s</id>' % station_id, '<id>%d</id>' % (int(station_id) + offset))
+            copies.append(block.replace('</name>', ' %d</name>' % copy_index))
+        for station_id in ids[step - 1::step][:WANTED_BIKE_STATIONS - 1] + ids[-1:]:
+            wanted[str(int(station_id) + offset)] = None
+    return (head + ''.join(copies) + tail).encode('utf-8'), wanted
+
+
+def scale_oebb(journeys, factor):
+    """
+    :return: journeys json with every connection repeated `factor` times, each copy from a station of its own
+    """
+    scaled = list(journeys)
+    for copy_index in range(1, factor):
+        for connection in journeys:
+            connection = copy.deepcopy(connection)
+            for journey in connection:
+                journey['legs'][0]['origin']['name'] += ' %d' % copy_index
+            scaled.append(connection)
+    return scaled
+
+
+def synthesize():
+    """
+    Writes synthetic fixtures in the format of the live apis to `FIXTURES_DIRECTORY`
+    """
+    from benchmarks.wrlinien_server import monitor, TIME_FORMAT
+
+    server_time = SYNTHETIC_TIME.strftime(TIME_FORMAT)
+    wrlinien = {'data': {'monitors': [monitor(rbl, SYNTHETIC_TIME) for rbl in range(4000, 4000 + SYNTHETIC_RBLS)]},
+                'message': {'value': 'OK', 'messageCode': 1, 'serverTime': server_time}}
+    _write(WRLINIEN_FILE, json.dumps(wrlinien, indent=1).encode('utf-8'))
+    _write(CITYBIKEWIEN_FILE, _synthetic_citybikewien().encode('utf-8'))
+    _write(YRNO_FILE, _synthetic_yrno().encode('utf-8'))
+    _write(OEBB_FILE, json.dumps(_synthetic_oebb(), indent=1).encode('utf-8'))
+
+
+def _synthetic_citybikewien():
+    stations = []
+    for i in range(SYNTHETIC_BIKE_STATIONS):
+        stations.append(
+            '<station><id>%d</id><internal_id>%d</internal_id><name>Station %d</name><boxes>%d</boxes>'
+            '<free_boxes>%d</free_boxes><free_bikes>%d</free_bikes><status>%s</status><description>%s</description>'
+            '<latitude>%.6f</latitude><longitude>%.6f</longitude></station>'
+            % (2001 + i, 1001 + i, i, 20 + i % 10, 20 + i % 10 - i % 13, i % 13, 'aktiv' if i % 17 else 'nicht aktiv',
+               'Ecke Gasse %d' % i, 48.18 + i * 0.001, 16.33 + i * 0.001))
+    return '<?xml version="1.0" encoding="utf-8"?>\n<stations>%s</stations>\n' % '\n'.join(stations)
+
+
+def _synthetic_yrno():
+    fmt = '%Y-%m-%dT%H:%M:%S'
+    start = SYNTHETIC_TIME.replace(tzinfo=None, minute=0)
+    forecasts = []
+    for i in range(SYNTHETIC_FORECASTS):
+        time_from = start + timedelta(hours=6 * i)
+        forecasts.append(
+            '<time from="%s" to="%s" period="%d"><symbol number="%d" numberEx="%d" name=%s var="%02dd"/>'
+            '<precipitation value="%.1f"/><windDirection deg="%.1f" code="%s" name="West"/>'
+            '<windSpeed mps="%.1f" name="Light breeze"/><temperature unit="celsius" value="%d"/>'
+            '<pressure unit="hPa" value="1012.3"/></time>'
+            % (time_from.strftime(fmt), (time_from + timedelta(hours=6)).strftime(fmt), i % 4, 1 + i % 9, 1 + i % 9,
+               quoteattr('Cloudy'), 1 + i % 9, i % 7 * 0.3, 270 + i, ('W', 'WNW', 'NW')[i % 3], 1 + i % 8 * 0.7,
+               -3 + i % 11))
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>\n<weatherdata>'
+        '<location><name>Vienna</name><type>Capital</type><country>Austria</country>'
+        '<timezone id="Europe/Vienna" utcoffsetMinutes="60"/>'
+        '<location altitude="171" latitude="48.20849" longitude="16.37208" geobase="geonames" geobaseid="2761369"/>'
+        '</location>'
+        '<credit><link text="Weather forecast from Yr, delivered by the Norwegian Meteorological Institute and NRK" '
+        'url="http://www.yr.no/place/Austria/Vienna/Vienna/"/></credit>'
+        '<links><link id="xmlSource" url="https://www.yr.no/place/Austria/Vienna/Vienna/forecast.xml"/></links>'
+        '<meta><lastupdate>%s</lastupdate><nextupdate>%s</nextupdate></meta>'
+        '<sun rise="%s" set="%s"/>'
+        '<forecast><text><location name="Vienna"/></text><tabular>%s</tabular></forecast>'
+        '<observations/></weatherdata>\n'
+        % (start.strftime(fmt), (start + timedelta(hours=12)).strftime(fmt),
+           start.replace(hour=7, minute=44).strftime(fmt), start.replace(hour=16, minute=10).strftime(fmt),
+           '\n'.join(forecasts)))
+
+
+def _synthetic_oebb():
+    connections = []
+    for c in range(SYNTHETIC_CONNECTIONS):
+        journeys = []
+        for j in range(SYNTHETIC_JOURNEYS):
+            departure = SYNTHETIC_TIME + timedelta(minutes=4 + j * 7 + c)
+            journeys.append({'type': 'journey', 'legs': [{
+                'origin': {'type': 'station', 'id': str(1290201 + c), 'name': 'Origin %d' % c},
+                'destination': {'type': 'station', 'id': str(1292101 + j % 2), 'name': 'Destination %d' % (j % 2)},
+                'departure': departure.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'arrival': (departure + timedelta(minutes=9)).strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'mode': 'bus' if j == SYNTHETIC_JOURNEYS - 1 else 'train',
+                'public': True,
+                'line': {'type': 'line', 'id': 's-%d' % (1 + c), 'name': 'S %d' % (1 + c), 'mode': 'train',
+                         'product': {'shortName': 'S'}}
+            }], 'price': None})
+        connections.append(journeys)
+    return connections
+
+
+def record():
+    """
+    Records the fixtures from the live apis configured in `config.json` to `FIXTURES_DIRECTORY`
+    """
+    import requests
+
+    from api.api_citybikewien import FEED_URL
+    from api.api_wrlinien import MONITOR_URL
+    from api.oebb_sidecar import JOURNEYS_SCRIPT
+    from utils import get_config
+
+    apis = get_config()['api']
+    res = requests.get(MONITOR_URL, params={'rbl': ','.join(map(str, apis['wrlinien']['rbls'])),
+                                            'sender': apis['wrlinien']['key']}, timeout=30)
+    res.raise_for_status()
+    _write(WRLINIEN_FILE, res.content)
+
+    res = requests.get(FEED_URL, timeout=30)
+    res.raise_for_status()
+    _write(CITYBIKEWIEN_FILE, res.content)
+
+    res = requests.get('https://www.yr.no/place/%s/%s/%s/forecast.xml'
+                       % (apis['yrno']['country'], apis['yrno']['province'], apis['yrno']['city']), timeout=30)
+    res.raise_for_status()
+    _write(YRNO_FILE, res.content)
+
+    journeys = [json.loads(subprocess.check_output(['node', JOURNEYS_SCRIPT, str(c['from']), str(c['to'])],
+                                                   timeout=60).decode('utf-8'))
+                for c in apis['oebb']['connections']]
+    _write(OEBB_FILE, json.dumps(journeys, indent=1).encode('utf-8'))
+
+
+def _write(name, content):
+    os.makedirs(FIXTURES_DIRECTORY, exist_ok=True)
+    with open(os.path.join(FIXTURES_DIRECTORY, name), 'wb') as f:
+        f.write(content)
+    print('wrote %s (%d bytes)' % (os.path.join(FIXTURES_DIRECTORY, name), len(content)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Writes the fixtures of the micro-benchmarks')
+    parser.add_argument('--record', action='store_true', help='record from the live apis in config.json')
+    args = parser.parse_args()
+    if args.record:
+        record()
+    else:
+        synthesize()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+Benchmarks fetching from a local stand-in server with a long latency tail, once without and once with hedged requests.
+Every fetch has a deadline, the latency percentiles, deadline misses and hedges of both runs are printed.
+
+Run from the project root:
+python -m benchmarks.hedging
+"""
+import statistics
+import time
+
+from api.http_transport import HttpTransport
+from benchmarks.wrlinien_server import WrLinienStandIn
+from deadlines import DeadlineExceededException, get_latency_stats
+
+FETCHES = 300
+DEADLINE = 1.5  # seconds every fetch may take
+TAIL_RATE = 0.05  # share of responses that take `TAIL_LATENCY` seconds longer
+TAIL_LATENCY = 2
+
+
+def benchmark(transport, url, api_name, hedge):
+    """
+    :return: sorted seconds every fetch took, including the ones that missed the deadline
+    """
+    timings = []
+    for _ in range(FETCHES):
+        start = time.time()
+        try:
+            transport.fetch(api_name, url, lambda res: res.json(), deadline=start + DEADLINE, hedge=hedge)
+        except DeadlineExceededException:
+            pass
+        timings.append(time.time() - start)
+    return sorted(timings)
+
+
+def main():
+    server = WrLinienStandIn(base_latency=0.02, tail_rate=TAIL_RATE, tail_latency=TAIL_LATENCY)
+    server.start()
+    url = server.url + '/ogd_realtime/monitor?rbl=4000,4001'
+    transport = HttpTransport()
+
+    print('%-10s %7s %7s %7s %7s %7s' % ('mode', 'p50', 'p95', 'p99', 'misses', 'hedges'))
+    for mode, hedge in (('single', False), ('hedged', True)):
+        timings = benchmark(transport, url, 'benchmark-' + mode, hedge)
+        stats = get_latency_stats('benchmark-' + mode)
+        quantiles = statistics.quantiles(timings, n=100)
+        print('%-10s %7.3f %7.3f %7.3f %7d %7d' % (mode, quantiles[49], quantiles[94], quantiles[98],
+                                                   stats.deadline_misses, stats.hedges))
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
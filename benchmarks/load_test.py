@@ -0,0 +1,220 @@
+"""
+Runs recorded api traffic through `main()` offline and measures the end-to-end cycle latency, the CPU time and the
+memory of the display loop.
+
+The archive is served by `benchmarks.replay_server` in a process of its own, `speed` times faster than it was
+recorded, and every interval of the config is divided by `speed`, e.g. a day of traffic runs in 6 minutes at the
+default speed of 240. The display is simulated. Without an archive, a synthetic day of traffic is generated from the
+fixtures of `benchmarks.fixtures` for the apis of the config.
+
+Record an archive with `transport.record` in `config.json`, then run from the project root, the fonts and node
+have to be installed:
+python -m benchmarks.load_test recordings/day.jsonl.gz --config config.json --speed 240 --latency 0.05
+"""
+import argparse
+import copy
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import config
+import metrics
+from benchmarks import fixtures
+
+DEFAULT_SPEED = 240
+SAMPLE_INTERVAL = 1  # seconds between memory samples
+SYNTHETIC_HOURS = 24  # hours of synthetic traffic
+SYNTHETIC_INTERVALS = {'wrlinien': 30, 'oebb': 60, 'citybikewien': 300, 'yrno': 3600}  # seconds between responses
+
+
+def synthetic_archive(path, conf, hours=SYNTHETIC_HOURS):
+    """
+    Writes `hours` of synthetic responses of the apis in `conf` to the archive at `path`, starting at the time of the
+    fixtures
+    """
+    from api.api_citybikewien import FEED_URL
+    from api.api_wrlinien import MONITOR_URL
+    from api.replay import JOURNEYS_URL, ResponseArchive
+    from benchmarks.replay_server import shift_timestamps
+    from benchmarks.wrlinien_server import TIME_FORMAT, monitor
+
+    raw = fixtures.load()
+    apis = conf['api']
+    start = fixtures.SYNTHETIC_TIME.timestamp()
+    archive = ResponseArchive(path)
+    for api_name, interval in SYNTHETIC_INTERVALS.items():
+        if api_name not in apis:
+            continue
+        for at in range(int(start), int(start + hours * 3600), interval):
+            moment = datetime.fromtimestamp(at, fixtures.SYNTHETIC_TIME.tzinfo)
+            if api_name == 'wrlinien':
+                rbls = apis['wrlinien']['rbls']
+                body = json.dumps({'data': {'monitors': [monitor(rbl, moment) for rbl in rbls]},
+                                   'message': {'value': 'OK', 'messageCode': 1,
+                                               'serverTime': moment.strftime(TIME_FORMAT)}}).encode('utf-8')
+                archive.record('%s?rbl=%s' % (MONITOR_URL, ','.join(map(str, rbls))), 200,
+                               {'Content-Type': 'application/json'}, body, at)
+            elif api_name == 'oebb':
+                for i, connection in enumerate(apis['oebb']['connections']):
+                    journeys = raw['oebb'][i % len(raw['oebb'])]
+                    body = shift_timestamps(json.dumps(journeys).encode('utf-8'), at - start)
+                    archive.record(JOURNEYS_URL % (connection['from'], connection['to']), 200,
+                                   {'Content-Type': 'application/json'}, body, at)
+            elif api_name == 'citybikewien':
+                body = raw['citybikewien']
+                for i, station in enumerate(apis['citybikewien']['stations']):  # the configured stations exist
+                    body = body.replace(b'<id>%d</id>' % (2001 + i), b'<id>%d</id>' % station['id'], 1)
+                archive.record(FEED_URL, 200, {'Content-Type': 'text/xml'}, body, at)
+            else:
+                archive.record('https://www.yr.no/place/%s/%s/%s/forecast.xml'
+                               % (apis['yrno']['country'], apis['yrno']['province'], apis['yrno']['city']), 200,
+                               {'Content-Type': 'text/xml'}, shift_timestamps(raw['yrno'], at - start), at)
+    archive.close()
+
+
+def _scale_config(conf, speed, replay_url):
+    """
+    :return: copy of `conf` replaying from `replay_url`, on the simulated display, with every interval divided by
+             `speed`
+    """
+    from config import DEFAULT_BREAKER_POLICY
+
+    conf = copy.deepcopy(conf)
+    conf['display'].update(updateInterval=conf['display']['updateInterval'] / speed, backend='simulated',
+                           bootFrame=False)
+    for api in conf['api'].values():
+        for key in ('updateInterval', 'maxAge', 'deadline', 'cacheTtl'):
+            if key in api:
+                api[key] /= speed
+        breaker = api.setdefault('breaker', {})
+        breaker['baseDelay'] = breaker.get('baseDelay', DEFAULT_BREAKER_POLICY.base_delay) / speed
+        breaker['maxDelay'] = breaker.get('maxDelay', DEFAULT_BREAKER_POLICY.max_delay) / speed
+    conf['cache'] = {'enabled': False}
+    conf['transport'] = {'replay': replay_url}
+    conf.pop('metrics', None)
+    conf.pop('profiling', None)
+    return conf
+
+
+def _rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _start_replay_server(archive, args):
+    command = [sys.executable, '-m', 'benchmarks.replay_server', archive, '--speed', str(args.speed),
+               '--latency', str(args.latency), '--error-rate', str(args.error_rate),
+               '--not-modified-rate', str(args.not_modified_rate), '--seed', '1']
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+    url = process.stdout.readline().decode('utf-8').strip()
+    print(process.stdout.readline().decode('utf-8').strip())
+    return process, url
+
+
+def run(conf, duration):
+    """
+    Runs `main()` with `conf` for `duration` seconds on a daemon thread
+
+    :return: `dict` with the metrics and `array` of `(seconds since start, rss bytes)` samples
+    """
+    import main
+    from api.oebb_sidecar import get_sidecar
+
+    with open(config.CONFIG_PATH, 'w') as f:
+        json.dump(conf, f)
+    config.reload_config()
+    metrics.HISTOGRAM_WINDOW = 10 ** 7  # percentiles of every cycle, not only the latest
+    os.environ['OEBB_REPLAY_URL'] = conf['transport']['replay']
+    if 'oebb' in conf['api']:  # node starts slower than the scaled deadlines, like a sidecar running for a while
+        get_sidecar().journeys([], 10)
+
+    start = time.time()
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    threading.Thread(target=main.main, name='main', daemon=True).start()
+    samples = []
+    while time.time() - start < duration:
+        samples.append((time.time() - start, _rss()))
+        time.sleep(SAMPLE_INTERVAL)
+    cpu_end = resource.getrusage(resource.RUSAGE_SELF)
+    wall = time.time() - start
+
+    get_sidecar().stop()  # node is counted as a child once it ended
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return {
+        'wall': wall,
+        'cpu': cpu_end.ru_utime + cpu_end.ru_stime - cpu_start.ru_utime - cpu_start.ru_stime,
+        'node_cpu': children.ru_utime + children.ru_stime,
+        'max_rss': cpu_end.ru_maxrss * 1024,  # KiB on Linux
+        'samples': samples,
+        'metrics': metrics.get_metrics().to_dict()
+    }
+
+
+def report(result, speed):
+    histograms = {(h['name'], tuple(sorted(h['labels'].items()))): h for h in result['metrics']['histograms']}
+    counters = result['metrics']['counters']
+    cycle = histograms.get(('cycle_seconds', ()), {'count': 0, 'p50': 0, 'p95': 0, 'max': 0})
+    print('\nreplayed %.1f hours in %.0f seconds, %d cycles' % (result['wall'] * speed / 3600, result['wall'],
+                                                              cycle['count']))
+    print('%-32s %9s %9s %9s' % ('latency (ms)', 'p50', 'p95', 'max'))
+    print('%-32s %9.1f %9.1f %9.1f' % ('cycle', cycle['p50'] * 1e3, cycle['p95'] * 1e3, cycle['max'] * 1e3))
+    for (name, labels), h in sorted(histograms.items()):
+        if name in ('stage_seconds', 'api_update_seconds'):
+            print('%-32s %9.1f %9.1f %9.1f' % ('%s %s' % (name.split('_')[0], labels[0][1]), h['p50'] * 1e3,
+                                               h['p95'] * 1e3, h['max'] * 1e3))
+    for counter in sorted(counters, key=lambda c: (c['name'], sorted(c['labels'].items()))):
+        if counter['name'] in ('api_updates_total', 'display_refreshes_total', 'stage_errors_total'):
+            print('%-32s %9d' % ('%s %s' % (counter['name'], ' '.join(counter['labels'].values())), counter['value']))
+
+    rss = [rss for _, rss in result['samples']]
+    warm = rss[len(rss) // 10] if rss else 0  # after startup
+    print('cpu %.1f seconds, %.1f%% of a core, node %.1f seconds'
+          % (result['cpu'], 100 * result['cpu'] / result['wall'], result['node_cpu']))
+    print('rss %.1f MiB after start, %.1f MiB at the end, %.1f MiB peak'
+          % (warm / 2 ** 20, rss[-1] / 2 ** 20 if rss else 0, max(rss + [result['max_rss']]) / 2 ** 20))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs recorded api traffic through main() offline')
+    parser.add_argument('archive', nargs='?', help='archive recorded with `transport.record`, synthetic if missing')
+    parser.add_argument('--config', default='config.json', help='config the archive was recorded with')
+    parser.add_argument('--speed', type=float, default=DEFAULT_SPEED, help='replay seconds per real second')
+    parser.add_argument('--duration', type=float, help='real seconds to run, default until the archive ends')
+    parser.add_argument('--latency', type=float, default=0, help='seconds every response takes longer')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests answered with 503')
+    parser.add_argument('--not-modified-rate', type=float, default=0,
+                        help='share of requests with validators answered with 304')
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        base_conf = json.load(f)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        archive = args.archive
+        if archive is None:
+            archive = os.path.join(tmp, 'synthetic.jsonl.gz')
+            synthetic_archive(archive, base_conf)
+        duration = args.duration
+        if duration is None:
+            from api.replay import ResponseArchive
+            times = [r.time for r in ResponseArchive.read(archive)]
+            duration = (max(times) - min(times)) / args.speed
+
+        server, url = _start_replay_server(archive, args)
+        try:
+            config.CONFIG_PATH = os.path.join(tmp, 'config.json')
+            result = run(_scale_config(base_conf, args.speed, url), duration)
+        finally:
+            server.terminate()
+            server.wait()
+    report(result, args.speed)
+
+
+if __name__ == '__main__':
+    main()
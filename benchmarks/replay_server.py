@@ -0,0 +1,192 @@
+"""
+Local stand-in of every api, serving the responses recorded in a `ResponseArchive` as they were received over time,
+at real or accelerated speed, with injectable latency, errors and `304 Not Modified`.
+
+Point the display at it with `transport.replay` in `config.json`. A request for `<url>/<host>/<path>?<query>` is
+answered with the latest response of `https://<host>/<path>?<query>` recorded until the replay clock, which starts
+at the first recording and runs `speed` times faster than real time. Timestamps in the bodies are shifted from the
+replay clock to now, so departures, forecasts and server times look as fresh as when they were recorded.
+
+Run from the project root, prints the url to use as `transport.replay`:
+python -m benchmarks.replay_server recordings/day.jsonl.gz --speed 60 --port 8080 --latency 0.2 --error-rate 0.05
+"""
+import argparse
+import bisect
+import hashlib
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from api.replay import ResponseArchive, archive_key
+
+TIMESTAMP = re.compile(rb'(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)(?=[.+\-Z"<\s]|$)')  # ISO 8601, local or with offset
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+def shift_timestamps(body, seconds):
+    """
+    :return: `body` with every ISO 8601 timestamp moved by `seconds`, fractions and offsets are kept
+    """
+    delta = timedelta(seconds=round(seconds))
+
+    def shift(match):
+        try:
+            moved = datetime.strptime(match.group(1).decode('ascii'), TIMESTAMP_FORMAT) + delta
+        except ValueError:  # looks like a timestamp, but is none
+            return match.group(0)
+        return moved.strftime(TIMESTAMP_FORMAT).encode('ascii')
+
+    return TIMESTAMP.sub(shift, body)
+
+
+class ReplayServer:
+    """
+    Replays a `ResponseArchive` over HTTP, see the module docstring
+
+    Requests are answered with `503 Service Unavailable` at a random share `error_rate`, and with `304 Not Modified`
+    at a random share `not_modified_rate` if they carry validators. A request with the `ETag` of the current response
+    in `If-None-Match` is answered with `304` like the real server would. Every response takes `latency` seconds
+    longer.
+
+    Example:
+    server = ReplayServer(ResponseArchive.read('recordings/day.jsonl.gz'), speed=60)
+    server.start()
+    url = server.url
+    server.stop()
+    """
+
+    def __init__(self, recordings, speed=1, latency=0, error_rate=0, not_modified_rate=0, shift=True, seed=None,
+                 port=0):
+        self.responses = {}  # archive key -> (sorted times, recordings)
+        for recording in recordings:
+            times, key_recordings = self.responses.setdefault(archive_key(recording.url), ([], []))
+            times.append(recording.time)
+            key_recordings.append(recording)
+        self.first = min((r.time for r in recordings), default=0)  # the replay clock starts here
+        self.last = max((r.time for r in recordings), default=0)
+        self.speed = speed  # replay seconds per real second
+        self.latency = latency  # seconds every response takes longer
+        self.error_rate = error_rate  # share of requests answered with `503`
+        self.not_modified_rate = not_modified_rate  # share of requests with validators answered with `304`
+        self.shift = shift  # shift timestamps in the bodies to now
+        self.random = random.Random(seed)
+        self.started = None  # real time the replay clock started
+        self.stats = {'served': 0, 'notModified': 0, 'errorsInjected': 0, 'notFound': 0}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+
+    def start(self):
+        self.started = time.time()
+        threading.Thread(target=self.server.serve_forever, name='replay', daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def clock(self):
+        """
+        :return: replay time in seconds since the Epoch
+        """
+        return self.first + (time.time() - self.started) * self.speed
+
+    def duration(self):
+        """
+        :return: real seconds until the replay clock passed the last recording
+        """
+        return (self.last - self.first) / self.speed
+
+    def response(self, path, headers):
+        """
+        :param path: requested path with query, `/<host>/<path>?<query>`
+        :param headers: request headers
+        :return: status, response headers and body
+        """
+        now = self.clock()
+        recorded = self.responses.get(archive_key('http:/' + path))
+        if recorded is None:
+            return self._count('notFound', 404, {}, b'no recording of %s' % path.encode('utf-8'))
+        times, recordings = recorded
+        recording = recordings[max(0, bisect.bisect_right(times, now) - 1)]  # before the first one, serve it early
+
+        with self.lock:
+            fail = self.random.random() < self.error_rate
+            not_modified = self.random.random() < self.not_modified_rate
+        if fail:
+            return self._count('errorsInjected', 503, {}, b'injected error')
+
+        response_headers = dict(recording.headers)
+        etag = response_headers.get('ETag')
+        validated = headers.get('If-None-Match') or headers.get('If-Modified-Since')
+        if validated and (not_modified or (etag is not None and headers.get('If-None-Match') == etag)):
+            return self._count('notModified', 304, {k: v for k, v in response_headers.items() if k == 'ETag'}, b'')
+
+        body = recording.body
+        if self.shift:
+            body = shift_timestamps(body, time.time() - now)
+        if etag is None:  # the shifted body changes with every request, only its recording is a version
+            response_headers['ETag'] = '"%s"' % hashlib.sha1(recording.body).hexdigest()[:16]
+        return self._count('served', recording.status, response_headers, body)
+
+    def _count(self, stat, status, headers, body):
+        with self.lock:
+            self.stats[stat] += 1
+        return status, headers, body
+
+    def _handler(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep connections alive
+
+            def do_GET(self):
+                time.sleep(replay.latency)
+                status, headers, body = replay.response(self.path, self.headers)
+                self.send_response(status)
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replays recorded api responses over HTTP')
+    parser.add_argument('archive', help='archive recorded with `transport.record`')
+    parser.add_argument('--port', type=int, default=0, help='port to listen on, default any free port')
+    parser.add_argument('--speed', type=float, default=1, help='replay seconds per real second, default 1')
+    parser.add_argument('--latency', type=float, default=0, help='seconds every response takes longer')
+    parser.add_argument('--error-rate', type=float, default=0, help='share of requests answered with 503')
+    parser.add_argument('--not-modified-rate', type=float, default=0,
+                        help='share of requests with validators answered with 304')
+    parser.add_argument('--no-shift', action='store_true', help='serve the timestamps as recorded')
+    parser.add_argument('--seed', type=int, help='seed of the injected errors and 304s')
+    args = parser.parse_args()
+
+    recordings = ResponseArchive.read(args.archive)
+    server = ReplayServer(recordings, args.speed, args.latency, args.error_rate, args.not_modified_rate,
+                          not args.no_shift, args.seed, args.port)
+    server.start()
+    print(server.url, flush=True)  # first line of the output, read by `benchmarks.load_test`
+    print('replaying %d responses of %d urls over %.0f seconds' % (len(recordings), len(server.responses),
+                                                                  server.duration()), flush=True)
+    try:
+        while True:
+            time.sleep(60)
+            print('replay clock %s, %s' % (time.strftime('%Y-%m-%d %H:%M', time.localtime(server.clock())),
+                                           server.stats), flush=True)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
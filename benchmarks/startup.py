@@ -0,0 +1,128 @@
+"""
+Benchmarks the startup: how long importing `main` takes and which heavy modules it loads, then the time from starting
+the process until the first frame is on the simulated display, with an empty response cache, with a warm
+response cache and with the last frame pushed again right after start (`bootFrame`).
+The Wiener Linien api is served by a local stand-in server.
+
+Run from the project root, the fonts have to be installed:
+python -m benchmarks.startup
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPEAT = 5
+HEAVY_MODULES = ('PIL.Image', 'PIL.ImageFont', 'requests', 'xml.etree.ElementTree', 'api.api_wrlinien',
+                 'api.api_oebb', 'api.api_citybikewien', 'api.api_yrno', 'api.http_transport')
+IMPORT_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import main
+print('import %f' % (time.perf_counter() - start))
+print('loaded ' + ','.join(m for m in sys.argv[1:] if m in sys.modules))
+"""
+
+
+def _configure(directory, boot_frame):
+    conf = {
+        'display': {'updateInterval': 59, 'title': 'Benchmark', 'backend': 'simulated', 'bootFrame': boot_frame},
+        'stations': {'avgWaitingTime': 3, 'walkingTime': []},
+        'cache': {'directory': os.path.join(directory, 'cache')},
+        'api': {'wrlinien': {'updateInterval': 50, 'key': 'BENCHMARK', 'rbls': list(range(4000, 4010))}}
+    }
+    path = os.path.join(directory, 'config.json')
+    with open(path, 'w') as f:
+        json.dump(conf, f)
+    return path
+
+
+def first_frame(config_path):
+    """
+    Runs in the child process: starts `main` with `config_path` and exits as soon as the first frame was pushed
+    """
+    start = float(sys.argv[3])
+    import config
+    config.CONFIG_PATH = config_path
+
+    from benchmarks.wrlinien_server import WrLinienStandIn
+    server = WrLinienStandIn()
+    server.start()
+    from api import api_wrlinien
+    api_wrlinien.MONITOR_URL = server.url + '/ogd_realtime/monitor'
+
+    import main
+    from display.display_driver import UIDriver
+    pushed = threading.Event()
+    push_frame = UIDriver.push_frame
+
+    def timed_push_frame(self, frame):
+        # a frame the display already shows is skipped by the refresh policy, it is on the display nevertheless
+        push_frame(self, frame)
+        if not pushed.is_set():
+            print('first frame %f' % (time.time() - start))  # the log goes to stdout as well
+            pushed.set()
+
+    UIDriver.push_frame = timed_push_frame
+    threading.Thread(target=main.main, daemon=True).start()
+    pushed.wait(60)
+    time.sleep(0.5)  # let the push stage persist the frame
+    os._exit(0)
+
+
+def _time_first_frame(config_path):
+    output = subprocess.run([sys.executable, '-m', 'benchmarks.startup', '--first-frame', config_path,
+                             str(time.time())], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    lines = [line for line in output.stdout.decode().split('\n') if line.startswith('first frame ')]
+    return float(lines[0].split()[2])
+
+
+def benchmark_import():
+    """
+    :return: median seconds to import `main` and the heavy modules it loaded
+    """
+    timings = []
+    loaded = ''
+    for _ in range(REPEAT):
+        output = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT] + list(HEAVY_MODULES), stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, check=True).stdout.decode().split('\n')
+        timings.append(float(next(line for line in output if line.startswith('import ')).split()[1]))
+        loaded = next(line for line in output if line.startswith('loaded '))[len('loaded '):]
+    return statistics.median(timings), loaded or 'none'
+
+
+def benchmark_first_frame(warm, boot_frame):
+    """
+    :param warm: run `main` once before measuring, so the response cache and the last frame exist
+    :return: median seconds from process start to the first pushed frame
+    """
+    timings = []
+    for _ in range(REPEAT):
+        with tempfile.TemporaryDirectory() as tmp:
+            config_path = _configure(tmp, boot_frame)
+            if warm:
+                _time_first_frame(config_path)
+            timings.append(_time_first_frame(config_path))
+    return statistics.median(timings)
+
+
+def main():
+    elapsed, loaded = benchmark_import()
+    print('import main: %.3f seconds, heavy modules loaded: %s' % (elapsed, loaded))
+
+    print('%-34s %9s' % ('first frame', 'seconds'))
+    for scenario, warm, boot_frame in (('cold, empty response cache', False, False),
+                                       ('warm response cache', True, False),
+                                       ('warm response cache, boot frame', True, True)):
+        print('%-34s %9.3f' % (scenario, benchmark_first_frame(warm, boot_frame)))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--first-frame']:
+        first_frame(sys.argv[2])
+    else:
+        main()
@@ -0,0 +1,211 @@
+"""
+Micro-benchmarks of every parse, merge and render path on the recorded fixtures of `benchmarks.fixtures`, each path
+measured in isolation on inputs prepared beforehand.
+
+With `--scale` the fixtures are scaled to more stations, e.g. `--scale 1,10,100` measures 1x to 100x the stations,
+paths that do not depend on the number of stations are only measured once. Results can be saved as a json baseline
+and compared with the baseline of another commit, the run fails if a path got slower than `--threshold`.
+
+Run from the project root, the renderer needs the fonts:
+python -m benchmarks.suite --scale 1,10,100 --save baseline.json
+git checkout other-commit
+python -m benchmarks.suite --scale 1,10,100 --compare baseline.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import config
+from benchmarks import fixtures
+
+ROUNDS = 7  # rounds per path, the median round is reported
+ROUND_SECONDS = 0.05  # min seconds per round, fast paths are called repeatedly per round
+DEFAULT_THRESHOLD = 1.2  # slowdown against the baseline reported as regression
+RENDER_OFFSET = 1  # minutes, like on the e-paper display
+
+
+class _Response:
+    """
+    Stand-in of the `requests.Response` the parsers get, with the fixture in memory
+    """
+
+    def __init__(self, content):
+        self.content = content
+        self.raw = io.BytesIO(content)
+
+    def json(self):
+        return json.loads(self.content)
+
+
+def _configure(wanted):
+    conf = {
+        'display': {'updateInterval': 59, 'title': 'Benchmark', 'renderOffset': RENDER_OFFSET},
+        'stations': {'avgWaitingTime': 3, 'walkingTime': [{'station': 'Station 2000', 'time': 4},
+                                                          {'station': 'Origin 0', 'time': 7}]},
+        'api': {
+            'wrlinien': {'updateInterval': 50, 'key': 'BENCHMARK', 'rbls': list(range(4000, 4010))},
+            'oebb': {'updateInterval': 60, 'connections': [{'from': 1290201, 'to': 1292101}],
+                     'rename': [{'old': 'Destination 1', 'new': 'Floridsdorf'}]},
+            'citybikewien': {'updateInterval': 60, 'stations': [{'id': int(i)} for i in wanted]},
+            'yrno': {'updateInterval': 600, 'country': 'Austria', 'province': 'Vienna', 'city': 'Vienna'}
+        }
+    }
+    with open(config.CONFIG_PATH, 'w') as f:
+        json.dump(conf, f)
+    config.reload_config()
+
+
+def measure(fn):
+    """
+    :return: `dict` with median and min seconds per call of `ROUNDS` rounds
+    """
+    fn()  # warm up, e.g. the sprite cache
+    calls = 1
+    while True:  # calibrate, so a round takes at least `ROUND_SECONDS`
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= ROUND_SECONDS:
+            break
+        calls *= 2 if elapsed <= 0 else max(2, min(10, int(ROUND_SECONDS / elapsed) + 1))
+
+    timings = [elapsed / calls]
+    for _ in range(ROUNDS - 1):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        timings.append((time.perf_counter() - start) / calls)
+    return {'median': statistics.median(timings), 'min': min(timings), 'calls': calls}
+
+
+def cases(raw, factor):
+    """
+    Prepares the inputs of every path at `factor` times the stations of the fixtures
+
+    :return: `array` of `(name, function, scales with the stations)`
+    """
+    from api.api_citybikewien import CitybikeWienApi
+    from api.api_oebb import OeBBApi
+    from api.api_wrlinien import WrLinienApi
+    from api.api_yrno import FORECAST_SLOTS, YRNOApi
+    from departures import upcoming
+    from display.bpm_render import DISPLAY_HEIGHT, DISPLAY_WIDTH, render
+    from display.display_driver import pack_bitplane
+    import main
+
+    wrlinien_raw = fixtures.scale_wrlinien(raw['wrlinien'], factor)
+    citybikewien_raw, wanted = fixtures.scale_citybikewien(raw['citybikewien'], factor)
+    oebb_raw = fixtures.scale_oebb(raw['oebb'], factor)
+    _configure(wanted)
+    rename = config.get_compiled_config().oebb_rename
+
+    wrlinien = WrLinienApi._parse(_Response(wrlinien_raw))
+    citybikewien = CitybikeWienApi._parse_stream(io.BytesIO(citybikewien_raw), wanted)
+    weather = YRNOApi._parse_stream(io.BytesIO(raw['yrno']), FORECAST_SLOTS)
+    oebb = OeBBApi._parse(oebb_raw, rename)
+    display_data = main._to_display_data(wrlinien, oebb, citybikewien)
+    now = wrlinien.last_update + RENDER_OFFSET * 60  # the render time of the e-paper display
+    upcoming_data = upcoming(display_data, now)
+    image_black, image_red = render(upcoming_data, weather, now)
+
+    return [
+        ('parse_wrlinien', lambda: WrLinienApi._parse(_Response(wrlinien_raw)), True),
+        ('parse_citybikewien', lambda: CitybikeWienApi._parse_stream(io.BytesIO(citybikewien_raw), wanted), True),
+        ('parse_yrno', lambda: YRNOApi._parse_stream(io.BytesIO(raw['yrno']), FORECAST_SLOTS), False),
+        ('parse_oebb', lambda: OeBBApi._parse(oebb_raw, rename), True),
+        ('to_display_data', lambda: main._to_display_data(wrlinien, oebb, citybikewien), True),
+        ('render_offset', lambda: upcoming(display_data, now), True),
+        ('render', lambda: render(upcoming_data, weather, now), True),
+        ('pack_bitplane', lambda: (pack_bitplane(image_black, DISPLAY_WIDTH, DISPLAY_HEIGHT),
+                                   pack_bitplane(image_red, DISPLAY_WIDTH, DISPLAY_HEIGHT)), False),
+    ]
+
+
+def run(scales, only=None):
+    """
+    :param scales: factors the stations of the fixtures are scaled by
+    :param only: names of the paths to measure, all if `None`
+    :return: `dict` of `name@factorx` to the measurement
+    """
+    raw = fixtures.load()
+    results = {}
+    for factor in scales:
+        for name, fn, scaled in cases(raw, factor):
+            if (only and name not in only) or (not scaled and factor != scales[0]):
+                continue
+            key = '%s@%dx' % (name, factor) if scaled else name
+            results[key] = measure(fn)
+            print('%-28s %12.1f us %12.1f us min' % (key, results[key]['median'] * 1e6, results[key]['min'] * 1e6))
+    return results
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL, timeout=5,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode('utf-8').strip()
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(results, baseline, threshold):
+    """
+    Prints every path measured in both runs with its slowdown against the baseline
+
+    :return: names of the paths slower than `threshold` times the baseline
+    """
+    print('\ncompared with %s (%s)' % (baseline.get('commit'), time.strftime('%Y-%m-%d %H:%M',
+                                                                          time.localtime(baseline['time']))))
+    print('%-28s %12s %12s %8s' % ('path', 'baseline us', 'now us', 'ratio'))
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline['results']:
+            continue
+        before = baseline['results'][key]['median']
+        ratio = result['median'] / before if before else float('inf')
+        flag = ''
+        if ratio > threshold:
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print('%-28s %12.1f %12.1f %7.2fx%s' % (key, before * 1e6, result['median'] * 1e6, ratio, flag))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks of the parse, merge and render paths')
+    parser.add_argument('--scale', default='1', help='comma separated factors of stations, e.g. 1,10,100')
+    parser.add_argument('--only', help='comma separated names of the paths to measure')
+    parser.add_argument('--save', help='write the results as json baseline to this file')
+    parser.add_argument('--compare', help='compare with the json baseline in this file')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='slowdown reported as regression, default %s' % DEFAULT_THRESHOLD)
+    args = parser.parse_args()
+    scales = [int(factor) for factor in args.scale.split(',')]
+    only = set(args.only.split(',')) if args.only else None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.CONFIG_PATH = os.path.join(tmp, 'config.json')
+        results = run(scales, only)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'commit': _commit(), 'time': time.time(), 'python': platform.python_version(),
+                       'machine': platform.machine(), 'results': results}, f, indent=1)
+        print('saved baseline to %s' % args.save)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmarks fetching Wiener Linien monitors for 10, 100 and 500 rbls from a local stand-in server, once with all rbls in
+a single request and once split into concurrent chunks, then again with the request of the first rbl hanging.
+Failed requests are logged.
+
+Run from the project root:
+python -m benchmarks.wrlinien_chunks
+"""
+import json
+import os
+import statistics
+import tempfile
+import time
+
+import config
+from api import api_wrlinien
+from api.api_wrlinien import WrLinienApi
+from benchmarks.wrlinien_server import WrLinienStandIn
+
+RBL_COUNTS = (10, 100, 500)
+CHUNK_SIZE = 50
+CHUNK_TIMEOUT = 1
+REPEAT = 3
+
+
+def _configure(rbls, chunk_size):
+    conf = {
+        'display': {'updateInterval': 59, 'title': 'Benchmark'},
+        'stations': {'avgWaitingTime': 3, 'walkingTime': []},
+        'api': {'wrlinien': {'updateInterval': 50, 'key': 'BENCHMARK', 'rbls': rbls, 'chunkSize': chunk_size,
+                             'chunkTimeout': CHUNK_TIMEOUT}}
+    }
+    with open(config.CONFIG_PATH, 'w') as f:
+        json.dump(conf, f)
+    config.reload_config()
+
+
+def _run(api):
+    """
+    :return: seconds `api` took to fetch, and its data or the raised exception
+    """
+    start = time.time()
+    api.update()
+    elapsed = time.time() - start
+    if api.exc_info:
+        return elapsed, api.exc_info[1]
+    return elapsed, api.data
+
+
+def _describe(result):
+    if isinstance(result, Exception):
+        return 'failed: %s' % type(result).__name__
+    return '%d stations' % len(result.stations)
+
+
+def benchmark(server, rbl_count, chunk_size, warm_up=False):
+    """
+    :param warm_up: fetch once before measuring, so failing chunks have last good data
+    :return: median seconds of `REPEAT` fetches and the description of the last result
+    """
+    rbls = list(range(4000, 4000 + rbl_count))
+    _configure(rbls, chunk_size)
+    timings = []
+    result = None
+    for _ in range(REPEAT):
+        api = WrLinienApi()
+        if warm_up:
+            server.slow_rbls, slow_rbls = set(), server.slow_rbls
+            _run(api)
+            server.slow_rbls = slow_rbls
+            api.nextUpdate = 0
+        elapsed, result = _run(api)
+        timings.append(elapsed)
+    return statistics.median(timings), _describe(result)
+
+
+def main():
+    server = WrLinienStandIn()
+    server.start()
+    api_wrlinien.MONITOR_URL = server.url + '/ogd_realtime/monitor'
+
+    with tempfile.TemporaryDirectory() as tmp:
+        config.CONFIG_PATH = os.path.join(tmp, 'config.json')
+        print('%5s  %-28s %9s  %s' % ('rbls', 'mode', 'seconds', 'result'))
+        for rbl_count in RBL_COUNTS:
+            for mode, chunk_size in (('single request', rbl_count), ('chunks of %d' % CHUNK_SIZE, CHUNK_SIZE)):
+                elapsed, result = benchmark(server, rbl_count, chunk_size)
+                print('%5d  %-28s %9.3f  %s' % (rbl_count, mode, elapsed, result))
+
+            server.slow_rbls = {4000}  # the request containing the first rbl hangs
+            for mode, chunk_size in (('single request, hangs', rbl_count), ('chunks, first one hangs', CHUNK_SIZE)):
+                elapsed, result = benchmark(server, rbl_count, chunk_size, warm_up=True)
+                print('%5d  %-28s %9.3f  %s' % (rbl_count, mode, elapsed, result))
+            server.slow_rbls = set()
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
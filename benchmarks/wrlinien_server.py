@@ -0,0 +1,115 @@
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+VIENNA = timezone(timedelta(hours=1))
+TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.000%z'
+
+
+def monitor(rbl, now):
+    """
+    Synthetic monitor of one rbl in the format of the Wiener Linien realtime API, two rbls share a station
+
+    :return: `dict` of the monitor
+    """
+    departures = []
+    for i in range(8):
+        planned = now + timedelta(minutes=3 + i * 7 + rbl % 5)
+        departures.append({'departureTime': {
+            'timePlanned': planned.strftime(TIME_FORMAT),
+            'timeReal': (planned + timedelta(seconds=30 * (rbl % 3))).strftime(TIME_FORMAT),
+            'countdown': 3 + i * 7 + rbl % 5
+        }})
+    return {
+        'locationStop': {'properties': {'title': 'Station %d' % (rbl // 2), 'attributes': {'rbl': rbl}}},
+        'lines': [{
+            'name': str(rbl % 70),
+            'towards': 'Direction %d' % (rbl % 2),
+            'barrierFree': True,
+            'trafficjam': False,
+            'departures': {'departure': departures}
+        }]
+    }
+
+
+class WrLinienStandIn:
+    """
+    Local stand-in for the Wiener Linien realtime monitor, serving synthetic monitors for any rbl
+
+    Responses take `base_latency` plus `rbl_latency` per requested rbl, requests containing one of `slow_rbls` take
+    `slow_latency` longer. A random share `tail_rate` of the responses takes `tail_latency` longer, like a server
+    with a long latency tail. Like most servers and proxies, urls longer than `max_url_length` are answered with
+    `414 URI Too Long`.
+
+    Example:
+    server = WrLinienStandIn()
+    server.start()
+    url = server.url + '/ogd_realtime/monitor'
+    server.stop()
+    """
+
+    def __init__(self, base_latency=0.05, rbl_latency=0.002, max_url_length=2048, slow_rbls=(), slow_latency=5,
+                 tail_rate=0, tail_latency=1):
+        self.base_latency = base_latency  # seconds every response takes
+        self.rbl_latency = rbl_latency  # seconds every requested rbl adds to the response time
+        self.max_url_length = max_url_length  # longer urls are answered with `414`
+        self.slow_rbls = set(slow_rbls)  # rbls that make a response `slow_latency` seconds slower
+        self.slow_latency = slow_latency
+        self.tail_rate = tail_rate  # share of responses that are `tail_latency` seconds slower
+        self.tail_latency = tail_latency
+        self.requests = 0  # requests answered
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:%d' % self.server.server_port
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep connections alive
+
+            def do_GET(self):
+                stand_in.requests += 1
+                if len(self.path) > stand_in.max_url_length:
+                    return self._send(414, {'message': {'value': 'URI Too Long'}})
+
+                rbls = [int(r) for r in parse_qs(urlsplit(self.path).query)['rbl'][0].split(',')]
+                delay = stand_in.base_latency + stand_in.rbl_latency * len(rbls)
+                if stand_in.slow_rbls.intersection(rbls):
+                    delay += stand_in.slow_latency
+                if random.random() < stand_in.tail_rate:
+                    delay += stand_in.tail_latency
+                time.sleep(delay)
+
+                now = datetime.now(VIENNA)
+                self._send(200, {
+                    'message': {'value': 'OK', 'serverTime': now.strftime(TIME_FORMAT)},
+                    'data': {'monitors': [monitor(rbl, now) for rbl in rbls]}
+                })
+
+            def _send(self, status, body):
+                payload = json.dumps(body).encode('utf-8')
+                try:
+                    self.send_response(status)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):  # client gave up, e.g. timed out
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -0,0 +1,100 @@
+import random
+import time
+
+from config import get_compiled_config, DEFAULT_BREAKER_POLICY
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+CLOSED = 'closed'  # the api works, it is updated on its own interval
+OPEN = 'open'  # the api failed `failureThreshold` times in a row, it is not called until the backoff passed
+HALF_OPEN = 'half-open'  # the backoff passed, the next update is a trial
+
+
+class CircuitBreaker:
+    """
+    Failure policy of one api, decides when a failed api is updated again
+
+    Every api has its own breaker, so an outage of one api never touches the others. Failures are retried after
+    `base_delay` seconds, until `failure_threshold` updates failed in a row. Then the breaker opens and the api is left
+    alone for an exponentially growing, jittered backoff, so a dead server is not hammered and several displays do
+    not retry in lockstep. After the backoff one trial update either closes the breaker or opens it again with twice
+    the backoff. The api's last good data is kept meanwhile.
+
+    Input:
+    Uses data from `config.json` with the following keys:
+    api (json):                                 api json with the following keys for every api:
+        breaker (json, optional):               circuit breaker json with the following keys:
+            failureThreshold (int, optional):   failures in a row until the breaker opens, default 3
+            baseDelay (number, optional):       seconds until a failed update is retried, default 10
+            maxDelay (number, optional):        max seconds of the backoff, default 900
+
+    Example:
+    breaker = CircuitBreaker('citybikewien')
+    api.update()
+    delay = breaker.record_failure() if api.exc_info else breaker.record_success()
+    """
+
+    def __init__(self, name, policy=None):
+        self.name = name
+        self.policy = policy  # `config.BreakerPolicy`, `None` to look it up in the compiled config on every failure
+        self.state = CLOSED
+        self.failures = 0  # failures in a row
+        self.opened = 0  # times the breaker opened since it was closed the last time
+        self.retry_at = 0  # time of the next update in seconds since the Epoch, while the breaker is open
+
+    def _policy(self):
+        if self.policy is not None:
+            return self.policy
+        return get_compiled_config().breakers.get(self.name, DEFAULT_BREAKER_POLICY)
+
+    def record_success(self):
+        """
+        Closes the breaker after a successful update
+
+        :return: 0, a successful api is updated on its own interval again
+        """
+        if self.state != CLOSED:
+            logger.info("%s recovered after %d failures, closing breaker" % (self.name, self.failures))
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.retry_at = 0
+        return 0
+
+    def record_failure(self, now=None):
+        """
+        Counts a failed update and opens the breaker if the api failed too often in a row
+
+        :param now: time of the failure in seconds since the Epoch, defaults to now
+        :return: seconds until the api should be updated again
+        """
+        now = time.time() if now is None else now
+        policy = self._policy()
+        self.failures += 1
+        if self.state == CLOSED and self.failures < policy.failure_threshold:
+            return policy.base_delay
+
+        backoff = min(policy.max_delay, policy.base_delay * 2 ** self.opened)
+        delay = backoff / 2 + random.uniform(0, backoff / 2)  # equal jitter, never retries right away
+        self.opened += 1
+        self.state = OPEN
+        self.retry_at = now + delay
+        logger.warning("%s failed %d times in a row, breaker open for %d seconds" % (self.name, self.failures, delay))
+        return delay
+
+    def allow(self, now=None):
+        """
+        :param now: time in seconds since the Epoch, defaults to now
+        :return: `True` if the api may be updated, moves an open breaker to half-open once its backoff passed
+        """
+        now = time.time() if now is None else now
+        if self.state == OPEN and now >= self.retry_at:
+            self.state = HALF_OPEN
+        return self.state != OPEN
+
+    def report(self):
+        """
+        :return: `dict` with the state of the breaker
+        """
+        return {'state': self.state, 'failures': self.failures, 'retryAt': self.retry_at}
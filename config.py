@@ -0,0 +1,323 @@
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+CONFIG_PATH = 'config.json'
+CHECK_INTERVAL = 1  # seconds between checks of the config file's mtime
+
+config_cache = None  # caches the compiled `Config`
+config_lock = threading.Lock()
+last_check = 0  # time of the last mtime check in seconds since the Epoch
+failed_mtime = None  # mtime of a config file that failed to load, so it is only reported once
+pinned = False  # `True` while the cached config was set by `set_config`, `CONFIG_PATH` is not watched then
+config_scope = threading.local()  # `config` attribute, the config of the calling thread set by `scoped_config`
+
+# Failure policy of one api, see `circuit_breaker.CircuitBreaker`
+# failure_threshold:    failures in a row until the breaker opens, failures before are retried after `base_delay`
+# base_delay:           seconds until a failed api is updated again, and the first backoff once the breaker opened
+# max_delay:            max seconds of the backoff
+BreakerPolicy = namedtuple('BreakerPolicy', ['failure_threshold', 'base_delay', 'max_delay'])
+
+DEFAULT_BREAKER_POLICY = BreakerPolicy(3, 10, 900)
+
+DEADLINE_SHARE = 0.5  # share of `display.updateInterval` an api update may take by default
+
+# Refresh policies of the display, see `display_driver.UIDriver`
+REFRESH_ALWAYS = 'always'  # refresh on every cycle
+REFRESH_CHANGED = 'changed'  # refresh if the black or red bitplane apart from the clock changed
+REFRESH_HIGHLIGHT = 'highlight'  # refresh if the red bitplane below the header changed, e.g. a highlighted departure
+REFRESH_POLICIES = (REFRESH_ALWAYS, REFRESH_CHANGED, REFRESH_HIGHLIGHT)
+
+
+class ConfigException(Exception):
+    pass
+
+
+class FrozenDict(dict):
+    """
+    Read only `dict`, still serializable with `json`
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("config is read only")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _require(conf, path, types):
+    """
+    :param conf: `dict` to look up `path` in
+    :param path: dot separated keys, e.g. `api.oebb.updateInterval`
+    :param types: allowed type or `tuple` of types of the value
+    :return: value at `path`
+    """
+    types = types if isinstance(types, tuple) else (types,)
+    value = conf
+    for key in path.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            raise ConfigException("missing key `%s`" % path)
+        value = value[key]
+    if not isinstance(value, types) or isinstance(value, bool) and bool not in types:
+        raise ConfigException("key `%s` has invalid value %r" % (path, value))
+    return value
+
+
+class Config:
+    """
+    Compiled, immutable `config.json`
+
+    The config is validated once when it is loaded and lists scanned in hot paths are compiled into lookup structures.
+    A reload builds a new `Config` and swaps it in as a whole, so readers always see one consistent config.
+
+    raw (FrozenDict):                           read only `config.json`, lists are `tuple`s
+    mtime (int):                                mtime of the loaded file in nanoseconds
+    walking_times (FrozenDict):                 station name -> minutes to walk to the station
+    avg_waiting_time (number):                  acceptable minutes to wait at a station
+    oebb_rename (FrozenDict):                   old ÖBB station or direction name -> new name
+    citybikewien_stations (FrozenDict):         citybikewien station id (str) -> rename value or `None`
+    update_intervals (FrozenDict):              `display` and name of every configured api -> update interval in seconds
+    max_ages (FrozenDict):                      name of every configured api -> max age of its data in seconds
+    breakers (FrozenDict):                      name of every configured api -> `BreakerPolicy` of the api
+    deadlines (FrozenDict):                     name of every configured api -> seconds an update of the api may take
+    hedges (FrozenDict):                        name of every configured api -> `True` if slow requests are hedged
+    render_offset (number):                     minutes the displayed times are ahead of the clock
+    """
+    __slots__ = ('raw', 'mtime', 'walking_times', 'avg_waiting_time', 'oebb_rename', 'citybikewien_stations',
+                 'update_intervals', 'max_ages', 'breakers', 'deadlines', 'hedges',
+                 'render_offset')
+
+    def __init__(self, conf, mtime=0):
+        number = (int, float)
+        update_intervals = {'display': _require(conf, 'display.updateInterval', number)}
+        _require(conf, 'display.title', str)
+        render_offset = _require(conf, 'display.renderOffset', number) if 'renderOffset' in conf['display'] else 0
+        if 'refresh' in conf['display']:
+            refresh = _require(conf, 'display.refresh', dict)
+            if 'policy' in refresh and _require(conf, 'display.refresh.policy', str) not in REFRESH_POLICIES:
+                raise ConfigException("key `display.refresh.policy` has to be one of %s" % ', '.join(REFRESH_POLICIES))
+            if 'maxAge' in refresh and _require(conf, 'display.refresh.maxAge', number) <= 0:
+                raise ConfigException("key `display.refresh.maxAge` has to be positive")
+
+        walking_times = {}
+        for walking_time in _require(conf, 'stations.walkingTime', list):
+            walking_times[_require(walking_time, 'station', str)] = _require(walking_time, 'time', number)
+        avg_waiting_time = _require(conf, 'stations.avgWaitingTime', number)
+
+        apis = _require(conf, 'api', dict)
+        max_ages = {}
+        for api_name in apis:
+            update_intervals[api_name] = _require(conf, 'api.%s.updateInterval' % api_name, number)
+            max_ages[api_name] = update_intervals[api_name]
+            if 'maxAge' in apis[api_name]:
+                max_ages[api_name] = _require(conf, 'api.%s.maxAge' % api_name, number)
+
+        oebb_rename = {}
+        if 'oebb' in apis:
+            for connection in _require(conf, 'api.oebb.connections', list):
+                _require(connection, 'from', (int, str))
+                _require(connection, 'to', (int, str))
+            for rename in apis['oebb'].get('rename', []):
+                oebb_rename[_require(rename, 'old', str)] = _require(rename, 'new', str)
+
+        citybikewien_stations = {}
+        if 'citybikewien' in apis:
+            for station in _require(conf, 'api.citybikewien.stations', list):
+                citybikewien_stations[str(_require(station, 'id', (int, str)))] = station.get('rename')
+
+        if 'wrlinien' in apis:
+            _require(conf, 'api.wrlinien.key', str)
+            _require(conf, 'api.wrlinien.rbls', list)
+            if 'chunkSize' in apis['wrlinien'] and _require(conf, 'api.wrlinien.chunkSize', int) < 1:
+                raise ConfigException("key `api.wrlinien.chunkSize` has to be at least 1")
+            if 'chunkTimeout' in apis['wrlinien']:
+                _require(conf, 'api.wrlinien.chunkTimeout', number)
+
+        if 'yrno' in apis:
+            for key in ('country', 'province', 'city'):
+                _require(conf, 'api.yrno.%s' % key, str)
+            if 'forecastSlots' in apis['yrno'] and _require(conf, 'api.yrno.forecastSlots', int) < 1:
+                raise ConfigException("key `api.yrno.forecastSlots` has to be at least 1")
+
+        if 'cache' in conf:
+            _require(conf, 'cache', dict)
+            if 'directory' in conf['cache']:
+                _require(conf, 'cache.directory', str)
+        if 'metrics' in conf:
+            _require(conf, 'metrics', dict)
+            if 'port' in conf['metrics']:
+                _require(conf, 'metrics.port', int)
+            if 'file' in conf['metrics']:
+                _require(conf, 'metrics.file', str)
+        if 'transport' in conf:
+            _require(conf, 'transport', dict)
+            for key in ('record', 'replay'):
+                if key in conf['transport']:
+                    _require(conf, 'transport.' + key, str)
+        if 'profiling' in conf:
+            _require(conf, 'profiling', dict)
+            for key, types in (('enabled', bool), ('cycles', int), ('directory', str), ('keep', int)):
+                if key in conf['profiling']:
+                    _require(conf, 'profiling.' + key, types)
+        for api_name in apis:
+            if 'cacheTtl' in apis[api_name]:
+                _require(conf, 'api.%s.cacheTtl' % api_name, number)
+
+        breakers = {}
+        for api_name in apis:
+            breaker = apis[api_name].get('breaker', {})
+            policy = DEFAULT_BREAKER_POLICY._asdict()
+            for key, field, types in (('failureThreshold', 'failure_threshold', int),
+                                      ('baseDelay', 'base_delay', number), ('maxDelay', 'max_delay', number)):
+                if key in breaker:
+                    policy[field] = _require(conf, 'api.%s.breaker.%s' % (api_name, key), types)
+            if policy['failure_threshold'] < 1:
+                raise ConfigException("key `api.%s.breaker.failureThreshold` has to be at least 1" % api_name)
+            breakers[api_name] = BreakerPolicy(**policy)
+
+        deadlines = {}
+        hedges = {}
+        for api_name in apis:
+            deadlines[api_name] = update_intervals['display'] * DEADLINE_SHARE
+            if 'deadline' in apis[api_name]:
+                deadlines[api_name] = _require(conf, 'api.%s.deadline' % api_name, number)
+            if deadlines[api_name] <= 0:
+                raise ConfigException("key `api.%s.deadline` has to be positive" % api_name)
+            hedges[api_name] = _require(conf, 'api.%s.hedge' % api_name, bool) if 'hedge' in apis[api_name] else False
+
+        self.raw = _freeze(conf)
+        self.mtime = mtime
+        self.walking_times = FrozenDict(walking_times)
+        self.avg_waiting_time = avg_waiting_time
+        self.oebb_rename = FrozenDict(oebb_rename)
+        self.citybikewien_stations = FrozenDict(citybikewien_stations)
+        self.update_intervals = FrozenDict(update_intervals)
+        self.max_ages = FrozenDict(max_ages)
+        self.breakers = FrozenDict(breakers)
+        self.deadlines = FrozenDict(deadlines)
+        self.hedges = FrozenDict(hedges)
+        self.render_offset = render_offset
+
+
+def load_config(path=None, overrides=None):
+    """
+    Loads and compiles the config file at `path`, defaults to `CONFIG_PATH`
+
+    :param overrides: `dict` of top level keys replacing the ones of the file, e.g. the sections a fleet shares
+    :return: new `Config`
+    :raises ConfigException: if the file is no valid json or a key is missing or invalid
+    """
+    with open(path or CONFIG_PATH, 'r') as f:
+        mtime = os.fstat(f.fileno()).st_mtime_ns
+        try:
+            conf = json.load(f)
+        except ValueError as err:
+            raise ConfigException("invalid json: %s" % err)
+    if not isinstance(conf, dict):
+        raise ConfigException("invalid config: %r" % conf)
+    conf.update(overrides or {})
+    return Config(conf, mtime)
+
+
+def get_compiled_config():
+    """
+    Returns the cached `Config`. At most every `CHECK_INTERVAL` seconds the mtime of `config.json` is checked,
+    and if it changed, the config is reloaded. An invalid config file is logged and the last valid config is kept.
+    Cached data of the apis is not touched by a reload.
+    Within `scoped_config`, the scoped config of the calling thread is returned instead.
+
+    :return: cached `Config`
+    """
+    global config_cache, last_check, failed_mtime
+    scoped = getattr(config_scope, 'config', None)
+    if scoped is not None:
+        return scoped
+    now = time.time()
+    if config_cache is not None and (pinned or now - last_check < CHECK_INTERVAL):
+        return config_cache
+
+    with config_lock:
+        if config_cache is None:  # first load, errors are raised
+            config_cache = load_config()
+            last_check = now
+            return config_cache
+
+        if now - last_check >= CHECK_INTERVAL:
+            last_check = now
+            try:
+                mtime = os.stat(CONFIG_PATH).st_mtime_ns
+            except OSError as err:
+                logger.error("Caught OSError checking config: %s, keeping current config" % err)
+                return config_cache
+
+            if mtime != config_cache.mtime and mtime != failed_mtime:
+                try:
+                    config_cache = load_config()
+                    failed_mtime = None
+                    logger.info("reloaded config")
+                except (OSError, ConfigException) as err:
+                    failed_mtime = mtime
+                    logger.error("Caught %s reloading config: %s, keeping current config" % (type(err).__name__, err))
+        return config_cache
+
+
+def reload_config():
+    """
+    Reloads `config.json` right away, errors are raised
+
+    :return: new cached `Config`
+    """
+    global config_cache, last_check, failed_mtime, pinned
+    with config_lock:
+        config_cache = load_config()
+        last_check = time.time()
+        failed_mtime = None
+        pinned = False
+        return config_cache
+
+
+def set_config(config):
+    """
+    Replaces the cached config with `config`, e.g. a config built from several files like the one of a fleet.
+    `CONFIG_PATH` is not watched until the next `reload_config()`, the caller reloads the config itself.
+
+    :param config: `Config`
+    """
+    global config_cache, last_check, failed_mtime, pinned
+    with config_lock:
+        config_cache = config
+        last_check = time.time()
+        failed_mtime = None
+        pinned = True
+
+
+@contextmanager
+def scoped_config(config):
+    """
+    Makes `config` the config of the calling thread within the block, other threads keep the cached config.
+    A fleet renders every display with its own config, while the shared apis run with the config of the fleet.
+
+    Example:
+    with scoped_config(load_config('displays/kitchen.json')):
+        ui_driver.render_frame(traffic_data, weather_data)
+    """
+    last = getattr(config_scope, 'config', None)
+    config_scope.config = config
+    try:
+        yield config
+    finally:
+        config_scope.config = last
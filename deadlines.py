@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import deque
+
+from config import get_compiled_config
+
+LATENCY_WINDOW = 200  # latest latencies per api the percentiles are computed from
+MIN_SAMPLES = 20  # latencies needed before a percentile is trusted, e.g. to hedge requests
+
+latency_stats_cache = {}  # api name -> LatencyStats
+latency_stats_lock = threading.Lock()
+
+
+class DeadlineExceededException(TimeoutError):
+    pass
+
+
+def api_deadline(api_name, now=None):
+    """
+    :param api_name: name of the api in `config.json`
+    :param now: start of the update in seconds since the Epoch, defaults to now
+    :return: time in seconds since the Epoch the update of the api has to be done, see `Config.deadlines`
+    """
+    now = time.time() if now is None else now
+    return now + get_compiled_config().deadlines[api_name]
+
+
+def remaining(api_name, deadline):
+    """
+    :param api_name: name of the api, a missed deadline is recorded in its `LatencyStats`
+    :param deadline: time in seconds since the Epoch
+    :return: seconds left until `deadline`
+    :raises DeadlineExceededException: if the deadline passed
+    """
+    left = deadline - time.time()
+    if left <= 0:
+        get_latency_stats(api_name).record_miss()
+        raise DeadlineExceededException("%s missed its deadline by %.1f seconds" % (api_name, -left))
+    return left
+
+
+class LatencyStats:
+    """
+    Rolling latencies and deadline misses of one api
+
+    Keeps the latest `LATENCY_WINDOW` latencies of successful requests, so the percentiles follow changes of the
+    network or the server within a few cycles.
+    """
+
+    def __init__(self):
+        self.latencies = deque(maxlen=LATENCY_WINDOW)  # seconds of the latest successful requests
+        self.requests = 0  # successful requests measured
+        self.deadline_misses = 0  # updates that ran out of time
+        self.hedges = 0  # hedged second requests sent
+        self.hedges_won = 0  # hedged requests that answered first
+        self.lock = threading.Lock()
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.requests += 1
+
+    def record_miss(self):
+        with self.lock:
+            self.deadline_misses += 1
+
+    def record_hedge(self, won=False):
+        with self.lock:
+            if won:
+                self.hedges_won += 1
+            else:
+                self.hedges += 1
+
+    def percentile(self, percent):
+        """
+        :param percent: percentile to compute, e.g. 95
+        :return: latency in seconds, `None` if fewer than `MIN_SAMPLES` latencies were recorded
+        """
+        with self.lock:
+            latencies = sorted(self.latencies)
+        if len(latencies) < MIN_SAMPLES:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percent / 100))]
+
+    def to_dict(self):
+        percentiles = {'p%d' % p: self.percentile(p) for p in (50, 95, 99)}
+        with self.lock:
+            stats = {'requests': self.requests, 'deadlineMisses': self.deadline_misses, 'hedges': self.hedges,
+                     'hedgesWon': self.hedges_won}
+        stats.update({k: round(v, 3) for k, v in percentiles.items() if v is not None})
+        return stats
+
+
+def get_latency_stats(api_name):
+    """
+    :return: shared `LatencyStats` of the api, it outlives `reset()` of the apis
+    """
+    with latency_stats_lock:
+        if api_name not in latency_stats_cache:
+            latency_stats_cache[api_name] = LatencyStats()
+        return latency_stats_cache[api_name]
+
+
+def latency_report():
+    """
+    :return: `dict` of api name to `dict` of its latency stats
+    """
+    with latency_stats_lock:
+        stats = dict(latency_stats_cache)
+    return {api_name: s.to_dict() for api_name, s in stats.items()}
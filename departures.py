@@ -0,0 +1,67 @@
+DISPLAYED_DEPARTURES = 2  # departures shown per line by the renderer
+
+
+def countdown(departure, now):
+    """
+    :param departure: departure time in seconds since the Epoch
+    :param now: time to count down from in seconds since the Epoch
+    :return: full minutes until `departure`, 0 if it departs within the minute
+    """
+    return max(0, int((departure - now) // 60))
+
+
+def upcoming(transport_data, now):
+    """
+    Drops departures that have passed at `now`, then lines without departures and stations without lines.
+    Stations with a citybikewien station are kept.
+
+    :param transport_data: `Transport` with departure times in seconds since the Epoch
+    :param now: time in seconds since the Epoch
+    :return: new `Transport`, shares unchanged lines with `transport_data`
+    """
+    stations = []
+    for station in transport_data.stations:
+        lines = []
+        for line in station.lines:
+            if line.departures and line.departures[0] >= now:  # departures are sorted, nothing has passed
+                lines.append(line)
+                continue
+            departures = tuple(d for d in line.departures if d >= now)
+            if departures:  # removing lines with no departure time
+                lines.append(line.replace(departures=departures))
+        if lines or station.citybikewien:  # keep citybikewien stations, removing other stations with no lines
+            stations.append(station.replace(lines=tuple(lines)))
+    return transport_data.replace(stations=tuple(stations))
+
+
+def horizon(stations, min_departures=DISPLAYED_DEPARTURES):
+    """
+    Time at which the first line runs out of departures to display, i.e. has fewer than `min_departures` left.
+    Lines that have fewer than `min_departures` already are not counted, fetching again would not help them.
+
+    :param stations: `Station`s with departure times in seconds since the Epoch
+    :return: time in seconds since the Epoch, `None` if no line limits the horizon
+    """
+    times = [line.departures[-min_departures] for station in stations for line in station.lines
+             if len(line.departures) >= min_departures]
+    return min(times) if times else None
+
+
+def next_update(fetched_at, stations, min_interval, max_age, lead=0):
+    """
+    Time of the next fetch of an api with absolute departure times. The countdowns are recomputed locally from the
+    clock in between, so the api is only fetched again when its data is `max_age` seconds old or its horizon runs
+    low, but never earlier than `min_interval` seconds after the last fetch.
+
+    :param fetched_at: time of the last fetch in seconds since the Epoch
+    :param stations: fetched `Station`s
+    :param min_interval: min seconds between fetches, `updateInterval` of the api
+    :param max_age: max seconds real-time data is displayed before it is fetched again
+    :param lead: seconds the display is ahead of the clock, see `renderOffset`
+    :return: time in seconds since the Epoch
+    """
+    update_at = fetched_at + max_age
+    stations_horizon = horizon(stations)
+    if stations_horizon is not None:
+        update_at = min(update_at, stations_horizon - lead)
+    return max(update_at, fetched_at + min_interval)
@@ -0,0 +1,125 @@
+import os
+import threading
+
+from PIL import Image
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+CITYBIKEWIEN_ASSETS_DIR = 'assets/citybikewien/'
+YR_ASSETS_DIR = 'assets/yr/'
+IONICONS_ASSETS_DIR = 'assets/ionicons/'
+
+CITYBIKEWIEN_ICON = 'citybikewien'
+ALERT_ICON = 'alert'
+
+ICON_SIZES = {  # final sizes the renderer draws the icons with
+    CITYBIKEWIEN_ICON: (25, 20),
+    ALERT_ICON: (18, 18),
+    'yr': (35, 35)
+}
+
+atlas_cache = None  # caches the shared IconAtlas
+
+
+class IconAtlas:
+    """
+    Packs every icon the renderer needs, already resized to its final size, into one L-mode atlas image
+
+    Icons are used as masks by `ImageDraw.bitmap`, so only their alpha channel is kept. The atlas is built once
+    on first use and kept in memory, afterwards drawing an icon does neither file I/O nor resampling.
+
+    Example:
+    draw.bitmap((307, 59), get_atlas().icon(CITYBIKEWIEN_ICON), fill=0)
+    draw.bitmap((10, 596), get_atlas().weather_icon('04', True), fill=255)
+    """
+
+    def __init__(self):
+        self.atlas = None  # L-mode image with all icons
+        self.boxes = {}  # icon name -> box of the icon inside the atlas
+        self.icons = {}  # icon name -> L-mode mask, cropped from the atlas once
+        self.weather_icons = {}  # (weather id, is night) -> resolved icon name
+        self.lock = threading.Lock()
+
+    def icon(self, name):
+        """
+        :param name: `CITYBIKEWIEN_ICON`, `ALERT_ICON` or a yr.no icon name like `04n`
+        :return: L-mode mask of the icon in its final size
+        """
+        self._ensure_built()
+        return self.icons[name]
+
+    def weather_icon(self, weather_id, is_night):
+        """
+        Looks up the yr.no icon of `weather_id`, uses the day icon if there is no night icon for the weather type.
+        The lookup is resolved once per weather id and time of day.
+
+        :param weather_id: yr.no symbol id zero padded to 2 `char`s
+        :param is_night: `True` to prefer the night icon
+        :return: L-mode mask of the icon in its final size
+        """
+        self._ensure_built()
+        key = (weather_id, is_night)
+        if key not in self.weather_icons:
+            if is_night and weather_id + 'n' in self.icons:
+                self.weather_icons[key] = weather_id + 'n'
+            elif weather_id in self.icons:
+                self.weather_icons[key] = weather_id
+            else:
+                logger.error("No YR icon named %s found! Have you run the setup script?"
+                             % (YR_ASSETS_DIR + weather_id + '.png'))
+                raise FileNotFoundError(YR_ASSETS_DIR + weather_id + '.png')
+        return self.icons[self.weather_icons[key]]
+
+    def _ensure_built(self):
+        if self.atlas is None:
+            with self.lock:
+                if self.atlas is None:
+                    self._build()
+
+    def _build(self):
+        masks = {
+            CITYBIKEWIEN_ICON: self._load_mask(CITYBIKEWIEN_ASSETS_DIR + 'citybikewien.png',
+                                               ICON_SIZES[CITYBIKEWIEN_ICON]),
+            ALERT_ICON: self._load_mask(IONICONS_ASSETS_DIR + 'ionicons_alert_md.png', ICON_SIZES[ALERT_ICON])
+        }
+        if os.path.isdir(YR_ASSETS_DIR):
+            for file_name in sorted(os.listdir(YR_ASSETS_DIR)):
+                if file_name.endswith('.png'):
+                    masks[file_name[:-len('.png')]] = self._load_mask(YR_ASSETS_DIR + file_name, ICON_SIZES['yr'])
+
+        # pack icons next to each other in one row, they are all about the same height
+        width = sum(mask.size[0] for mask in masks.values())
+        height = max(mask.size[1] for mask in masks.values())
+        atlas = Image.new('L', (width, height), 0)
+        boxes = {}
+        x_offset = 0
+        for name, mask in masks.items():
+            boxes[name] = (x_offset, 0, x_offset + mask.size[0], mask.size[1])
+            atlas.paste(mask, boxes[name][:2])
+            x_offset = x_offset + mask.size[0]
+
+        self.icons = {name: atlas.crop(box) for name, box in boxes.items()}
+        self.boxes = boxes
+        self.atlas = atlas
+        logger.info("built icon atlas with %d icons, %dx%d pixels" % (len(boxes), width, height))
+
+    @staticmethod
+    def _load_mask(path, size):
+        with Image.open(path) as img:
+            img = img.convert('RGBA')
+        # `ImageDraw.bitmap` only uses the alpha channel of RGBA images as mask
+        return img.getchannel('A').resize(size, Image.LANCZOS)
+
+
+def get_atlas():
+    """
+    Returns the shared `IconAtlas`, it is kept in memory across cycles
+
+    :return: shared `IconAtlas`
+    """
+    global atlas_cache
+    if atlas_cache is None:
+        atlas_cache = IconAtlas()
+    return atlas_cache
@@ -2,21 +2,43 @@ from PIL import Image
 from PIL import ImageDraw
 from PIL import ImageFont
 import time
-from utils import get_config, get_logger
+from collections import namedtuple
+from config import get_compiled_config
+from departures import countdown, DISPLAYED_DEPARTURES
+from utils import get_logger
+from .assets import get_atlas, CITYBIKEWIEN_ICON, ALERT_ICON
+from .sprite_cache import get_sprite_cache
 
 logger = get_logger(__name__)
 
 DISPLAY_HEIGHT = 640
 DISPLAY_WIDTH = 384
 DISPLAY_SIZE = (DISPLAY_WIDTH, DISPLAY_HEIGHT)
+HEADER_HEIGHT = 42  # height of the red header with title and server time
+CLOCK_BOX = (305, 0, DISPLAY_WIDTH, HEADER_HEIGHT)  # (left, top, right, bottom) of the render time in the header
+WEATHER_COLUMNS = 2  # forecasts shown in the footer, see `api_yrno.DISPLAYED_SLOTS`
 
-TITLE_FONT = ImageFont.truetype('fonts/Ubuntu-M.ttf', 24)
-MONO_FONT = ImageFont.truetype('fonts/UbuntuMono-R.ttf', 22)
 # ICON_FONT = ImageFont.truetype('fonts/DejaVuSansMono.ttf', 55)
 
-CITYBIKEWIEN_ASSETS_DIR = 'assets/citybikewien/'
-YR_ASSETS_DIR = 'assets/yr/'
-IONICONS_ASSETS_DIR = 'assets/ionicons/'
+# Fonts of the renderer
+# title:    station names, header and error type
+# mono:     lines, directions, countdowns and weather
+Fonts = namedtuple('Fonts', ['title', 'mono'])
+
+fonts_cache = None  # caches the loaded `Fonts`
+
+
+def get_fonts():
+    """
+    Returns the cached `Fonts`, the font files are loaded on first use, so importing the renderer stays cheap
+
+    :return: cached `Fonts`
+    """
+    global fonts_cache
+    if fonts_cache is None:
+        fonts_cache = Fonts(title=ImageFont.truetype('fonts/Ubuntu-M.ttf', 24),
+                            mono=ImageFont.truetype('fonts/UbuntuMono-R.ttf', 22))
+    return fonts_cache
 
 
 def _display_countdown(num):
@@ -26,6 +48,16 @@ def _display_countdown(num):
         return str(num).zfill(2)
 
 
+def _upcoming_forecasts(weather_data, now):
+    """
+    The forecast is reused until yr.no's next update, so slots that already passed are skipped. With fewer slots than
+    `WEATHER_COLUMNS` left, the last columns stay empty
+
+    :return: `array` of the first `WEATHER_COLUMNS` `Forecast`s that did not pass at `now`
+    """
+    return [forecast for forecast in weather_data.forecast if forecast.time_to > now][:WEATHER_COLUMNS]
+
+
 def _format_name(name, length):
     if len(name) > length:
         return name[:(length - 2)] + '…'
@@ -44,8 +76,13 @@ def _format_addr(addr, length):
     return _format_name(addr, length)
 
 
-def render(display_data, weather_data):
-    conf = get_config()
+def render(display_data, weather_data, now, stale=()):
+    config = get_compiled_config()
+    conf = config.raw
+    avg_waiting_time = config.avg_waiting_time
+    atlas = get_atlas()
+    sprites = get_sprite_cache()
+    fonts = get_fonts()
 
     # Setup Image and Draw
     image_black = Image.new('L', DISPLAY_SIZE, 255)  # 255: clear the frame
@@ -57,94 +94,85 @@ def render(display_data, weather_data):
     draw_red.fontmode = "L"  # less antialias of fonts
 
     # Header: Title and Server Time
-    draw_red.rectangle(((0, 0), (DISPLAY_WIDTH, 42)), fill=0)
-    draw_red.text((10, 10), conf['display']['title'], font=TITLE_FONT, fill=255)
-
-    minute_val = time.strftime("%M", display_data['lastUpdate'])
-    hour_val = time.strftime("%H", display_data['lastUpdate'])
-    draw_red.text((305, 10), hour_val, font=TITLE_FONT, fill=255)
-    draw_red.text((336, 10), ":", font=TITLE_FONT, fill=255)
-    draw_red.text((345, 10), minute_val.zfill(2), font=TITLE_FONT, fill=255)
+    draw_red.rectangle(((0, 0), (DISPLAY_WIDTH, HEADER_HEIGHT)), fill=0)
+    sprites.text(draw_red, (10, 10), conf['display']['title'], font=fonts.title, fill=255)
+
+    render_time = time.localtime(now)
+    minute_val = time.strftime("%M", render_time)
+    hour_val = time.strftime("%H", render_time)
+    sprites.text(draw_red, (305, 10), hour_val, font=fonts.title, fill=255)
+    sprites.text(draw_red, (336, 10), ":", font=fonts.title, fill=255)
+    sprites.text(draw_red, (345, 10), minute_val.zfill(2), font=fonts.title, fill=255)
+    if stale:  # an api failed, its last good data is shown
+        draw_red.bitmap((275, 12), atlas.icon(ALERT_ICON), fill=255)
 
     # Main: Public Transport Data
     y_offset = 55
-    for station in sorted(display_data['stations'], key=lambda s: s['name']):
-        if 'citybikewien' in station:
-            draw_red.text((10, y_offset), _format_addr(station['name'], 23), font=TITLE_FONT, fill=0)
-            draw_red.bitmap((307, 4 + y_offset),
-                            Image.open(CITYBIKEWIEN_ASSETS_DIR + 'citybikewien.png').resize((25, 20), Image.ANTIALIAS),
-                            fill=0)
-            draw_red.text((345, 7 + y_offset), station['citybikewien']['bikes'].zfill(2), font=MONO_FONT, fill=0)
+    for station in sorted(display_data.stations, key=lambda s: s.name):
+        if y_offset >= DISPLAY_HEIGHT:  # the remaining stations are below the frame
+            break
+        if station.citybikewien:
+            sprites.text(draw_red, (10, y_offset), _format_addr(station.name, 23), font=fonts.title, fill=0)
+            draw_red.bitmap((307, 4 + y_offset), atlas.icon(CITYBIKEWIEN_ICON), fill=0)
+            sprites.text(draw_red, (345, 7 + y_offset), str(station.citybikewien.bikes).zfill(2), font=fonts.mono,
+                         fill=0)
         else:
-            draw_red.text((10, y_offset), _format_addr(station['name'], 26), font=TITLE_FONT, fill=0)
-
-        if 'lines' in station:
-            for line in sorted(station['lines'], key=lambda l: l['name'] + l['direction']):
-                draw_black.text((10, 35 + y_offset), line['name'], font=MONO_FONT, fill=0)
-
-                line['direction'] = _format_addr(line['direction'], 17)
-                draw_black.text((60, 35 + y_offset), line['direction'], font=MONO_FONT, fill=0)
-
-                if line['trafficJam']:
-                    draw_red.bitmap((270, 38 + y_offset),
-                                    Image.open(IONICONS_ASSETS_DIR + "ionicons_alert_md.png").resize((18, 18),
-                                                                                                     Image.ANTIALIAS),
-                                    fill=0)
-
-                if len(line['departures']) > 0:
-                    if 'walkingTime' in station and station['walkingTime'] + conf['stations']['avgWaitingTime'] >= \
-                            line['departures'][0] >= station['walkingTime']:
-                        draw_red.text((305, 35 + y_offset), _display_countdown(line['departures'][0]), font=MONO_FONT,
-                                      fill=0)
+            sprites.text(draw_red, (10, y_offset), _format_addr(station.name, 26), font=fonts.title, fill=0)
+
+        walking_time = station.walking_time
+        for line in sorted(station.lines, key=lambda l: l.name + l.direction):
+            sprites.text(draw_black, (10, 35 + y_offset), line.name, font=fonts.mono, fill=0)
+
+            direction = _format_addr(line.direction, 17)
+            sprites.text(draw_black, (60, 35 + y_offset), direction, font=fonts.mono, fill=0)
+
+            if line.traffic_jam:
+                draw_red.bitmap((270, 38 + y_offset), atlas.icon(ALERT_ICON), fill=0)
+
+            countdowns = [countdown(d, now) for d in line.departures[:DISPLAYED_DEPARTURES]]
+            if len(countdowns) > 0:
+                if walking_time is not None and walking_time + avg_waiting_time >= \
+                        countdowns[0] >= walking_time:
+                    sprites.text(draw_red, (305, 35 + y_offset), _display_countdown(countdowns[0]),
+                                 font=fonts.mono, fill=0)
+                else:
+                    sprites.text(draw_black, (305, 35 + y_offset), _display_countdown(countdowns[0]),
+                                 font=fonts.mono, fill=0)
+                if len(countdowns) > 1:
+                    if walking_time is not None and walking_time + avg_waiting_time >= \
+                            countdowns[1] >= walking_time:
+                        sprites.text(draw_red, (345, 35 + y_offset), _display_countdown(countdowns[1]),
+                                     font=fonts.mono,
+                                     fill=0)
                     else:
-                        draw_black.text((305, 35 + y_offset), _display_countdown(line['departures'][0]), font=MONO_FONT,
-                                        fill=0)
-                    if len(line['departures']) > 1:
-                        if 'walkingTime' in station and station['walkingTime'] + conf['stations']['avgWaitingTime'] >= \
-                                line['departures'][1] >= station['walkingTime']:
-                            draw_red.text((345, 35 + y_offset), _display_countdown(line['departures'][1]),
-                                          font=MONO_FONT,
-                                          fill=0)
-                        else:
-                            draw_black.text((345, 35 + y_offset), _display_countdown(line['departures'][1]),
-                                            font=MONO_FONT,
-                                            fill=0)
-                y_offset = y_offset + 25
+                        sprites.text(draw_black, (345, 35 + y_offset), _display_countdown(countdowns[1]),
+                                     font=fonts.mono,
+                                     fill=0)
+            y_offset = y_offset + 25
         y_offset = y_offset + 45
 
     # Footer: Weather data
-    if bool(weather_data):
+    if weather_data is not None:
         draw_red.rectangle(((0, 564), (DISPLAY_WIDTH, DISPLAY_HEIGHT)), fill=0)
         fst_row_height = 568
         snd_row_height = 598
-        weather_cols = 2
+        weather_cols = WEATHER_COLUMNS
         x_offset = 0
-        for i in range(0, weather_cols):
+        for forecast in _upcoming_forecasts(weather_data, now):
             if not (int(DISPLAY_WIDTH / weather_cols) + x_offset + 1 >= DISPLAY_WIDTH):
                 draw_red.rectangle(((int(DISPLAY_WIDTH / weather_cols) + x_offset, 564 + 3),
                                     (int(DISPLAY_WIDTH / weather_cols) + 1 + x_offset, DISPLAY_HEIGHT - 3)), fill=255)
-            draw_red.text((10 + x_offset, fst_row_height), time.strftime("%H:%M", weather_data['forecast'][i]['time']['from']),
-                          font=MONO_FONT, fill=255)
-            draw_red.text((int(DISPLAY_WIDTH / weather_cols) - 74 + x_offset, fst_row_height),
-                          weather_data['forecast'][i]['celsius'].rjust(3) + '°C', font=MONO_FONT, fill=255)
-
-            weather_id = str(weather_data['forecast'][i]['symbol']['id']).zfill(2)
-            is_night = weather_data['sun']['rise'] > time.localtime() > weather_data['sun'][
-                'set']  # check if current time is between sunset and sunrise
-            icon = YR_ASSETS_DIR + weather_id + (is_night if '' else 'n') + '.png'  # get specific icon from assets folder
-            try:
-                img = Image.open(icon)
-            except FileNotFoundError:  # if there is no night icon for the weather type, then use day time variant instead
-                try:
-                    img = Image.open(YR_ASSETS_DIR + weather_id + '.png')
-                except FileNotFoundError as err:
-                    logger.error(
-                        "No YR icon named %s found! Have you run the setup script?" % (YR_ASSETS_DIR + weather_id + '.png'))
-                    raise err
-            img = img.convert("RGBA").resize((35, 35), Image.ANTIALIAS)
-            draw_red.bitmap((10 + x_offset, snd_row_height - 2), img, fill=255)
-            draw_red.text((int(DISPLAY_WIDTH / weather_cols) - 99 + x_offset, snd_row_height),
-                          str(weather_data['forecast'][i]['wind']['mps']).rjust(3) + "km/h", font=MONO_FONT, fill=255)
+            sprites.text(draw_red, (10 + x_offset, fst_row_height),
+                         time.strftime("%H:%M", time.localtime(forecast.time_from)),
+                         font=fonts.mono, fill=255)
+            sprites.text(draw_red, (int(DISPLAY_WIDTH / weather_cols) - 74 + x_offset, fst_row_height),
+                         str(forecast.celsius).rjust(3) + '°C', font=fonts.mono, fill=255)
+
+            weather_id = str(forecast.symbol_id).zfill(2)
+            is_night = not weather_data.sun_rise <= now <= weather_data.sun_set  # before sunrise or after sunset
+            draw_red.bitmap((10 + x_offset, snd_row_height - 2), atlas.weather_icon(weather_id, is_night), fill=255)
+            sprites.text(draw_red, (int(DISPLAY_WIDTH / weather_cols) - 99 + x_offset, snd_row_height),
+                         str(forecast.wind_mps).rjust(3) + "km/h", font=fonts.mono, fill=255)
 
             x_offset = x_offset + int(DISPLAY_WIDTH / weather_cols)
 
@@ -155,6 +183,7 @@ def render_exception(err, err_type, msg_list=None):
     if msg_list is None:
         msg_list = []
     import textwrap
+    fonts = get_fonts()
 
     image_black = Image.new('L', DISPLAY_SIZE, 255)  # 255: clear the frame
     draw_black = ImageDraw.Draw(image_black)
@@ -162,14 +191,14 @@ def render_exception(err, err_type, msg_list=None):
     draw_red = ImageDraw.Draw(image_red)
 
     y_offset = 20
-    draw_red.text((10, y_offset), err_type, font=TITLE_FONT, fill=0)
+    draw_red.text((10, y_offset), err_type, font=fonts.title, fill=0)
 
     lines = textwrap.wrap(err, width=36)
 
     y_offset = y_offset + 10
     for line in lines:
         y_offset = y_offset + 25
-        draw_black.text((10, y_offset), line, font=MONO_FONT, fill=0)
+        draw_black.text((10, y_offset), line, font=fonts.mono, fill=0)
 
     if msg_list is not []:
         small_mono_font = ImageFont.truetype('fonts/UbuntuMono-R.ttf', 18)
@@ -1,80 +1,264 @@
-from .bpm_render import render, render_exception
+from .bpm_render import render, render_exception, CLOCK_BOX, DISPLAY_WIDTH, HEADER_HEIGHT
+from .sprite_cache import get_sprite_cache
+from config import get_compiled_config, REFRESH_ALWAYS, REFRESH_CHANGED, REFRESH_HIGHLIGHT
+from departures import upcoming
+from metrics import get_metrics
 from utils import get_config
 from utils import get_logger
+import hashlib
+import threading
 import time
-from lib.waveshare.epd7in5b import EPD
+from collections import namedtuple
+import os
+from PIL import Image
+from response_cache import cache_directory, read_pickle, write_pickle
 
 logger = get_logger(__name__)
 
 
+# A rendered frame on its way to the display
+# image_black, image_red:       rendered bitplanes as L-mode images
+# buffer_black, buffer_red:     packed bitplanes, see `pack_bitplane`, `None` until packed
+# digests:                      digests compared by the refresh policy, see `UIDriver._frame_digests`
+Frame = namedtuple('Frame', ['image_black', 'image_red', 'buffer_black', 'buffer_red', 'digests'])
+
+FRAME_CACHE_FILE = 'last_frame.pickle'  # last pushed frame in the cache directory, see `UIDriver.boot_frame`
+
+
+def pack_bitplane(image, width, height):
+    """
+    Packs a rendered image into the display's bitplane layout, produces the same bytes as the waveshare
+    `EPD.getbuffer`, but lets PIL threshold and bit-pack natively instead of walking every pixel in Python
+
+    Rows of `width` pixels, 8 pixels per byte, most significant bit first, a cleared bit is a colored pixel.
+    Images in portrait orientation are rotated like `EPD.getbuffer` does.
+
+    :param image: rendered image of size `width`x`height` or `height`x`width`
+    :param width: display width in pixels, a multiple of 8
+    :param height: display height in pixels
+    :return: `bytes` of length `width / 8 * height`
+    """
+    image_monocolor = image.convert('1')  # same dithering as `EPD.getbuffer`
+    if image_monocolor.size == (height, width):
+        image_monocolor = image_monocolor.transpose(Image.ROTATE_90)
+    elif image_monocolor.size != (width, height):  # `EPD.getbuffer` leaves the buffer white
+        return bytes([0xFF]) * (width // 8 * height)
+    return image_monocolor.tobytes()
+
+
 class UIDriver:
-    def __init__(self):
+    """
+    Renders traffic and weather data and pushes the frame to the e-paper display
+
+    A full refresh blocks for about 60 seconds and wears the panel, so frames are only pushed when the refresh
+    policy asks for it. The policy compares digests of the bitplanes with the last pushed frame, the clock in the
+    header alone does not count as a change, it is redrawn with the next refresh or after `maxAge`.
+
+    Input:
+    Uses data from `config.json` with the following keys:
+    display (json):                             display json with the following keys:
+        backend (str, optional):                `waveshare` (default), `spi` for bulk SPI writes, see `SpiEPD`,
+                                                `simulated` for the SPI backend on simulated hardware, or `file` to
+                                                write every frame to an image file, see `FileEPD`
+        file (str, optional):                   image file of the `file` backend, default `frame.png`
+        refresh (json, optional):               refresh policy json with the following keys:
+            policy (str, optional):             `always`, `changed` (default) or `highlight`
+            maxAge (number, optional):          refresh at least every `maxAge` minutes, even if the policy would skip
+        bootFrame (bool, optional):             push the last frame again right after start, default `True`
+
+    :param frame_file: file of the last pushed frame in the cache directory, see `boot_frame()`
+    :param labels: labels of the driver's metrics, e.g. the display of a fleet
+    """
+
+    def __init__(self, frame_file=FRAME_CACHE_FILE, labels=None):
         # self.driver = None
-        self.driver = EPD()
-        if self.driver is not None:
-            self.driver.init()
+        self.driver = self._open_driver()
+        self.frame_file = frame_file
+        self.labels = dict(labels or {})
+        self.driver_ready = False  # the driver is initialised with the first frame, not before any data exists
+        self.last_digests = None  # (black, red without clock, red below header) digests of the last pushed frame
+        self.last_refresh = 0  # time of the last pushed frame in seconds since the Epoch
+        self.refreshes_performed = 0  # frames pushed to the display
+        self.refreshes_skipped = 0  # frames not pushed, because the refresh policy skipped them
+        self.lock = threading.Lock()  # only one frame at a time on the e-paper display
 
-    def display(self, traffic_data, weather_data):
+    def display(self, traffic_data, weather_data, stale=()):
         """
         If drivers are loaded, correct traffic_data times and display on e-paper
         else show it on desktop
         :param traffic_data: merged traffic_data with walk times
         :param weather_data: weather_data from api
+        :param stale: names of the apis whose last update failed, their last good data is marked as stale
         """
-        if self.driver is not None:
-            traffic_data = self._adjust_to_render_offset(traffic_data)
-        image_black, image_red = render(traffic_data, weather_data)
-        self._show(image_black, image_red)
+        self.push_frame(self.pack_frame(self.render_frame(traffic_data, weather_data, stale)))
+
+    def render_frame(self, traffic_data, weather_data, stale=()):
+        """
+        Render stage of `display()`, renders both bitplanes for the time the frame will be visible
+
+        :return: `Frame` without packed buffers
+        """
+        now = self._render_time()
+        # countdowns are computed from the departure times, departures passed by now are dropped
+        with get_metrics().timer('render_seconds', **self.labels):
+            image_black, image_red = render(upcoming(traffic_data, now), weather_data, now, stale)
+        logger.info("Sprite Cache Stats: %s" % get_sprite_cache().report())
+        with get_metrics().timer('digest_seconds', **self.labels):
+            digests = self._frame_digests(image_black, image_red)
+        return Frame(image_black, image_red, None, None, digests)
+
+    def pack_frame(self, frame):
+        """
+        Pack stage of `display()`, packs both bitplanes into the display's buffer layout if drivers are loaded
+
+        :return: `Frame` with packed buffers
+        """
+        if self.driver is None:
+            return frame
+        with get_metrics().timer('pack_seconds', **self.labels):
+            return frame._replace(buffer_black=pack_bitplane(frame.image_black, self.driver.width, self.driver.height),
+                                  buffer_red=pack_bitplane(frame.image_red, self.driver.width, self.driver.height))
+
+    def push_frame(self, frame):
+        """
+        Push stage of `display()`, shows the frame if the refresh policy asks for it. Blocks while the e-paper
+        display refreshes
+        """
+        with self.lock:
+            if not self._needs_refresh(frame.digests):
+                self.refreshes_skipped += 1
+                get_metrics().counter('display_refreshes_total', result='skipped', **self.labels).inc()
+                logger.info("skipping refresh, frame did not change. Refresh Stats: %s" % self.report())
+                return
+            with get_metrics().timer('display_push_seconds', **self.labels):  # the e-paper refresh
+                self._show(frame)
+            self.last_digests = frame.digests
+            self.last_refresh = time.time()
+            self._save_frame(frame)
+            self.refreshes_performed += 1
+            get_metrics().counter('display_refreshes_total', result='performed', **self.labels).inc()
+        logger.info("Refresh Stats: %s" % self.report())
+
+    @staticmethod
+    def _open_driver():
+        conf = get_config()
+        backend = conf['display'].get('backend', 'waveshare')
+        if backend == 'waveshare':
+            from lib.waveshare.epd7in5b import EPD  # imported only when used, it opens SPI and GPIO on import
+            return EPD()
+        if backend == 'file':
+            from .epd_file import FileEPD
+            return FileEPD(conf['display'].get('file', 'frame.png'))
+
+        from .epd_spi import open_spi_epd, open_simulated_epd
+        chunk_size = conf['display'].get('spiChunkSize', 4096)
+        speed_hz = conf['display'].get('spiSpeedHz', 4000000)
+        if backend == 'spi':
+            return open_spi_epd(chunk_size, speed_hz)
+        if backend == 'simulated':
+            return open_simulated_epd(chunk_size, speed_hz)
+        raise ValueError("Unknown display backend '%s'" % backend)
+
+    def report(self):
+        """
+        :return: `dict` with the counters of performed and skipped refreshes
+        """
+        return {'performed': self.refreshes_performed, 'skipped': self.refreshes_skipped}
 
     def display_exception(self, err, err_type, msg_list=None):
         if msg_list is None:
             msg_list = []
 
-        if self.driver is not None:
-            self.driver.Clear(0xFF)
         image_black, image_red = render_exception(err, err_type, msg_list)
-        self._show(image_black, image_red)
+        frame = self.pack_frame(Frame(image_black, image_red, None, None, None))
+        with self.lock:
+            if self.driver is not None:
+                self._init_driver()
+                self.driver.Clear(0xFF)
+            self._show(frame)
+            self.last_digests = None  # always refresh the next frame after an exception was displayed
+            self.refreshes_performed += 1
+
+    def _needs_refresh(self, digests):
+        conf = get_config()
+        refresh_conf = conf['display'].get('refresh', {})
+        policy = refresh_conf.get('policy', REFRESH_CHANGED)
+
+        if policy == REFRESH_ALWAYS or self.last_digests is None:
+            return True
+        if 'maxAge' in refresh_conf and time.time() - self.last_refresh >= refresh_conf['maxAge'] * 60:
+            return True
+        if policy == REFRESH_HIGHLIGHT:
+            return digests[2] != self.last_digests[2]
+        return digests[:2] != self.last_digests[:2]
+
+    @staticmethod
+    def _frame_digests(image_black, image_red):
+        # the frame is rotated by 90 degrees, the header with the server time is on the left
+        left, top, right, bottom = CLOCK_BOX
+        red_without_clock = image_red.copy()  # the clock changes every minute, it is redrawn by `maxAge`
+        red_without_clock.paste(255, (top, DISPLAY_WIDTH - right, bottom + 1, DISPLAY_WIDTH - left))
+        red_below_header = image_red.crop((HEADER_HEIGHT + 1, 0) + image_red.size)
+        return tuple(hashlib.md5(image.tobytes()).digest()
+                     for image in (image_black, red_without_clock, red_below_header))
 
-    def _show(self, image_black, image_red):
+    def boot_frame(self):
+        """
+        Loads the last pushed frame from the cache directory, so it can be pushed again right after start while the
+        apis load. With `bootFrame` disabled, the frame is not pushed again, but the refresh policy knows the display
+        still shows it.
+
+        :return: packed `Frame` without images, `None` if there is none or it should not be pushed again
+        """
+        directory = cache_directory()
+        if self.driver is None or directory is None:
+            return None
+        cached = read_pickle(os.path.join(directory, self.frame_file))
+        if cached is None:
+            return None
+
+        frame, last_refresh = cached
+        if get_config()['display'].get('bootFrame', True):
+            return frame
+        with self.lock:
+            self.last_digests = frame.digests
+            self.last_refresh = last_refresh
+        return None
+
+    def _save_frame(self, frame):
+        directory = cache_directory()
+        if self.driver is not None and directory is not None:
+            write_pickle(os.path.join(directory, self.frame_file),
+                         (frame._replace(image_black=None, image_red=None), self.last_refresh))
+
+    def _init_driver(self):
+        if not self.driver_ready:
+            self.driver.init()
+            self.driver_ready = True
+
+    def _show(self, frame):
         if self.driver is not None:
             # show image on e-paper display
-            self.driver.display(self.driver.getbuffer(image_black), self.driver.getbuffer(image_red))
+            self._init_driver()
+            self.driver.display(frame.buffer_black, frame.buffer_red)
         else:
             # show image on monitor
-            image_black.show()
-            image_red.show()
+            frame.image_black.show()
+            frame.image_red.show()
 
-    @staticmethod
-    def _adjust_to_render_offset(transport_data):
+    def _render_time(self):
         """
         Unfortunately the waveshare display takes about 60 seconds to display the information.
-        Therefore the displayed time can be corrected by adding `renderOffset` to the server time minutes and
-        subtracting `renderOffset` from the countdown time
+        Therefore the displayed time and countdowns are computed for `renderOffset` minutes from now, if drivers are
+        loaded
 
         Input:
         Uses data from `config.json` with the following keys:
         display (json):                       display json with the following keys:
-            renderOffset (number, optional):            offset in minutes used to add to displayed server time and subtract countdown
+            renderOffset (number, optional):            offset in minutes the displayed time is ahead of the clock
 
-        :param transport_data
-        :return: time adjusted transport_data
+        :return: time the frame is rendered for in seconds since the Epoch
         """
-
-        conf = get_config()
-        if 'renderOffset' in conf['display']:
-            corrected_seconds = time.mktime(transport_data['lastUpdate']) + conf['display']['renderOffset'] * 60
-            transport_data['lastUpdate'] = time.localtime(corrected_seconds)
-
-            offset_data = []
-            for s in transport_data['stations']:
-                for l in s['lines']:
-                    # subtract `renderOffset` from countdown time
-                    l['departures'] = [d - conf['display']['renderOffset']
-                                       for d in l['departures'] if d - conf['display']['renderOffset'] >= 0]
-                    if not l['departures']:
-                        s['lines'].remove(l)  # removing lines with no departure time
-                if s['lines']:
-                    offset_data.append(s)  # removing stations with no lines
-            return {'stations': offset_data, 'lastUpdate': transport_data['lastUpdate']}
-        else:
-            return transport_data
+        if self.driver is None:
+            return time.time()
+        return time.time() + get_compiled_config().render_offset * 60
@@ -0,0 +1,62 @@
+import os
+import tempfile
+
+from PIL import Image, ImageChops
+
+from .epd_spi import EPD_WIDTH, EPD_HEIGHT
+
+PALETTE = [255, 255, 255, 0, 0, 0, 255, 0, 0]  # white, black and red, like the panel
+
+
+class FileEPD:
+    """
+    Display backend writing every frame to an image file instead of a panel, e.g. for displays of a fleet that are
+    driven remotely or for screenshots. Takes the same packed bitplanes as the e-paper drivers, see
+    `display_driver.pack_bitplane`, the image is in the panel's landscape orientation.
+    The file is replaced atomically, so readers never see half a frame.
+
+    Example:
+    epd = FileEPD('frames/kitchen.png')
+    epd.display(pack_bitplane(image_black, epd.width, epd.height), pack_bitplane(image_red, epd.width, epd.height))
+    """
+
+    def __init__(self, path, width=EPD_WIDTH, height=EPD_HEIGHT):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.frames = 0  # frames written
+
+    def init(self):
+        pass
+
+    def display(self, image_black, image_red):
+        """
+        :param image_black: packed black bitplane, a cleared bit is a black pixel
+        :param image_red: packed red bitplane, a cleared bit is a red pixel, red wins over black
+        """
+        size = (self.width, self.height)
+        frame = Image.new('P', size, 0)
+        frame.putpalette(PALETTE)
+        for color, buffer in ((1, image_black), (2, image_red)):
+            mask = ImageChops.invert(Image.frombytes('1', size, bytes(buffer)).convert('L'))
+            frame.paste(color, mask=mask)
+        self._write(frame)
+
+    def Clear(self, color):
+        pass  # the next frame replaces the file as a whole
+
+    def sleep(self):
+        pass
+
+    def _write(self, frame):
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(self.path) + '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                frame.save(f, 'PNG')
+            os.replace(tmp_path, self.path)  # atomic, readers see the old or the new frame
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.frames += 1
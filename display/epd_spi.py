@@ -0,0 +1,254 @@
+import time
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+EPD_WIDTH = 640
+EPD_HEIGHT = 384
+
+# pins in BCM numbering, same as the waveshare `epdconfig`
+RST_PIN = 17
+DC_PIN = 25
+CS_PIN = 8
+BUSY_PIN = 24
+
+# commands of the 7.5inch e-paper HAT (B)
+POWER_SETTING = 0x01
+POWER_OFF = 0x02
+POWER_ON = 0x04
+PANEL_SETTING = 0x00
+BOOSTER_SOFT_START = 0x06
+DEEP_SLEEP = 0x07
+DATA_START_TRANSMISSION_1 = 0x10
+DISPLAY_REFRESH = 0x12
+PLL_CONTROL = 0x30
+TEMPERATURE_CALIBRATION = 0x41
+VCOM_AND_DATA_INTERVAL_SETTING = 0x50
+TCON_SETTING = 0x60
+TCON_RESOLUTION = 0x61
+VCM_DC_SETTING = 0x82
+FLASH_MODE = 0xE5
+
+# 2 pixels per byte on the wire, 4 bits per pixel
+WIRE_BLACK = 0x0
+WIRE_WHITE = 0x3
+WIRE_RED = 0x4
+
+
+def _build_nibble_table():
+    # (4 black bits << 4 | 4 red bits) -> 2 wire bytes for these 4 pixels, like the loop in the waveshare `display`
+    table = []
+    for index in range(256):
+        black, red = index >> 4, index & 0x0F
+        pixels = []
+        for bit in (0x8, 0x4, 0x2, 0x1):
+            if not red & bit:
+                pixels.append(WIRE_RED)
+            elif not black & bit:
+                pixels.append(WIRE_BLACK)
+            else:
+                pixels.append(WIRE_WHITE)
+        table.append(bytes([pixels[0] << 4 | pixels[1], pixels[2] << 4 | pixels[3]]))
+    return table
+
+
+NIBBLE_TABLE = _build_nibble_table()
+
+
+def interleave_bitplanes(black, red):
+    """
+    Interleaves the packed black and red bitplanes into the 4 bit per pixel stream the panel expects
+
+    :param black: packed black bitplane, see `pack_bitplane`
+    :param red: packed red bitplane, see `pack_bitplane`
+    :return: `bytes` 4 times as long as one bitplane
+    """
+    table = NIBBLE_TABLE
+    return b''.join([table[(b & 0xF0) | (r >> 4)] + table[((b & 0x0F) << 4) | (r & 0x0F)] for b, r in zip(black, red)])
+
+
+class SpiEPD:
+    """
+    Backend for the 7.5inch e-paper HAT (B), a drop-in for the waveshare `EPD` used by `UIDriver`
+
+    The waveshare driver sends every byte with its own `send_data` call and GPIO toggle. This backend interleaves
+    both bitplanes up front and streams the frame with large `spidev` writes of `chunk_size` bytes.
+
+    Input:
+    Uses data from `config.json` with the following keys:
+    display (json):                             display json with the following keys:
+        backend (str, optional):                `waveshare` (default), `spi` or `simulated`
+        spiChunkSize (number, optional):        bytes per `spidev` write, defaults to 4096
+        spiSpeedHz (number, optional):          SPI clock in Hz, defaults to 4000000
+    """
+
+    def __init__(self, spi, gpio, chunk_size=4096, delay=time.sleep):
+        self.width = EPD_WIDTH
+        self.height = EPD_HEIGHT
+        self.spi = spi  # `spidev.SpiDev` like object with `writebytes2`
+        self.gpio = gpio  # `RPi.GPIO` like object
+        self.chunk_size = chunk_size  # bytes per spi write
+        self.delay = delay  # sleeps for seconds, injectable for the simulation
+
+    def init(self):
+        self.gpio.setmode(self.gpio.BCM)
+        self.gpio.setwarnings(False)
+        for pin in (RST_PIN, DC_PIN, CS_PIN):
+            self.gpio.setup(pin, self.gpio.OUT)
+        self.gpio.setup(BUSY_PIN, self.gpio.IN)
+        self.reset()
+
+        self.send_command(POWER_SETTING, [0x37, 0x00])
+        self.send_command(PANEL_SETTING, [0xCF, 0x08])
+        self.send_command(BOOSTER_SOFT_START, [0xC7, 0xCC, 0x28])
+        self.send_command(POWER_ON)
+        self.wait_until_idle()
+        self.send_command(PLL_CONTROL, [0x3C])
+        self.send_command(TEMPERATURE_CALIBRATION, [0x00])
+        self.send_command(VCOM_AND_DATA_INTERVAL_SETTING, [0x77])
+        self.send_command(TCON_SETTING, [0x22])
+        self.send_command(TCON_RESOLUTION, [self.width >> 8, self.width & 0xFF, self.height >> 8, self.height & 0xFF])
+        self.send_command(VCM_DC_SETTING, [0x1E])
+        self.send_command(FLASH_MODE, [0x03])
+        return 0
+
+    def reset(self):
+        for level in (1, 0, 1):
+            self.gpio.output(RST_PIN, level)
+            self.delay(0.2)
+
+    def send_command(self, command, data=None):
+        self.gpio.output(DC_PIN, 0)
+        self.spi.writebytes2(bytes([command]))
+        if data:
+            self.send_data(data)
+
+    def send_data(self, data):
+        self.gpio.output(DC_PIN, 1)
+        data = bytes(data)
+        for i in range(0, len(data), self.chunk_size):
+            self.spi.writebytes2(data[i:i + self.chunk_size])
+
+    def wait_until_idle(self):
+        while self.gpio.input(BUSY_PIN) == 0:  # 0: busy, 1: idle
+            self.delay(0.1)
+
+    def display(self, image_black, image_red):
+        self.send_command(DATA_START_TRANSMISSION_1, interleave_bitplanes(image_black, image_red))
+        self._refresh()
+
+    def Clear(self, color):
+        # same as the waveshare driver, `color` is ignored and the display is cleared to white
+        white = bytes([WIRE_WHITE << 4 | WIRE_WHITE]) * (self.width // 2 * self.height)
+        self.send_command(DATA_START_TRANSMISSION_1, white)
+        self._refresh()
+
+    def sleep(self):
+        self.send_command(POWER_OFF)
+        self.wait_until_idle()
+        self.send_command(DEEP_SLEEP, [0xA5])
+
+    def _refresh(self):
+        self.send_command(POWER_ON)
+        self.send_command(DISPLAY_REFRESH)
+        self.delay(0.1)
+        self.wait_until_idle()
+
+
+class SimulatedSpi:
+    """
+    Stand-in for `spidev.SpiDev`, counts the writes and models the transfer time, so the SPI backend can be run and
+    timed on a plain Linux box
+
+    Every write costs `call_overhead` seconds plus 8 bits per byte at `max_speed_hz`. Only counters are kept by
+    default, with `record` the writes of the last frame are kept as well, starting at its
+    `DATA_START_TRANSMISSION_1` command, so a long running simulation does not grow by a frame per refresh.
+    """
+
+    def __init__(self, max_speed_hz=4000000, call_overhead=0.0001, record=False):
+        self.max_speed_hz = max_speed_hz
+        self.call_overhead = call_overhead  # seconds per write call, syscall and GPIO latency
+        self.record = record  # `True` to keep the writes of the last frame
+        self.gpio = None  # `SimulatedGpio` to read the data/command pin from
+        self.elapsed = 0.0  # simulated seconds spent
+        self.writes = 0  # number of write calls
+        self.bytes_written = 0  # number of bytes written
+        self.transfers = []  # array of (is data, bytes) per write call of the last frame, only with `record`
+        self.data_stream = bytearray()  # data bytes of the last frame, only with `record`
+
+    def writebytes2(self, data):
+        self.writes += 1
+        self.bytes_written += len(data)
+        self.elapsed += self.call_overhead + len(data) * 8 / self.max_speed_hz
+        if self.record:
+            self._record(bytes(data))
+
+    def _record(self, data):
+        is_data = self.gpio is not None and self.gpio.levels.get(DC_PIN) == 1
+        if not is_data and data == bytes([DATA_START_TRANSMISSION_1]):  # a new frame starts, drop the last one
+            self.transfers = []
+            self.data_stream = bytearray()
+        self.transfers.append((is_data, data))
+        if is_data:
+            self.data_stream.extend(data)
+
+    def advance(self, seconds):
+        # used as `delay` of the backend, sleeping only advances the simulated time
+        self.elapsed += seconds
+
+
+class SimulatedGpio:
+    """
+    Stand-in for `RPi.GPIO`, records pin levels, the busy pin always reads idle
+    """
+    BCM = 11
+    OUT = 0
+    IN = 1
+
+    def __init__(self):
+        self.levels = {}  # pin -> last written level
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, pin, mode):
+        pass
+
+    def output(self, pin, level):
+        self.levels[pin] = level
+
+    def input(self, pin):
+        return 1
+
+
+def open_spi_epd(chunk_size=4096, speed_hz=4000000):
+    """
+    Opens the SPI backend on the Raspberry Pi's SPI bus 0, device 0
+
+    :return: `SpiEPD`
+    """
+    import spidev
+    import RPi.GPIO as GPIO
+
+    spi = spidev.SpiDev()
+    spi.open(0, 0)
+    spi.max_speed_hz = speed_hz
+    spi.mode = 0b00
+    return SpiEPD(spi, GPIO, chunk_size)
+
+
+def open_simulated_epd(chunk_size=4096, speed_hz=4000000, record=False):
+    """
+    Opens the SPI backend on simulated SPI and GPIO, for testing and timing without hardware
+
+    :param record: keep the writes of the last frame, see `SimulatedSpi`
+    :return: `SpiEPD`, its `spi` attribute is the `SimulatedSpi`
+    """
+    gpio = SimulatedGpio()
+    spi = SimulatedSpi(speed_hz, record=record)
+    spi.gpio = gpio
+    return SpiEPD(spi, gpio, chunk_size, delay=spi.advance)
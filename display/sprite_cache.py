@@ -0,0 +1,101 @@
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+from PIL import ImageDraw
+
+from utils import get_config
+
+sprite_cache = None  # caches the shared SpriteCache
+
+
+class SpriteCache:
+    """
+    Bounded LRU cache of pre-rasterised text sprites
+
+    Countdowns, line names, station names and directions repeat from frame to frame. Instead of rasterising them
+    with FreeType on every cycle, the glyph mask of a text is rasterised once and afterwards only pasted into the
+    frame with `ImageDraw.bitmap`, which gives the same pixels as `ImageDraw.text`.
+
+    Example:
+    get_sprite_cache().text(draw_black, (305, 90), '07', font=get_fonts().mono, fill=0)
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size  # max number of cached sprites
+        self.sprites = OrderedDict()  # (font, text, fill, fontmode) -> (mask, offset)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def text(self, draw, xy, text, font, fill):
+        """
+        Draws `text` like `draw.text(xy, text, font=font, fill=fill)`
+
+        :param draw: `ImageDraw` to draw on
+        :param xy: upper left corner of the text, integer coordinates
+        :param text: text to draw
+        :param font: `ImageFont` to draw with
+        :param fill: color to draw with
+        """
+        mask, offset = self._get(text, font, fill, draw.fontmode)
+        if mask is not None:
+            draw.bitmap((xy[0] + offset[0], xy[1] + offset[1]), mask, fill=fill)
+
+    def report(self):
+        """
+        :return: `dict` with size and hit rate counters of the cache
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.sprites),
+                'maxSize': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hitRate': round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+    def _get(self, text, font, fill, fontmode):
+        key = (font, text, fill, fontmode)
+        with self.lock:
+            sprite = self.sprites.get(key)
+            if sprite is not None:
+                self.sprites.move_to_end(key)
+                self.hits += 1
+                return sprite
+            self.misses += 1
+
+        sprite = self._rasterise(text, font, fontmode)
+        with self.lock:
+            self.sprites[key] = sprite
+            if len(self.sprites) > self.max_size:
+                self.sprites.popitem(last=False)
+                self.evictions += 1
+        return sprite
+
+    @staticmethod
+    def _rasterise(text, font, fontmode):
+        left, top, right, bottom = ImageDraw.Draw(Image.new('L', (1, 1))).textbbox((0, 0), text, font=font)
+        if right <= left or bottom <= top:  # nothing to draw, e.g. whitespace only
+            return None, (0, 0)
+        # drawing with 255 on 0 leaves exactly the glyph mask
+        mask = Image.new('L', (right - left, bottom - top), 0)
+        draw = ImageDraw.Draw(mask)
+        draw.fontmode = fontmode
+        draw.text((-left, -top), text, font=font, fill=255)
+        return mask, (left, top)
+
+
+def get_sprite_cache():
+    """
+    Returns the shared `SpriteCache`, sized by `display.spriteCacheSize` from `config.json`, defaults to 512
+
+    :return: shared `SpriteCache`
+    """
+    global sprite_cache
+    if sprite_cache is None:
+        sprite_cache = SpriteCache(get_config()['display'].get('spriteCacheSize', 512))
+    return sprite_cache
@@ -0,0 +1,412 @@
+import importlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import traceback
+
+import main
+from config import Config, ConfigException, load_config, scoped_config, set_config
+from display.display_driver import UIDriver
+from metrics import get_metrics, MetricsServer
+from pipeline import Pipeline
+from profiler import get_profiler
+from response_cache import open_response_cache
+from scheduler import ApiScheduler
+from utils import get_config, get_logger
+
+logger = get_logger(__name__)
+
+FLEET_PATH = 'fleet.json'
+SHARED_SECTIONS = ('cache', 'metrics', 'transport', 'profiling')  # sections of the fleet file used by every display
+DISPLAY_NAME = re.compile(r'^[A-Za-z0-9_-]+$')  # display names label metrics and name files
+
+# api name in the display configs -> module and class of the shared api, modules are imported only if configured
+FLEET_API_CLASSES = {
+    "wrlinien": ("api.api_wrlinien", "FleetWrLinienApi"),
+    "oebb": ("api.api_oebb", "FleetOeBBApi"),
+    "citybikewien": ("api.api_citybikewien", "FleetCitybikeWienApi"),
+    "yrno": ("api.api_yrno", "YRNOApi")
+}
+
+
+def load_fleet(path=None):
+    """
+    Loads the fleet file at `path`, defaults to `FLEET_PATH`, and the config of every display
+
+    Input:
+    The fleet file is json with the following keys:
+    displays (json):                            display name -> path of the display's `config.json`, relative to the
+                                                fleet file. Display names may only contain letters, digits, `_` and `-`
+    api (json, optional):                       api name -> json of keys every display's api is run with, e.g. the
+                                                Wiener Linien `key`
+    cache, metrics, transport, profiling (json, optional):  like in `config.json`, for all displays, the sections
+                                                of the display configs are ignored
+
+    :return: fleet json and `dict` of display name -> `Config` of the display
+    :raises ConfigException: if a file is no valid json or a key is missing or invalid
+    """
+    path = path or FLEET_PATH
+    with open(path, 'r') as f:
+        try:
+            fleet = json.load(f)
+        except ValueError as err:
+            raise ConfigException("invalid json: %s" % err)
+    if not isinstance(fleet, dict) or not isinstance(fleet.get('displays'), dict) or not fleet['displays']:
+        raise ConfigException("missing key `displays`")
+    if not isinstance(fleet.get('api', {}), dict):
+        raise ConfigException("key `api` has invalid value %r" % fleet['api'])
+
+    shared = {key: fleet.get(key, {}) for key in SHARED_SECTIONS}
+    configs = {}
+    for name, display_path in fleet['displays'].items():
+        if not DISPLAY_NAME.match(name) or not isinstance(display_path, str):
+            raise ConfigException("key `displays.%s` has invalid value %r" % (name, display_path))
+        try:
+            configs[name] = load_config(os.path.join(os.path.dirname(path), display_path), shared)
+        except ConfigException as err:
+            raise ConfigException("display `%s`: %s" % (name, err))
+    return fleet, configs
+
+
+def _location(config):
+    yrno = config.raw['api']['yrno']
+    return yrno['country'], yrno['province'], yrno['city']
+
+
+def weather_apis(configs, names=None):
+    """
+    Every weather location of the displays is fetched by a `YRNOApi` of its own
+
+    :param configs: `Config`s of the displays
+    :param names: `dict` of the weather apis so far, they keep their names
+    :return: `dict` of `(country, province, city)` -> name of the location's api, `yrno` for the location of the
+             first display, `yrno-2`, `yrno-3`... for the others in order of the displays
+    """
+    names = dict(names or {})
+    for location in [_location(config) for config in configs if 'yrno' in config.raw['api']]:
+        if location not in names:
+            names[location] = 'yrno-%d' % (len(names) + 1) if names else 'yrno'
+    return names
+
+
+def union_config(fleet, configs, weather):
+    """
+    Builds the config the shared apis of a fleet run with. Every api runs once for all displays, with the union of
+    their rbls, connections and stations, the shortest intervals and deadlines of the displays, and the other keys of
+    the first display, overridden by `api` of the fleet file. ÖBB and Citybike Wien stations are not renamed, every
+    display renames its own.
+
+    Example:
+    Displays with the rbls `[4110, 4119]` and `[4119, 2709]`, `updateInterval` 50 and 30, run one `wrlinien` api
+    with the rbls `[2709, 4110, 4119]` and `updateInterval` 30.
+
+    :param fleet: fleet json, see `load_fleet()`
+    :param configs: `dict` of display name -> `Config` of the display
+    :param weather: `dict` of location -> name of its api, see `weather_apis()`
+    :return: `dict` of the config
+    """
+    entries = {}  # shared api name -> `array` of `(Config, api name in the display's config)`
+    for config in configs.values():
+        for api_name in config.raw['api']:
+            entries.setdefault(weather[_location(config)] if api_name == 'yrno' else api_name, []).append(
+                (config, api_name))
+
+    apis = {}
+    for shared_name, api_entries in entries.items():
+        kind = api_entries[0][1]
+        sections = [config.raw['api'][api_name] for config, api_name in api_entries]
+        api = json.loads(json.dumps(sections[0]))  # mutable copy
+        api.update(updateInterval=min(config.update_intervals[api_name] for config, api_name in api_entries),
+                   maxAge=min(config.max_ages[api_name] for config, api_name in api_entries),
+                   deadline=min(config.deadlines[api_name] for config, api_name in api_entries),
+                   hedge=any(config.hedges[api_name] for config, api_name in api_entries))
+        ttls = [section['cacheTtl'] for section in sections if 'cacheTtl' in section]
+        if ttls:
+            api['cacheTtl'] = min(ttls)
+
+        if kind == 'wrlinien':
+            api['rbls'] = sorted({int(rbl) for section in sections for rbl in section['rbls']})
+        elif kind == 'oebb':
+            connections = {}  # (from, to) -> connection, in order of first appearance
+            for section in sections:
+                for connection in section['connections']:
+                    connections.setdefault((str(connection['from']), str(connection['to'])),
+                                           {'from': connection['from'], 'to': connection['to']})
+            api['connections'] = list(connections.values())
+            api.pop('rename', None)
+        elif kind == 'citybikewien':
+            stations = {}  # id (str) -> station, in order of first appearance
+            for section in sections:
+                for station in section['stations']:
+                    stations.setdefault(str(station['id']), {'id': station['id']})
+            api['stations'] = list(stations.values())
+        elif kind == 'yrno' and any('forecastSlots' in section for section in sections):
+            from api.api_yrno import FORECAST_SLOTS
+            api['forecastSlots'] = max(section.get('forecastSlots', FORECAST_SLOTS) for section in sections)
+        api.update(fleet.get('api', {}).get(kind, {}))
+        apis[shared_name] = api
+
+    conf = {key: fleet.get(key, {}) for key in SHARED_SECTIONS}
+    conf.update(display={'title': 'Fleet',
+                         'updateInterval': min(c.update_intervals['display'] for c in configs.values()),
+                         'renderOffset': max(c.render_offset for c in configs.values())},
+                stations={'avgWaitingTime': 0, 'walkingTime': []},
+                api=apis)
+    return conf
+
+
+class FleetDisplay(threading.Thread):
+    """
+    One display of a fleet, runs the display loop of `main.main()` on its own thread, with its own `Config`,
+    `Pipeline` and `UIDriver`. Instead of apis of its own, the display reads the snapshots of the fleet's shared
+    apis and takes its own rbls, connections, stations and weather location from them.
+
+    Errors of a display stay on the display: they are logged, counted in `display_errors_total` with the display's
+    name, and an error caught twice in a row is shown on the display, until the display pushes a frame again. The
+    other displays and the shared apis keep running.
+    """
+
+    def __init__(self, name, config, fleet):
+        threading.Thread.__init__(self, daemon=True)
+        self.name = name
+        self.config = config  # `Config` of the display, replaced on reload
+        self.fleet = fleet
+        self.views = {}  # api name -> (shared data, `Config`, display data) of the last view
+        self.last_exceptions = {}  # exception name -> times caught since the last pushed frame
+        self.pushed = 0  # frames through the push stage when the last exception was caught
+        labels = {'display': name}
+        with scoped_config(config):
+            self.ui_driver = UIDriver('last_frame_%s.pickle' % name, labels)
+        self.pipeline = Pipeline([(stage, self._scoped(fn)) for stage, fn in (
+            ('fetch', self._fetch_snapshots),
+            ('merge', main._merge_snapshots),
+            ('render', lambda data: self.ui_driver.render_frame(*data)),
+            ('pack', self.ui_driver.pack_frame),
+            ('push', self.ui_driver.push_frame)
+        )], labels=labels)
+
+    def _scoped(self, fn):
+        # stages run with the display's config, the shared apis with the fleet's
+        def scoped(item):
+            with scoped_config(self.config):
+                return fn(item)
+        return scoped
+
+    def view(self, snapshots):
+        """
+        :param snapshots: `dict` of shared api name -> `Snapshot` of the fleet's apis
+        :return: `dict` of api name -> `Snapshot` with the display's data, like the apis of `main.main()` publish it.
+                 The data of a display is only taken again from new snapshots or a new config
+        """
+        config = self.config
+        view = {}
+        for api_name in config.raw['api']:
+            shared_name = self.fleet.weather.get(_location(config)) if api_name == 'yrno' else api_name
+            if shared_name not in snapshots:  # configured after the fleet started
+                continue
+            snapshot = snapshots[shared_name]
+            last = self.views.get(api_name)
+            if last is not None and last[0] is snapshot.data and last[1] is config:
+                data = last[2]
+            else:
+                select = getattr(self.fleet.apis[shared_name], 'view', None)  # weather is taken as it is
+                data = select(snapshot.data, config) if select and snapshot.data is not None else snapshot.data
+                self.views[api_name] = (snapshot.data, config, data)
+            view[api_name] = snapshot._replace(data=data)
+        return view
+
+    def _fetch_snapshots(self, tick):
+        scheduler = self.fleet.scheduler
+        if not scheduler.wait_ready(max(self.config.deadlines.values(), default=0)):
+            logger.warning("%s: not every api is ready within its deadline, proceeding without them" % self.name)
+        return main._usable_snapshots(self.view(scheduler.snapshots()))
+
+    def run(self):
+        self.pipeline.start()
+        with scoped_config(self.config):
+            boot_frame = self.ui_driver.boot_frame()
+        if boot_frame is not None:
+            self.pipeline.submit(boot_frame, stage='push')
+
+        while True:
+            with scoped_config(self.config):
+                last_update = time.time()
+                try:
+                    self.pipeline.submit(last_update)
+                    main._wait_for_next_update(last_update, self.pipeline)
+                except Exception as err:
+                    self._handle_error(err)
+                    self.pipeline.clear_errors()
+                    main._sleep_until_next_cycle(last_update)
+
+    def _handle_error(self, err):
+        err_type = type(err).__name__
+        get_metrics().counter('display_errors_total', display=self.name, error=err_type).inc()
+        pushed = self.pipeline.stages[-1].processed
+        if pushed != self.pushed:  # a frame was pushed since the last exception, the display recovered
+            self.pushed = pushed
+            self.last_exceptions.clear()
+        self.last_exceptions[err_type] = self.last_exceptions.get(err_type, 0) + 1
+        if self.last_exceptions[err_type] == 1:
+            logger.error("%s: first time catching %s: %s" % (self.name, err_type, err))
+            return
+        logger.error("%s: caught %s already %d times: %s" % (self.name, err_type, self.last_exceptions[err_type], err))
+        if self.last_exceptions[err_type] > 2:  # still shown on the display
+            return
+
+        err_name = str(err)
+        msg = traceback.format_exc()
+        for key in self.fleet.secrets(self.config):  # censor wrlinien keys on display
+            err_name = err_name.replace(key, "*CENSORED KEY*")
+            msg = msg.replace(key, "*CENSORED KEY*")
+        try:
+            self.ui_driver.display_exception(err_name, err_type, [msg])
+        except Exception as display_err:
+            logger.error("%s: caught %s displaying %s: %s" % (self.name, type(display_err).__name__, err_type,
+                                                              display_err))
+
+    def report(self):
+        """
+        :return: `dict` with the stats of the display's pipeline and refreshes
+        """
+        return {'pipeline': self.pipeline.report(), 'refreshes': self.ui_driver.report()}
+
+
+class Fleet:
+    """
+    Drives many displays from one process, see `load_fleet()` for the fleet file
+
+    Every rbl, ÖBB connection, Citybike Wien feed and weather location the displays show is fetched once by apis
+    shared by all displays, with the config built by `union_config()`. Every display takes its own data from the
+    shared snapshots on its own `FleetDisplay` thread, merges and renders it with its own config and pushes it to its
+    own backend, e.g. the `file` backend for displays driven remotely.
+
+    Changes to the fleet file and the display configs are picked up while running, like `config.json`. Displays
+    added or removed, and apis or weather locations no display had on start, need a restart.
+
+    Example:
+    fleet = Fleet('fleet.json')
+    fleet.start()
+    fleet.run()
+    """
+
+    def __init__(self, path=FLEET_PATH):
+        self.path = path
+        fleet, configs = load_fleet(path)
+        self.paths = list(fleet['displays'].values())  # paths of the display configs, relative to the fleet file
+        self.mtimes = self._mtimes()  # mtimes of the fleet file and the display configs last checked
+        self.weather = weather_apis(configs.values())  # location -> name of the location's weather api
+        self.union = Config(union_config(fleet, configs, self.weather))
+        set_config(self.union)
+
+        self.apis = {}
+        for shared_name in self.union.raw['api']:
+            kind = 'yrno' if shared_name in self.weather.values() else shared_name
+            module_name, class_name = FLEET_API_CLASSES[kind]
+            api_class = getattr(importlib.import_module(module_name), class_name)
+            self.apis[shared_name] = api_class(shared_name) if kind == 'yrno' else api_class()
+        main._configure_transport()
+        self.scheduler = ApiScheduler(self.apis, open_response_cache())
+        self.displays = {name: FleetDisplay(name, config, self) for name, config in configs.items()}
+
+    def start(self):
+        self.scheduler.start()
+        for display in self.displays.values():
+            display.start()
+        self._start_metrics()
+        get_profiler().install_signal_handler()  # `kill -USR1` profiles the next cycles of all displays
+
+    def run(self):
+        """
+        Checks the configs, writes the metrics file and profiles once per shortest display interval, forever
+        """
+        profiler = get_profiler()
+        while True:
+            profiler.cycle()
+            self.reload()
+            main._write_metrics_file()
+            logger.info("Fleet Stats: %s" % self.report())
+            time.sleep(get_config()['display']['updateInterval'])
+
+    def secrets(self, config):
+        """
+        :return: Wiener Linien keys of the display `config` and of the shared api, never shown on a display
+        """
+        keys = set()
+        for conf in (config.raw, self.union.raw):
+            if 'wrlinien' in conf['api'] and conf['api']['wrlinien'].get('key'):
+                keys.add(conf['api']['wrlinien']['key'])
+        return keys
+
+    def reload(self):
+        """
+        Reloads the fleet file and every display config if one of them changed, an invalid file is logged once and
+        the current configs are kept
+        """
+        try:
+            mtimes = self._mtimes()
+        except OSError as err:
+            logger.error("Caught OSError checking fleet: %s, keeping current configs" % err)
+            return
+        if mtimes == self.mtimes:
+            return
+        self.mtimes = mtimes
+
+        try:
+            fleet, configs = load_fleet(self.path)
+            weather = weather_apis(configs.values(), self.weather)
+            conf = union_config(fleet, configs, weather)
+            for shared_name in set(self.apis).difference(conf['api']):  # no display uses it anymore, it keeps running
+                conf['api'][shared_name] = json.loads(json.dumps(self.union.raw['api'][shared_name]))
+            union = Config(conf)
+        except (OSError, ConfigException) as err:
+            logger.error("Caught %s reloading fleet: %s, keeping current configs" % (type(err).__name__, err))
+            return
+
+        if set(configs) != set(self.displays):
+            logger.warning("displays were added or removed, restart the fleet to apply")
+        new_apis = set(conf['api']).difference(self.apis)
+        if new_apis:
+            logger.warning("apis %s are not running, restart the fleet to apply" % ', '.join(sorted(new_apis)))
+        self.union = union
+        set_config(union)
+        for name, display in self.displays.items():
+            if name in configs:
+                display.config = configs[name]
+        self.paths = list(fleet['displays'].values())
+        logger.info("reloaded fleet")
+
+    def _mtimes(self):
+        # mtimes of the fleet file and the display configs of the last loaded fleet file
+        paths = [self.path] + [os.path.join(os.path.dirname(self.path), p) for p in self.paths]
+        return tuple(os.stat(p).st_mtime_ns for p in paths)
+
+    def _start_metrics(self):
+        metrics = get_metrics()
+        metrics.add_collector(lambda: main._api_samples(self.scheduler))
+        for display in self.displays.values():
+            metrics.add_collector(display.pipeline.collect_metrics)
+        conf = get_config()
+        if 'port' in conf.get('metrics', {}):
+            MetricsServer(metrics, conf['metrics']['port']).start()
+
+    def report(self):
+        """
+        :return: `dict` of display name -> report of the display
+        """
+        return {name: display.report() for name, display in self.displays.items()}
+
+
+def fleet_main(path=FLEET_PATH):
+    logger.info("Fleet Start!")
+    fleet = Fleet(path)
+    logger.info("driving displays %s with apis %s" % (', '.join(sorted(fleet.displays)), ', '.join(fleet.apis)))
+    fleet.start()
+    fleet.run()
+
+
+if __name__ == "__main__":
+    fleet_main(sys.argv[1] if len(sys.argv) > 1 else FLEET_PATH)
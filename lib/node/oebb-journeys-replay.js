@@ -0,0 +1,53 @@
+// stand-in of oebb-journeys.js for replays, same arguments and sidecar protocol, but the journeys are the ones
+// recorded in a replay archive, served by the replay server in OEBB_REPLAY_URL (see api/replay.py)
+const http = require('http');
+const readline = require('readline');
+
+const replayUrl = process.env.OEBB_REPLAY_URL;
+
+const journeys = (origin, destination) => new Promise((resolve, reject) => {
+    const url = replayUrl + '/journeys?from=' + encodeURIComponent(origin) + '&to=' + encodeURIComponent(destination);
+    http.get(url, res => {
+        let body = '';
+        res.setEncoding('utf8');
+        res.on('data', chunk => body += chunk);
+        res.on('end', () => {
+            if (res.statusCode !== 200) {
+                reject(new Error('replay server answered ' + res.statusCode));
+                return;
+            }
+            try {
+                resolve(JSON.parse(body));
+            } catch (err) {
+                reject(err);
+            }
+        });
+    }).on('error', reject);
+});
+
+const write = message => process.stdout.write(JSON.stringify(message) + '\n');
+
+if (process.argv[2] === '--sidecar') {
+    const rl = readline.createInterface({ input: process.stdin, terminal: false });
+    rl.on('line', line => {
+        let request;
+        try {
+            request = JSON.parse(line);
+        } catch (err) {
+            write({ id: null, error: 'invalid request: ' + err.message });
+            return;
+        }
+        Promise.all((request.connections || []).map(c => journeys(String(c.from), String(c.to))
+            .then(res => ({ journeys: res }), err => ({ error: String((err && err.message) || err) }))))
+            .then(results => write({ id: request.id, results: results }));
+    });
+    rl.on('close', () => process.exit(0));
+    write({ ready: true });
+} else {
+    journeys(process.argv[2], process.argv[3])
+        .then(res => console.log(JSON.stringify(res)))
+        .catch(err => {
+            console.error(err);
+            process.exitCode = 1;
+        });
+}
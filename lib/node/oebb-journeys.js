@@ -1,9 +1,35 @@
-
 const oebb = require('oebb');
+const readline = require('readline');
+
+const journeys = (origin, destination) => oebb.journeys(origin, destination, { when: new Date(), results: 5});
+
+const write = message => process.stdout.write(JSON.stringify(message) + '\n');
 
-const origin = process.argv[2];
-const destination = process.argv[3];
+if (process.argv[2] === '--sidecar') {
+    // sidecar mode: one JSON request per line on stdin, one JSON response per line on stdout
+    // request:  {"id": 1, "connections": [{"from": 1290201, "to": 1292101}, ...]}
+    // response: {"id": 1, "results": [{"journeys": [...]}, {"error": "..."}, ...]}
+    const rl = readline.createInterface({ input: process.stdin, terminal: false });
+    rl.on('line', line => {
+        let request;
+        try {
+            request = JSON.parse(line);
+        } catch (err) {
+            write({ id: null, error: 'invalid request: ' + err.message });
+            return;
+        }
+        // all connections of a batch are requested concurrently
+        Promise.all((request.connections || []).map(c => journeys(String(c.from), String(c.to))
+            .then(res => ({ journeys: res }), err => ({ error: String((err && err.message) || err) }))))
+            .then(results => write({ id: request.id, results: results }));
+    });
+    rl.on('close', () => process.exit(0));
+    write({ ready: true });
+} else {
+    const origin = process.argv[2];
+    const destination = process.argv[3];
 
-oebb.journeys(origin, destination, { when: new Date(), results: 5})
-    .then(res => console.log(JSON.stringify(res)))
-    .catch(console.error);
+    journeys(origin, destination)
+        .then(res => console.log(JSON.stringify(res)))
+        .catch(console.error);
+}
@@ -1,57 +1,47 @@
+import importlib
+import os
+import sys
 import time
-import copy
 
-from api.api_citybikewien import CitybikeWienApi
-from api.api_oebb import OeBBApi
-from api.api_wrlinien import WrLinienApi
-from api.api_yrno import YRNOApi
-from worker import Worker
+from scheduler import ApiScheduler, stale_apis
+from response_cache import open_response_cache
+from pipeline import Pipeline
 from display.display_driver import UIDriver
+from config import get_compiled_config
+from deadlines import latency_report
+from metrics import get_metrics, MetricsServer
+from profiler import get_profiler
+from merge import merge_stations
+from records import Transport
 from utils import get_config, get_logger
 
 logger = get_logger(__name__)
 
 
+# api name in config.json -> module and class of the api, modules are imported only if the api is configured
+API_CLASSES = {
+    "wrlinien": ("api.api_wrlinien", "WrLinienApi"),
+    "oebb": ("api.api_oebb", "OeBBApi"),
+    "citybikewien": ("api.api_citybikewien", "CitybikeWienApi"),
+    "yrno": ("api.api_yrno", "YRNOApi")
+}
+
+
 class NoDataException(Exception):
     pass
 
 
 def _merge_api_data(wrlinien, oebb, citybikewien):
-    # merge wrlinien and oebb
-    unmerged_stations = copy.deepcopy(wrlinien['stations'] if 'stations' in wrlinien else []) + oebb  # do not make changes to original dicts
-    stations = []
-    for unmerged_station in unmerged_stations:
-        exists = False
-        for station in stations:
-            if unmerged_station['name'] == station['name']:
-                station['lines'].extend(unmerged_station['lines'])  # does not merge same lines, just adds to station
-                exists = True
-        if exists is False:
-            stations.append(unmerged_station)
-
-    # merge citybikewien to merged
-    for bike_station in citybikewien:
-        exists = False
-        for station in stations:
-            if bike_station['name'] == station['name']:
-                station['citybikewien'] = bike_station
-                exists = True
-                break
-        if not exists:
-            stations.append({  # add a new station only for citybikewien to stations
-                'name': bike_station['name'],
-                'citybikewien': bike_station
-            })
-    return {'stations': stations, 'lastUpdate': wrlinien['lastUpdate'] if bool(wrlinien) else time.localtime()}
+    # merge wrlinien, oebb and citybikewien in one pass, the apis' snapshots are shared and stay unchanged
+    stations = merge_stations([wrlinien.stations, oebb], citybikewien)
+    return Transport(stations, wrlinien.last_update or time.time())
 
 
 def _add_walking_time(transport_data):
-    conf = get_config()
-    for station in transport_data['stations']:
-        for walkingTime in conf['stations']['walkingTime']:
-            if station['name'] == walkingTime['station']:
-                station['walkingTime'] = walkingTime['time']
-    return transport_data
+    walking_times = get_compiled_config().walking_times
+    return transport_data.replace(stations=tuple(
+        station.replace(walking_time=walking_times[station.name]) if station.name in walking_times else station
+        for station in transport_data.stations))
 
 
 def _check_api_data(wrlinien, oebb, citybikewien):
@@ -68,21 +58,126 @@ def _check_api_data(wrlinien, oebb, citybikewien):
 
 def _to_display_data(wrlinien, oebb, citybikewien):
     _check_api_data(wrlinien, oebb, citybikewien)
-    merged_data = _merge_api_data(wrlinien, oebb, citybikewien)
-    walking_time_data = _add_walking_time(merged_data)
+    with get_metrics().timer('merge_seconds'):
+        merged_data = _merge_api_data(wrlinien, oebb, citybikewien)
+        walking_time_data = _add_walking_time(merged_data)
     return walking_time_data
 
 
-def _wait_for_next_update(last_update):
+def _fetch_snapshots(scheduler):
+    # only waits after start up or a reset, when an api has no data yet, and at most as long as the slowest api may take
+    deadlines = get_compiled_config().deadlines
+    if not scheduler.wait_ready(max(deadlines.values(), default=0)):
+        logger.warning("not every api is ready within its deadline, proceeding without them")
+    return _usable_snapshots(scheduler.snapshots())
+
+
+def _usable_snapshots(snapshots):
+    # leaves out apis still loading, raises the error of an api that failed without any data
+    for api_name in list(snapshots):
+        snapshot = snapshots[api_name]
+        if snapshot.data is None and not snapshot.exc_info:  # still loading, left out like an api not configured
+            del snapshots[api_name]
+            continue
+        if snapshot.exc_info and snapshot.data is None:  # failed apis with last good data are shown stale
+            raise snapshot.exc_info[1].with_traceback(snapshot.exc_info[2])
+    return snapshots
+
+
+def _merge_snapshots(snapshots):
+    wrlinien_data = snapshots['wrlinien'].data if 'wrlinien' in snapshots else Transport((), None)
+    oebb_data = snapshots['oebb'].data if 'oebb' in snapshots else ()
+    citybikewien_data = snapshots['citybikewien'].data if 'citybikewien' in snapshots else ()
+    yrno_data = snapshots['yrno'].data if 'yrno' in snapshots else None
+
+    if 'api.http_transport' in sys.modules:  # only imported by http apis
+        logger.info("Transport Stats: %s" % sys.modules['api.http_transport'].get_transport().report())
+    logger.info("Latency Stats: %s" % latency_report())
+    traffic_data = _to_display_data(wrlinien_data, oebb_data, citybikewien_data)
+    logger.info("Traffic Data: %s" % traffic_data)
+    stale = stale_apis(snapshots)
+    if stale:
+        logger.warning("showing last good data of failing apis: %s" % ', '.join(stale))
+    return traffic_data, yrno_data, stale
+
+
+def _wait_for_next_update(last_update, pipeline):
     conf = get_config()
     update_delta = last_update - time.time() + conf['display']['updateInterval']
     if update_delta > 0:
         logger.info('sleeping for %d seconds before next cycle' % update_delta)
-        time.sleep(update_delta)
+        pipeline.raise_error(update_delta)  # raises exceptions of the pipeline stages while sleeping
     else:
         logger.warning('skipping sleep, late for next cycle by %d seconds' % (update_delta * -1))
 
 
+def _api_samples(scheduler):
+    # samples of the stats the apis, their breakers and the transport keep anyway, see `MetricsRegistry.add_collector`
+    samples = []
+    for api_name, stats in latency_report().items():
+        for key, name in (('deadlineMisses', 'api_deadline_misses_total'), ('hedges', 'api_hedges_total'),
+                          ('hedgesWon', 'api_hedges_won_total')):
+            samples.append((name, {'api': api_name}, stats[key]))
+    for api_name, breaker in scheduler.breakers().items():
+        samples.append(('api_breaker_open', {'api': api_name}, breaker['state'] != 'closed'))
+        samples.append(('api_failures_in_row', {'api': api_name}, breaker['failures']))
+    for api_name, snapshot in scheduler.snapshots().items():
+        if snapshot.fetched_at:
+            samples.append(('api_data_age_seconds', {'api': api_name}, round(time.time() - snapshot.fetched_at, 3)))
+    if 'api.http_transport' in sys.modules:  # only imported by http apis
+        for api_name, stats in sys.modules['api.http_transport'].get_transport().report().items():
+            samples.append(('http_bytes_received_total', {'api': api_name}, stats['bytes_received']))
+            samples.append(('http_not_modified_total', {'api': api_name}, stats['not_modified']))
+    return samples
+
+
+def _start_metrics(scheduler, pipeline):
+    """
+    Exports the metrics of every stage, api and the display
+
+    Input:
+    Uses data from `config.json` with the following keys:
+    metrics (json, optional):                   metrics json with the following keys:
+        port (int, optional):                   serve `/metrics` and `/metrics.json` on this port of localhost
+        file (str, optional):                   write the metrics as json to this file every cycle
+    """
+    metrics = get_metrics()
+    metrics.add_collector(pipeline.collect_metrics)
+    metrics.add_collector(lambda: _api_samples(scheduler))
+
+    conf = get_config()
+    if 'port' in conf.get('metrics', {}):
+        MetricsServer(metrics, conf['metrics']['port']).start()
+
+
+def _write_metrics_file():
+    conf = get_config()
+    if 'file' in conf.get('metrics', {}):
+        get_metrics().write_file(conf['metrics']['file'])
+
+
+def _configure_transport():
+    # records the api responses to an archive or replays recorded ones, see `api.replay`
+    conf = get_config().get('transport', {})
+    if not conf:
+        return
+    from api.http_transport import get_transport, set_transport
+    from api.replay import RecordingTransport, ReplayTransport, ResponseArchive
+    if 'replay' in conf:
+        set_transport(ReplayTransport(get_transport(), conf['replay']))
+        os.environ['OEBB_REPLAY_URL'] = conf['replay']  # the node scripts ask the replay server for journeys
+        logger.info("replaying api responses from %s" % conf['replay'])
+    elif 'record' in conf:
+        set_transport(RecordingTransport(get_transport(), ResponseArchive(conf['record'])))
+        logger.info("recording api responses to %s" % conf['record'])
+
+
+def _sleep_until_next_cycle(last_update):
+    # gives failing apis the time of a whole cycle to recover on their circuit breakers
+    conf = get_config()
+    time.sleep(max(0, last_update - time.time() + conf['display']['updateInterval']))
+
+
 def main():
     logger.info("Application Start!")
 
@@ -90,86 +185,78 @@ def main():
     ui_driver = UIDriver()
     last_exceptions = dict()  # keep track of exceptions
 
-    api_classes = {
-        "wrlinien": WrLinienApi,
-        "oebb": OeBBApi,
-        "citybikewien": CitybikeWienApi,
-        "yrno": YRNOApi
-    }
     threaded_apis = {}
 
-    # select apis from config.json, create api objects and save the reference to threaded_apis dict
-    for conf_api_name in api_classes:
+    # select apis from config.json, import only their modules, create api objects and save the reference to
+    # threaded_apis dict
+    for conf_api_name in API_CLASSES:
         if conf_api_name in conf['api']:
-            threaded_apis[conf_api_name] = api_classes[conf_api_name]()
+            module_name, class_name = API_CLASSES[conf_api_name]
+            threaded_apis[conf_api_name] = getattr(importlib.import_module(module_name), class_name)()
+
+    _configure_transport()
+
+    # every api is updated on its own thread on its own interval, the loop only reads the latest snapshots
+    scheduler = ApiScheduler(threaded_apis, open_response_cache())  # starts from cached results after a restart
+    scheduler.start()
+
+    # every stage runs on its own thread, fetching and rendering the next cycle overlaps the display refresh
+    pipeline = Pipeline([
+        ('fetch', lambda tick: _fetch_snapshots(scheduler)),
+        ('merge', _merge_snapshots),
+        ('render', lambda data: ui_driver.render_frame(*data)),
+        ('pack', ui_driver.pack_frame),
+        ('push', ui_driver.push_frame)
+    ])
+    pipeline.start()
+    _start_metrics(scheduler, pipeline)
+    profiler = get_profiler()
+    profiler.install_signal_handler()  # `kill -USR1` profiles the next cycles
+
+    # push the last frame again right away, the first live frame follows as soon as the apis have data
+    boot_frame = ui_driver.boot_frame()
+    if boot_frame is not None:
+        pipeline.submit(boot_frame, stage='push')
 
     while True:
         try:
             logger.info("Cycle Start!")
             last_update = time.time()
+            profiler.cycle()
 
-            threads = []
-            for api_name in threaded_apis:
-                api = threaded_apis[api_name]
-                threads.append(Worker(type(api).__name__, api))
-
-            for t in threads:
-                t.start()
-
-            for t in threads:
-                t.join()
-            for api_name in threaded_apis:
-                api = threaded_apis[api_name]
-                if api.exc_info:
-                    raise api.exc_info[1].with_traceback(api.exc_info[2])
-
-            wrlinien_data = threaded_apis['wrlinien'].data if 'wrlinien' in threaded_apis else {}
-            oebb_data = threaded_apis['oebb'].data if 'oebb' in threaded_apis else []
-            citybikewien_data = threaded_apis['citybikewien'].data if 'citybikewien' in threaded_apis else {}
-            yrno_data = threaded_apis['yrno'].data if 'yrno' in threaded_apis else {}
-
-            traffic_data = _to_display_data(wrlinien_data, oebb_data, citybikewien_data)
-            logger.info("Traffic Data: %s" % traffic_data)
-            ui_driver.display(traffic_data, yrno_data)
+            pipeline.submit(last_update)
+            logger.info("Pipeline Stats: %s" % pipeline.report())
+            _write_metrics_file()
 
-            _wait_for_next_update(last_update)
+            _wait_for_next_update(last_update, pipeline)
 
         except Exception as err:
-            # sleeps one hour if error between 1 and 5 a.m., where less traffic info is available
-            hour = int(time.strftime("%H"))
-            if 1 <= hour <= 5:
-                logger.exception(err)
-                logger.warning("sleeping for an hour")
-                time.sleep(3600)
-
-            else:  # exception handling
-                if type(err).__name__ not in last_exceptions:
-                    last_exceptions[type(err).__name__] = 1
-                    logger.error("First time catching {}".format(type(err).__name__))
-                    for api_name in threaded_apis:
-                        api = threaded_apis[api_name]
-                        api.reset()
-                    time.sleep(2)
+            # failing apis are retried by their own circuit breakers and keep their last good data, only apis that
+            # never had data, and errors of the stages end up here. No api is reset, the next cycle is simply awaited
+            logger.info("Circuit Breakers: %s" % scheduler.breakers())
+            if type(err).__name__ not in last_exceptions:
+                last_exceptions[type(err).__name__] = 1
+                logger.error("First time catching {}".format(type(err).__name__))
+                pipeline.clear_errors()
+                _sleep_until_next_cycle(last_update)
+            else:
+                if last_exceptions[type(err).__name__] >= 1:
+                    # if exception happened 5 times already, display and raise exception
+                    import traceback
+                    # censor wrlinien key on display
+                    err_name = str(err)
+                    msg = traceback.format_exc()
+                    if 'wrlinien' in threaded_apis:
+                        censored_key = "*CENSORED KEY*"
+                        err_name = err_name.replace(conf['api']['wrlinien']['key'], censored_key)
+                        msg = msg.replace(conf['api']['wrlinien']['key'], censored_key)
+                    ui_driver.display_exception(err_name, type(err).__name__, [msg])
+                    raise err
                 else:
-                    if last_exceptions[type(err).__name__] >= 1:
-                        # if exception happened 5 times already, display and raise exception
-                        import traceback
-                        # censor wrlinien key on display
-                        err_name = str(err)
-                        msg = traceback.format_exc()
-                        if 'wrlinien' in threaded_apis:
-                            censored_key = "*CENSORED KEY*"
-                            err_name = err_name.replace(conf['api']['wrlinien']['key'], censored_key)
-                            msg = msg.replace(conf['api']['wrlinien']['key'], censored_key)
-                        ui_driver.display_exception(err_name, type(err).__name__, [msg])
-                        raise err
-                    else:
-                        last_exceptions[type(err).__name__] += 1  # if exception already occurred, increment counter
-                        logger.error("Caught {} already {} times".format(type(err).__name__, last_exceptions[type(err).__name__]))
-                        for api_name in threaded_apis:
-                            api = threaded_apis[api_name]
-                            api.reset()
-                        time.sleep(2)
+                    last_exceptions[type(err).__name__] += 1  # if exception already occurred, increment counter
+                    logger.error("Caught {} already {} times".format(type(err).__name__, last_exceptions[type(err).__name__]))
+                    pipeline.clear_errors()
+                    _sleep_until_next_cycle(last_update)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,83 @@
+import itertools
+
+from records import Station
+
+
+def normalise_name(name):
+    """
+    Normalises station names, line names and directions, so they can be used as merge keys
+
+    Example:
+    normalise_name(' Wien  Praterstern ') == normalise_name('wien praterstern')
+
+    :param name: name to normalise
+    :return: case folded name with collapsed whitespace
+    """
+    return ' '.join(name.split()).casefold()
+
+
+def line_by_name_and_direction(line):
+    """
+    Default line key, lines of the same name heading in the same direction are merged
+    """
+    return normalise_name(line.name), normalise_name(line.direction)
+
+
+def line_by_direction(line):
+    """
+    Line key merging all lines heading in the same direction, e.g. all trains to the same destination
+    """
+    return normalise_name(line.direction)
+
+
+def merge_stations(station_lists, bike_stations=(), line_key=line_by_name_and_direction):
+    """
+    Merges stations of all apis by normalised name in a single pass, without copying or changing the inputs
+
+    Stations are looked up by normalised name and lines by `line_key` in `dict`s. Identical lines are only kept
+    once, other lines with the same key are folded into one line with the sorted departures of both.
+    Citybike Wien stations are added to the station with the same name, or as a station of their own.
+
+    Input `Line`s are shared with the result where nothing had to be merged, so neither the inputs nor the lines
+    of the result may be changed afterwards.
+
+    :param station_lists: `array`s of `Station`s
+    :param bike_stations: `BikeStation`s
+    :param line_key: function returning the merge key of a `Line`
+    :return: `array` of new merged `Station`s in order of first appearance
+    """
+    names = {}  # normalised station name -> station name of first appearance
+    lines = {}  # normalised station name -> merged lines
+    line_indexes = {}  # normalised station name -> (line key -> index of the line in the station's lines)
+    bikes = {}  # normalised station name -> citybikewien station
+
+    for station in itertools.chain.from_iterable(station_lists):
+        name = normalise_name(station.name)
+        if name not in names:
+            names[name] = station.name
+            lines[name] = []
+            line_indexes[name] = {}
+        station_lines = lines[name]
+        indexes = line_indexes[name]
+
+        for line in station.lines:
+            key = line_key(line)
+            if key not in indexes:
+                indexes[key] = len(station_lines)
+                station_lines.append(line)
+                continue
+
+            merged_line = station_lines[indexes[key]]
+            if merged_line == line:  # identical line, e.g. requested twice
+                continue
+            station_lines[indexes[key]] = merged_line.replace(
+                departures=tuple(sorted(merged_line.departures + line.departures)),
+                traffic_jam=merged_line.traffic_jam or line.traffic_jam)
+
+    for bike_station in bike_stations:
+        name = normalise_name(bike_station.name)
+        if name not in names:  # add a new station only for citybikewien to stations
+            names[name] = bike_station.name
+        bikes.setdefault(name, bike_station)
+
+    return [Station(station_name, lines.get(name, ()), bikes.get(name)) for name, station_name in names.items()]
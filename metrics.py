@@ -0,0 +1,258 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+HISTOGRAM_WINDOW = 256  # latest observations per histogram the percentiles are computed from
+
+metrics_cache = None  # caches the shared MetricsRegistry
+
+
+class Histogram:
+    """
+    Rolling histogram of durations or sizes
+
+    Observing appends to a bounded window and is cheap enough for every cycle on a Pi Zero, the window is only
+    sorted when the metrics are exported.
+    """
+
+    def __init__(self):
+        self.window = deque(maxlen=HISTOGRAM_WINDOW)  # latest observations
+        self.count = 0  # observations since start
+        self.sum = 0  # sum of all observations since start
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        with self.lock:
+            self.window.append(value)
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        """
+        :return: `dict` with count and sum since start, and p50, p95 and max of the window
+        """
+        with self.lock:
+            window = sorted(self.window)
+            count, total = self.count, self.sum
+        if not window:
+            return {'count': count, 'sum': total, 'p50': 0, 'p95': 0, 'max': 0}
+        return {'count': count, 'sum': round(total, 6), 'p50': window[len(window) // 2],
+                'p95': window[min(len(window) - 1, len(window) * 95 // 100)], 'max': window[-1]}
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class MetricsRegistry:
+    """
+    Named histograms and counters of the whole application, every metric may carry labels
+
+    Collectors are functions returning `(name, labels, value)` samples of stats kept elsewhere, e.g. the transport
+    stats, they are only called on export.
+
+    Example:
+    with get_metrics().timer('stage_seconds', stage='render'):
+        render(...)
+    get_metrics().counter('display_refreshes_total', result='skipped').inc()
+    """
+
+    def __init__(self):
+        self.histograms = {}  # (name, sorted label items) -> Histogram
+        self.counters = {}  # (name, sorted label items) -> Counter
+        self.collectors = []  # functions returning `array` of `(name, labels, value)`
+        self.lock = threading.Lock()
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def counter(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        counter = self.counters.get(key)
+        if counter is None:
+            with self.lock:
+                counter = self.counters.setdefault(key, Counter())
+        return counter
+
+    def timer(self, name, **labels):
+        """
+        :return: context manager observing the seconds its block took in the histogram `name`
+        """
+        return _Timer(self.histogram(name, **labels))
+
+    def add_collector(self, collector):
+        with self.lock:
+            self.collectors.append(collector)
+
+    def _collect(self):
+        with self.lock:
+            collectors = list(self.collectors)
+        samples = []
+        for collector in collectors:
+            try:
+                samples.extend(collector())
+            except Exception as err:  # a broken collector must not break the export
+                logger.error("Caught %s collecting metrics: %s" % (type(err).__name__, err))
+        return samples
+
+    def to_dict(self):
+        """
+        :return: `dict` with `histograms`, `counters` and `gauges`, each an `array` of metrics with name and labels
+        """
+        with self.lock:
+            histograms = list(self.histograms.items())
+            counters = list(self.counters.items())
+        return {
+            'time': time.time(),
+            'histograms': [dict(name=name, labels=dict(labels), **h.snapshot()) for (name, labels), h in histograms],
+            'counters': [{'name': name, 'labels': dict(labels), 'value': c.value} for (name, labels), c in counters],
+            'gauges': [{'name': name, 'labels': labels, 'value': value} for name, labels, value in self._collect()]
+        }
+
+    def to_prometheus(self):
+        """
+        :return: metrics in the Prometheus text format, histograms are exported as summaries
+        """
+        metrics = self.to_dict()
+        lines = []
+        for metric_type, samples in (('summary', metrics['histograms']), ('counter', metrics['counters']),
+                                     ('gauge', metrics['gauges'])):
+            typed = set()
+            for sample in sorted(samples, key=lambda s: s['name']):  # samples of a metric have to be grouped
+                name, labels = sample['name'], sample['labels']
+                if name not in typed:
+                    typed.add(name)
+                    # collected samples named `_total` are counters kept elsewhere
+                    lines.append('# TYPE %s %s' % (name, 'counter' if name.endswith('_total') else metric_type))
+                if metric_type != 'summary':
+                    lines.append('%s%s %s' % (name, _labels(labels), _number(sample['value'])))
+                    continue
+                for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('1', 'max')):
+                    lines.append('%s%s %s' % (name, _labels(dict(labels, quantile=quantile)), _number(sample[key])))
+                lines.append('%s_count%s %s' % (name, _labels(labels), sample['count']))
+                lines.append('%s_sum%s %s' % (name, _labels(labels), _number(sample['sum'])))
+        return '\n'.join(lines) + '\n'
+
+    def write_file(self, path):
+        """
+        Writes the metrics as json to `path` atomically, errors are logged
+        """
+        directory = os.path.dirname(path) or '.'
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(self.to_dict(), f)
+                os.replace(tmp_path, path)  # readers see the old or the new file
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except Exception as err:
+            logger.error("Caught %s writing metrics to %s: %s" % (type(err).__name__, path, err))
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for k, v in sorted(labels.items()))
+
+
+def _number(value):
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, float):
+        return round(value, 6)
+    return value
+
+
+class MetricsServer:
+    """
+    Local HTTP endpoint of the metrics, `/metrics` in the Prometheus text format, `/metrics.json` as json
+
+    Example:
+    server = MetricsServer(get_metrics(), 9100)
+    server.start()
+    """
+
+    def __init__(self, registry, port, host='127.0.0.1'):
+        self.registry = registry
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+        logger.info("serving metrics on http://%s:%d/metrics" % self.server.server_address[:2])
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.to_prometheus(), 'text/plain; version=0.0.4'
+                elif self.path == '/metrics.json':
+                    body, content_type = json.dumps(registry.to_dict()), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                payload = body.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+
+def get_metrics():
+    """
+    Returns the shared `MetricsRegistry`
+
+    :return: shared `MetricsRegistry`
+    """
+    global metrics_cache
+    if metrics_cache is None:
+        metrics_cache = MetricsRegistry()
+    return metrics_cache
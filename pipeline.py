@@ -0,0 +1,157 @@
+import queue
+import sys
+import threading
+import time
+
+from metrics import get_metrics
+from profiler import get_profiler
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+
+class LatestQueue(queue.Queue):
+    """
+    Bounded queue where the newest item wins: putting into a full queue drops the oldest item
+    """
+
+    def __init__(self, maxsize=1):
+        queue.Queue.__init__(self, maxsize)
+        self.dropped = 0  # items dropped because a newer one came in
+
+    def put_latest(self, item):
+        with self.mutex:
+            if 0 < self.maxsize <= self._qsize():
+                self._get()
+                self.dropped += 1
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+
+class Stage(threading.Thread):
+    """
+    Pipeline stage, runs on own thread
+    Takes `(cycle start, item)` from its inbox, calls `fn(item)` and hands the result to the next stage's inbox.
+    Exceptions are handed to the pipeline, the stage keeps running.
+    """
+
+    def __init__(self, name, fn, pipeline):
+        threading.Thread.__init__(self, daemon=True)
+        self.name = name
+        self.fn = fn
+        self.pipeline = pipeline
+        self.inbox = LatestQueue(pipeline.queue_size)
+        self.outbox = None  # inbox of the next stage, `None` for the last stage
+        self.processed = 0  # items processed without exception
+        self.last_latency = 0  # seconds the last item took in this stage
+        self.max_latency = 0  # max seconds an item took in this stage
+        self.total_latency = 0  # seconds all processed items took in this stage
+        self.histogram = get_metrics().histogram('stage_seconds', stage=name, **pipeline.labels)
+        self.errors = get_metrics().counter('stage_errors_total', stage=name, **pipeline.labels)
+
+    def run(self):
+        while True:
+            cycle_start, item = self.inbox.get()
+            start = time.time()
+            try:
+                with get_profiler().profile():
+                    result = self.fn(item)
+            except Exception:
+                self.errors.inc()
+                self.pipeline.errors.put(sys.exc_info())
+                continue
+
+            latency = time.time() - start
+            self.processed += 1
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+            self.total_latency += latency
+            self.histogram.observe(latency)
+            if self.outbox is not None:
+                self.outbox.put_latest((cycle_start, result))
+            else:
+                self.pipeline.last_cycle_latency = time.time() - cycle_start
+                self.pipeline.cycle_histogram.observe(self.pipeline.last_cycle_latency)
+
+    def report(self):
+        return {
+            'queueDepth': self.inbox.qsize(),
+            'dropped': self.inbox.dropped,
+            'processed': self.processed,
+            'lastLatency': round(self.last_latency, 3),
+            'avgLatency': round(self.total_latency / self.processed, 3) if self.processed else 0,
+            'maxLatency': round(self.max_latency, 3)
+        }
+
+
+class Pipeline:
+    """
+    Chain of `Stage`s connected by bounded queues, every stage runs on its own thread
+
+    While the last stage blocks, e.g. for the 60 seconds of an e-paper refresh, the earlier stages already work on
+    the next cycles. If a stage falls behind, the newest item wins and older ones are dropped.
+
+    Example:
+    pipeline = Pipeline([('fetch', fetch), ('merge', merge), ('render', render)])
+    pipeline.start()
+    pipeline.submit(tick)
+    pipeline.raise_error(timeout=59)
+    """
+
+    def __init__(self, stages, queue_size=1, labels=None):
+        self.queue_size = queue_size  # max items waiting in front of every stage
+        self.labels = dict(labels or {})  # labels of the pipeline's metrics, e.g. the display of a fleet
+        self.stages = [Stage(name, fn, self) for name, fn in stages]
+        for stage, next_stage in zip(self.stages, self.stages[1:]):
+            stage.outbox = next_stage.inbox
+        self.errors = queue.Queue()  # `sys.exc_info()`s of failed stages
+        self.last_cycle_latency = 0  # seconds from submit until the last stage finished, of the last finished item
+        self.cycle_histogram = get_metrics().histogram('cycle_seconds', **self.labels)
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def submit(self, item, stage=None):
+        """
+        Hands `item` to the first stage, or to the stage named `stage`
+        """
+        target = self.stages[0] if stage is None else next(s for s in self.stages if s.name == stage)
+        target.inbox.put_latest((time.time(), item))
+
+    def raise_error(self, timeout):
+        """
+        Waits up to `timeout` seconds for a failed stage and raises its exception on the calling thread
+        """
+        try:
+            exc_info = self.errors.get(timeout=timeout)
+        except queue.Empty:
+            return
+        raise exc_info[1].with_traceback(exc_info[2])
+
+    def clear_errors(self):
+        """
+        Drops exceptions of failed stages that were not raised yet
+        """
+        while not self.errors.empty():
+            self.errors.get_nowait()
+
+    def collect_metrics(self):
+        """
+        :return: `array` of `(name, labels, value)` samples of the stages' queues, see `MetricsRegistry.add_collector`
+        """
+        samples = []
+        for stage in self.stages:
+            labels = dict(self.labels, stage=stage.name)
+            samples.append(('stage_queue_depth', labels, stage.inbox.qsize()))
+            samples.append(('stage_dropped_total', labels, stage.inbox.dropped))
+        return samples
+
+    def report(self):
+        """
+        :return: `dict` of stage name to queue depth and latency stats, and the end to end latency
+        """
+        report = {stage.name: stage.report() for stage in self.stages}
+        report['cycleLatency'] = round(self.last_cycle_latency, 3)
+        return report
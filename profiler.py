@@ -0,0 +1,215 @@
+import cProfile
+import os
+import pstats
+import signal
+import threading
+import time
+import tracemalloc
+
+from utils import get_config, get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_CYCLES = 3  # cycles profiled per capture
+DEFAULT_DIRECTORY = 'profiles'
+DEFAULT_KEEP = 10  # captures kept in the profiles directory, older ones are deleted
+TOP_ALLOCATIONS = 25  # lines listed in the allocation report
+WRITE_GRACE = 30  # max seconds the writer waits for profiled work units that are still running
+
+profiler_cache = None  # caches the shared Profiler
+
+
+class _Capture:
+    """
+    One profiling capture, every thread doing work during the capture gets its own `cProfile.Profile`
+    """
+
+    def __init__(self, cycles):
+        self.started = time.time()
+        self.cycles_left = cycles
+        self.profiles = {}  # thread id -> cProfile.Profile
+        self.threads = set()  # names of the profiled threads
+        self.running = 0  # work units currently profiled
+        self.done = threading.Condition()  # notified whenever a profiled work unit ends
+        self.start_snapshot = tracemalloc.take_snapshot()
+
+
+class Profiler:
+    """
+    Profiles the next cycles with `cProfile` and `tracemalloc` on demand, while the display keeps running
+
+    A capture is requested by `SIGUSR1`, e.g. `kill -USR1 <pid>`, or by setting `profiling.enabled` in `config.json`.
+    The api workers, the pipeline stages and the http fetches wrap their work in `profile()`, so the worker threads
+    are covered as well and idle waiting does not show up in the profile. When the capture ends, a background thread
+    writes one `.pstats` file of all threads and an allocation report to the profiles directory, and deletes the
+    oldest captures beyond `keep`.
+
+    Input:
+    Uses data from `config.json` with the following keys:
+    profiling (json, optional):                 profiling json with the following keys:
+        enabled (bool, optional):               capture once when set to `true`, set to `false` and `true` again to
+                                                capture again
+        cycles (int, optional):                 cycles profiled per capture, default 3
+        directory (str, optional):              directory of the profiles, default `profiles`
+        keep (int, optional):                   captures kept in the directory, default 10
+
+    Example:
+    kill -USR1 <pid of main.py>
+    python -m pstats profiles/profile-20190101-120000.pstats
+    """
+
+    def __init__(self):
+        self.requested = False  # set by `SIGUSR1`, a capture starts with the next cycle
+        self.config_flag = False  # last seen `profiling.enabled`
+        self.capture = None  # running `_Capture`
+        self.writer = None  # thread writing the last capture
+        self.local = threading.local()  # `depth` of nested `profile()` calls on the thread
+
+    def install_signal_handler(self):
+        """
+        Requests a capture on `SIGUSR1`, only possible on the main thread
+        """
+        try:
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.request())
+        except (ValueError, AttributeError) as err:  # not the main thread, or no `SIGUSR1` on this platform
+            logger.warning("Caught %s installing SIGUSR1 handler, profiling only by config: %s"
+                           % (type(err).__name__, err))
+
+    def request(self):
+        """
+        Requests a capture with the next cycle, safe to call from a signal handler
+        """
+        self.requested = True
+
+    def cycle(self):
+        """
+        Called by the display loop once per cycle, starts and ends captures. Never blocks, the profiles are written
+        on a background thread.
+        """
+        conf = get_config().get('profiling', {})
+        flag = conf.get('enabled', False)
+        if flag and not self.config_flag:
+            self.requested = True
+        self.config_flag = flag
+
+        if self.capture is not None:
+            self.capture.cycles_left -= 1
+            if self.capture.cycles_left <= 0:
+                capture, self.capture = self.capture, None
+                self.writer = threading.Thread(target=self._write, args=(capture, conf), name='profiler', daemon=True)
+                self.writer.start()
+            return
+
+        if self.requested and (self.writer is None or not self.writer.is_alive()):  # `tracemalloc` is still in use
+            self.requested = False
+            cycles = conf.get('cycles', DEFAULT_CYCLES)
+            logger.info("profiling the next %d cycles" % cycles)
+            tracemalloc.start()
+            self.capture = _Capture(cycles)
+
+    def profile(self):
+        """
+        :return: context manager profiling its block on the calling thread while a capture runs, cheap otherwise
+        """
+        return _ProfiledBlock(self)
+
+    def _write(self, capture, conf):
+        directory = conf.get('directory', DEFAULT_DIRECTORY)
+        with capture.done:  # profiles can only be read once their thread stopped them
+            capture.done.wait_for(lambda: capture.running == 0, WRITE_GRACE)
+            profiles = list(capture.profiles.values())
+            threads = sorted(capture.threads)
+
+        try:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(capture.started))
+            os.makedirs(directory, exist_ok=True)
+
+            stats = None
+            for profile in profiles:
+                if stats is None:
+                    stats = pstats.Stats(profile)
+                else:
+                    stats.add(profile)
+            if stats is not None:
+                stats.dump_stats(os.path.join(directory, 'profile-%s.pstats' % stamp))
+
+            with open(os.path.join(directory, 'alloc-%s.txt' % stamp), 'w') as f:
+                f.write("Profiled threads: %s\n\n" % ', '.join(threads))
+                f.write("Top %d allocations grown during the capture:\n" % TOP_ALLOCATIONS)
+                for stat in snapshot.compare_to(capture.start_snapshot, 'lineno')[:TOP_ALLOCATIONS]:
+                    f.write("%s\n" % stat)
+                f.write("\nTop %d allocations at the end of the capture:\n" % TOP_ALLOCATIONS)
+                for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+                    f.write("%s\n" % stat)
+            logger.info("wrote profile of %d threads to %s" % (len(threads), directory))
+            self._prune(directory, conf.get('keep', DEFAULT_KEEP))
+        except Exception as err:
+            logger.error("Caught %s writing profile: %s" % (type(err).__name__, err))
+
+    @staticmethod
+    def _prune(directory, keep):
+        # file names sort by time, a capture is a `profile-` and an `alloc-` file with the same stamp
+        stamps = sorted({name.split('-', 1)[1].rsplit('.', 1)[0] for name in os.listdir(directory)
+                         if name.startswith(('profile-', 'alloc-'))})
+        for stamp in stamps[:-keep] if keep > 0 else stamps:
+            for name in ('profile-%s.pstats' % stamp, 'alloc-%s.txt' % stamp):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except FileNotFoundError:
+                    pass
+
+
+class _ProfiledBlock:
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.capture = None
+        self.profile = None
+
+    def __enter__(self):
+        capture = self.profiler.capture
+        local = self.profiler.local
+        depth = getattr(local, 'depth', 0)
+        local.depth = depth + 1
+        if capture is None or depth > 0:  # nested blocks are covered by the outermost one
+            return self
+
+        name = threading.current_thread().name
+        with capture.done:
+            profile = capture.profiles.get(threading.get_ident())
+            if profile is None:
+                profile = capture.profiles[threading.get_ident()] = cProfile.Profile()
+                capture.threads.add(name)
+            capture.running += 1
+        try:
+            profile.enable()
+        except ValueError as err:  # e.g. another profiler is active
+            logger.warning("Caught ValueError profiling %s: %s" % (name, err))
+            with capture.done:
+                capture.running -= 1
+                capture.done.notify_all()
+            return self
+        self.capture, self.profile = capture, profile
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.local.depth -= 1
+        if self.profile is not None:
+            self.profile.disable()
+            with self.capture.done:
+                self.capture.running -= 1
+                self.capture.done.notify_all()
+        return False
+
+
+def get_profiler():
+    """
+    Returns the shared `Profiler`
+
+    :return: shared `Profiler`
+    """
+    global profiler_cache
+    if profiler_cache is None:
+        profiler_cache = Profiler()
+    return profiler_cache
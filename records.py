@@ -0,0 +1,193 @@
+import time
+
+LOCAL_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+
+class Record:
+    """
+    Base of the compact, `__slots__` based records passed from the apis to the renderer
+
+    Records are treated as immutable once published by an api, use `replace()` to get a changed copy.
+    Numbers are parsed once when the api data is ingested, timestamps are seconds since the Epoch.
+    `_fields` are the arguments of `__init__`, other slots are caches.
+    """
+    __slots__ = ()
+    _fields = ()
+
+    def replace(self, **changes):
+        """
+        :return: shallow copy of the record with the given fields replaced
+        """
+        return type(self)(*(changes[f] if f in changes else getattr(self, f) for f in self._fields))
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, f) == getattr(other, f) for f in self._fields)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join('%s=%r' % (f, getattr(self, f)) for f in self._fields))
+
+    def __getstate__(self):
+        return tuple(getattr(self, f) for f in self._fields)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+class Line(Record):
+    """
+    Transport line of a station
+
+    name (str):                 lines name abbreviated to 3 `char`s
+    direction (str):            displayed name of direction/destination the line is heading
+    departures (tuple[float]):  departure times in seconds since the Epoch, sorted, see `departures.countdown`
+    barrier_free (bool):        `True` if the coming transport is barrier free accessible
+    traffic_jam (bool):         `True` if the coming transport is delayed
+    """
+    __slots__ = _fields = ('name', 'direction', 'departures', 'barrier_free', 'traffic_jam')
+
+    def __init__(self, name, direction, departures, barrier_free=False, traffic_jam=False):
+        self.name = name
+        self.direction = direction
+        self.departures = tuple(departures)
+        self.barrier_free = barrier_free
+        self.traffic_jam = traffic_jam
+
+
+class BikeStation(Record):
+    """
+    Citybike Wien station
+
+    id (int):       id of the station
+    name (str):     name of station, used to merge with other traffic data
+    bikes (int):    number of available bikes at station
+    status (str):   status code of station from citybikewien.at API
+    """
+    __slots__ = _fields = ('id', 'name', 'bikes', 'status')
+
+    def __init__(self, id, name, bikes, status):
+        self.id = id
+        self.name = name
+        self.bikes = bikes
+        self.status = status
+
+
+class Station(Record):
+    """
+    Station with its lines, merged from all apis by name
+
+    name (str):                         name of station, used to merge with other traffic data
+    lines (tuple[Line]):                transport lines of the station, empty for citybikewien only stations
+    citybikewien (BikeStation):         citybikewien station of the same name or `None`
+    walking_time (int):                 minutes to walk to the station or `None`
+    """
+    __slots__ = _fields = ('name', 'lines', 'citybikewien', 'walking_time')
+
+    def __init__(self, name, lines=(), citybikewien=None, walking_time=None):
+        self.name = name
+        self.lines = tuple(lines)
+        self.citybikewien = citybikewien
+        self.walking_time = walking_time
+
+
+class Transport(Record):
+    """
+    Stations of a public transport api
+
+    stations (tuple[Station]):  stations
+    last_update (float):        server timestamp of update in seconds since the Epoch, `None` if unknown
+    """
+    __slots__ = _fields = ('stations', 'last_update')
+
+    def __init__(self, stations, last_update):
+        self.stations = tuple(stations)
+        self.last_update = last_update
+
+
+def parse_local_time(text):
+    """
+    :param text: local time formatted as `LOCAL_TIME_FORMAT`
+    :return: time in seconds since the Epoch
+    """
+    return time.mktime(time.strptime(text, LOCAL_TIME_FORMAT))
+
+
+class Forecast(Record):
+    """
+    Weather forecast of a time range
+
+    time_from_text (str):       lower bound of valid time range, local time as `LOCAL_TIME_FORMAT`
+    time_to_text (str):         upper bound of valid time range, local time as `LOCAL_TIME_FORMAT`
+    symbol_id (int):            yr.no id of the weather symbol
+    description (str):          weather description
+    precipitation (float):      precipitation in mm
+    celsius (int):              degrees celsius
+    wind_direction (str):       wind direction abbreviated to 3 `char`s
+    wind_description (str):     wind type description
+    wind_mps (float):           wind speed in meters per second
+
+    time_from (float):          lower bound in seconds since the Epoch, parsed on first access
+    time_to (float):            upper bound in seconds since the Epoch, parsed on first access
+    """
+    _fields = ('time_from_text', 'time_to_text', 'symbol_id', 'description', 'precipitation', 'celsius',
+               'wind_direction', 'wind_description', 'wind_mps')
+    __slots__ = _fields + ('_time_from', '_time_to')
+
+    def __init__(self, time_from_text, time_to_text, symbol_id, description, precipitation, celsius, wind_direction,
+                 wind_description, wind_mps):
+        self.time_from_text = time_from_text
+        self.time_to_text = time_to_text
+        self.symbol_id = symbol_id
+        self.description = description
+        self.precipitation = precipitation
+        self.celsius = celsius
+        self.wind_direction = wind_direction
+        self.wind_description = wind_description
+        self.wind_mps = wind_mps
+        self._time_from = None
+        self._time_to = None
+
+    @property
+    def time_from(self):
+        if self._time_from is None:
+            self._time_from = parse_local_time(self.time_from_text)
+        return self._time_from
+
+    @property
+    def time_to(self):
+        if self._time_to is None:
+            self._time_to = parse_local_time(self.time_to_text)
+        return self._time_to
+
+
+class Weather(Record):
+    """
+    Weather of a location
+
+    city (str):                     name of city
+    country (str):                  name of country
+    sun_rise (float):               time of sunrise in seconds since the Epoch
+    sun_set (float):                time of sunset in seconds since the Epoch
+    forecast (tuple[Forecast]):     forecasts
+    credit_text (str):              yr.no credits text
+    credit_url (str):               url to yr.no website of requested location
+    last_update (float):            server timestamp of update in seconds since the Epoch
+    next_update (float):            time of the next server update in seconds since the Epoch
+    """
+    __slots__ = _fields = ('city', 'country', 'sun_rise', 'sun_set', 'forecast', 'credit_text', 'credit_url',
+                           'last_update', 'next_update')
+
+    def __init__(self, city, country, sun_rise, sun_set, forecast, credit_text, credit_url, last_update, next_update):
+        self.city = city
+        self.country = country
+        self.sun_rise = sun_rise
+        self.sun_set = sun_set
+        self.forecast = tuple(forecast)
+        self.credit_text = credit_text
+        self.credit_url = credit_url
+        self.last_update = last_update
+        self.next_update = next_update
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import os
+import pickle
+import tempfile
+import time
+from collections import namedtuple
+
+from utils import get_config, get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_DIRECTORY = 'cache'
+DEFAULT_TTL = 3600  # seconds cached data of an api is used after it was fetched
+
+# Persisted result of an api's last successful update
+# data:         parsed data of the api
+# fetched_at:   time of the update in seconds since the Epoch
+# next_update:  the api's `nextUpdate` after the update, respects `updateInterval` and e.g. yr.no's `nextupdate`
+# expires:      time in seconds since the Epoch after which the entry is not used anymore
+# fingerprint:  fingerprint of the api's config the data was fetched with
+CacheEntry = namedtuple('CacheEntry', ['data', 'fetched_at', 'next_update', 'expires', 'fingerprint'])
+
+
+def config_fingerprint(api_name):
+    """
+    :return: hash of the api's section of `config.json`, data fetched with another config is not restored
+    """
+    conf = get_config()
+    return hashlib.md5(json.dumps(conf['api'][api_name], sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persists the last parsed result of every api, so a restart can draw the first frame without waiting for the apis
+
+    Every api has its own pickle file in `directory`, which is replaced atomically, so a crash or power cut while
+    writing leaves the last complete entry. Entries expire `cacheTtl` seconds after they were fetched.
+
+    Input:
+    Uses data from `config.json` with the following keys:
+        cache (json, optional):                 cache json with the following keys:
+            enabled (bool, optional):           persist api results, default `True`
+            directory (str, optional):          directory of the cache files, default `cache`
+        api (json):                             api json with the following keys for every api:
+            cacheTtl (number, optional):        seconds cached data is used after it was fetched, default 3600
+
+    Example:
+    cache = ResponseCache('cache')
+    cache.store('yrno', api.data, time.time(), api.nextUpdate)
+    entry = cache.load('yrno')
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def load(self, api_name):
+        """
+        :return: `CacheEntry` of the api, `None` if there is none, it expired or the api's config changed
+        """
+        entry = read_pickle(self._path(api_name))
+        if entry is None:
+            return None
+        if entry.expires <= time.time():
+            logger.info("cached %s expired %d seconds ago" % (api_name, time.time() - entry.expires))
+            return None
+        if entry.fingerprint != config_fingerprint(api_name):
+            logger.info("config of %s changed, ignoring cache" % api_name)
+            return None
+        return entry
+
+    def store(self, api_name, data, fetched_at, next_update):
+        """
+        Writes the api's data atomically, errors are logged and do not fail the api
+
+        :param fetched_at: time `data` was fetched, the entry expires `cacheTtl` seconds after it. Pass the time of the
+                           fetch, not of the update, an update that did not fetch keeps the entry of the last fetch
+        """
+        conf = get_config()
+        ttl = conf['api'][api_name].get('cacheTtl', DEFAULT_TTL)
+        entry = CacheEntry(data, fetched_at, next_update, fetched_at + ttl, config_fingerprint(api_name))
+        write_pickle(self._path(api_name), entry)
+
+    def _path(self, api_name):
+        return os.path.join(self.directory, api_name + '.pickle')
+
+
+def cache_directory():
+    """
+    :return: directory of the cache files configured in `config.json`, `None` if caching is disabled
+    """
+    conf = get_config()
+    cache_conf = conf.get('cache', {})
+    if not cache_conf.get('enabled', True):
+        return None
+    return cache_conf.get('directory', DEFAULT_DIRECTORY)
+
+
+def open_response_cache():
+    """
+    :return: `ResponseCache` configured in `config.json`, `None` if it is disabled
+    """
+    directory = cache_directory()
+    return ResponseCache(directory) if directory is not None else None
+
+
+def read_pickle(path):
+    """
+    :return: object pickled at `path`, `None` if there is no file or it cannot be read
+    """
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as err:  # e.g. truncated or written by another version
+        logger.error("Caught %s loading %s: %s, ignoring cache" % (type(err).__name__, path, err))
+        return None
+
+
+def write_pickle(path, obj):
+    """
+    Pickles `obj` to a temporary file and replaces `path` with it atomically, so a crash or power cut while writing
+    leaves the old file. Errors are logged, not raised.
+    """
+    directory = os.path.dirname(path) or '.'
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path) + '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)  # atomic, readers see the old or the new file
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    except Exception as err:
+        logger.error("Caught %s writing %s: %s" % (type(err).__name__, path, err))
@@ -0,0 +1,124 @@
+import threading
+import time
+from collections import namedtuple
+
+from worker import Worker
+from utils import get_logger
+
+logger = get_logger(__name__)
+
+# Immutable result of an api's last update
+# data:         last good data of the api, `None` if there is none yet. Readers must not change it
+# fetched_at:   time `data` was fetched in seconds since the Epoch, 0 if there was none yet
+# exc_info:     `sys.exc_info()` of the last update if it failed, else `None`. With `data`, the data is stale
+Snapshot = namedtuple('Snapshot', ['data', 'fetched_at', 'exc_info'])
+
+EMPTY_SNAPSHOT = Snapshot(None, 0, None)
+
+
+class ApiScheduler:
+    """
+    Refreshes every api on its own long-lived `Worker` thread on the api's own `updateInterval`
+
+    After every update the api's result is published as an immutable `Snapshot`. The render loop reads the latest
+    snapshots without waiting, so a slow api never delays the others. A failed update keeps the api's last good data,
+    marked stale, and every api retries on its own `CircuitBreaker`, so a failing api never invalidates the others.
+    With a `ResponseCache`, new results are persisted and the apis start with their cached results, so the first
+    frame after a restart does not wait for the apis. An api is not updated before its cached `nextUpdate`.
+
+    Example:
+    scheduler = ApiScheduler({'wrlinien': WrLinienApi(), 'yrno': YRNOApi()})
+    scheduler.start()
+    scheduler.wait_ready()
+    wrlinien_data = scheduler.snapshots()['wrlinien'].data
+    """
+
+    def __init__(self, apis, cache=None):
+        self.apis = apis  # api name -> api object
+        self.cache = cache  # `ResponseCache` or `None`
+        self.workers = {name: Worker(name, api, self) for name, api in apis.items()}
+        self._snapshots = {name: EMPTY_SNAPSHOT for name in apis}
+        self.stopped = threading.Event()
+        self.changed = threading.Condition()  # notified whenever an api published new data or a failure
+        if cache is not None:
+            self._restore()
+
+    def _restore(self):
+        """
+        Starts every api with its cached result, if it has one
+        """
+        for name, api in self.apis.items():
+            entry = self.cache.load(name)
+            if entry is None:
+                continue
+            api.data = entry.data
+            api.nextUpdate = entry.next_update
+            self._snapshots[name] = Snapshot(entry.data, entry.fetched_at, None)
+            logger.info("restored %s fetched %d seconds ago from cache" % (name, time.time() - entry.fetched_at))
+
+    def start(self):
+        for worker in self.workers.values():
+            worker.start()
+
+    def stop(self):
+        self.stopped.set()
+        for worker in self.workers.values():
+            worker.wakeup.set()
+
+    def publish(self, name, api, fetched=True):
+        """
+        Called by the `Worker`s after every update
+
+        :param fetched: `False` if the update did nothing, because the api's `nextUpdate` was not due. Its data keeps
+                        the time it was fetched and its cache entry
+        """
+        with self.changed:
+            last = self._snapshots[name]
+            if api.exc_info:  # keep the last good data
+                snapshot = Snapshot(last.data, last.fetched_at, api.exc_info)
+                api.exc_info = None
+            elif api.data is None or not fetched:
+                return  # not updated yet, or nothing was fetched
+            else:  # the same data after e.g. a `304 Not Modified` is fresh again, too
+                snapshot = Snapshot(api.data, time.time(), None)
+            self._snapshots[name] = snapshot
+            if snapshot.data is not last.data or snapshot.exc_info is not last.exc_info:
+                self.changed.notify_all()
+
+        if self.cache is not None and snapshot.exc_info is None:
+            self.cache.store(name, snapshot.data, snapshot.fetched_at, api.nextUpdate)
+
+    def snapshots(self):
+        """
+        :return: `dict` of api name to its latest `Snapshot`
+        """
+        with self.changed:
+            return dict(self._snapshots)
+
+    def breakers(self):
+        """
+        :return: `dict` of api name to the report of its `CircuitBreaker`
+        """
+        return {name: worker.breaker.report() for name, worker in self.workers.items()}
+
+    def wait_ready(self, timeout=None):
+        """
+        Waits until every api has either data or failed since the start
+
+        :param timeout: max seconds to wait, `None` to wait forever
+        :return: `True` if every api is ready
+        """
+        def ready():
+            return all(s.data is not None or s.exc_info for s in self._snapshots.values())
+
+        with self.changed:
+            return self.changed.wait_for(ready, timeout)
+
+
+def stale_apis(snapshots):
+    """
+    :param snapshots: `dict` of api name to `Snapshot`
+    :return: sorted `tuple` of the names of apis whose last update failed and which show their last good data
+    """
+    return tuple(sorted(name for name, snapshot in snapshots.items()
+                        if snapshot.exc_info and snapshot.data is not None))
@@ -0,0 +1,9 @@
+#!/usr/bin/env bash
+
+if [[ ! -f current_pid.txt ]]; then
+    echo >&2 "ERROR: no current_pid.txt found. abort."
+else
+    # the pid is the one of the subshell started by start.sh, python runs either as its child or in its place
+    pkill -USR1 -P `cat current_pid.txt` > /dev/null 2>&1 || kill -USR1 `cat current_pid.txt`
+    echo "profiling the next cycles, see the profiles directory."
+fi
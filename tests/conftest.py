@@ -0,0 +1,127 @@
+import copy
+import io
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))  # modules are imported from the root
+
+MINIMAL_CONFIG = {
+    'display': {'updateInterval': 59, 'title': 'Test'},
+    'stations': {'avgWaitingTime': 3, 'walkingTime': [{'station': 'Messe-Prater', 'time': 8}]},
+    'api': {}
+}
+
+
+@pytest.fixture
+def conf():
+    """
+    :return: fresh copy of a minimal valid `config.json`, add the keys under test
+    """
+    return copy.deepcopy(MINIMAL_CONFIG)
+
+
+@pytest.fixture
+def use_config(monkeypatch):
+    """
+    :return: function making a `config.json` `dict` the config of every thread until the test ends, returns the
+             `Config`
+    """
+    import config
+
+    def use(conf):
+        compiled = config.Config(conf)
+        monkeypatch.setattr(config, 'config_cache', compiled)
+        monkeypatch.setattr(config, 'pinned', True)  # `config.json` is not watched
+        return compiled
+    return use
+
+
+@pytest.fixture
+def fixture_data(conf):
+    """
+    Parses the fixtures of `benchmarks.fixtures` with the config of `benchmarks.suite`
+
+    :return: `dict` with the `config`, the merged `display_data`, the `weather` and the render time `now`
+    """
+    import config
+    import main
+    from api.api_citybikewien import CitybikeWienApi
+    from api.api_oebb import OeBBApi
+    from api.api_wrlinien import WrLinienApi
+    from api.api_yrno import FORECAST_SLOTS, YRNOApi
+    from benchmarks import fixtures, suite
+
+    raw = fixtures.load()
+    citybikewien_raw, wanted = fixtures.scale_citybikewien(raw['citybikewien'], 1)
+    conf['display']['renderOffset'] = suite.RENDER_OFFSET
+    conf['api'] = {'citybikewien': {'updateInterval': 60, 'stations': [{'id': int(i)} for i in wanted]}}
+    compiled = config.Config(conf)
+
+    wrlinien = WrLinienApi._parse(suite._Response(raw['wrlinien']))
+    oebb = OeBBApi._parse(raw['oebb'], compiled.oebb_rename)
+    citybikewien = CitybikeWienApi._parse_stream(io.BytesIO(citybikewien_raw), wanted)
+    return {
+        'config': compiled,
+        'display_data': main._to_display_data(wrlinien, oebb, citybikewien),
+        'weather': YRNOApi._parse_stream(io.BytesIO(raw['yrno']), FORECAST_SLOTS),
+        'now': wrlinien.last_update + suite.RENDER_OFFSET * 60
+    }
+
+
+class FixtureTransport:
+    """
+    Transport answering every fetch with the api's fixture of `benchmarks.fixtures`, without network access
+    """
+
+    def __init__(self, raw):
+        self.raw = raw  # api name -> raw fixture, see `fixtures.load()`
+        self.fetches = {}  # api name -> fetches
+
+    def fetch(self, api_name, url, parse, *args, **kwargs):
+        from benchmarks.suite import _Response
+        self.fetches[api_name] = self.fetches.get(api_name, 0) + 1
+        return parse(_Response(self.raw[api_name]))
+
+    def fetch_many(self, api_name, urls, parse, timeout, *args, **kwargs):
+        return [self.fetch(api_name, url, parse) for url in urls]
+
+    def report(self):
+        return {api_name: {'fetches': fetches} for api_name, fetches in self.fetches.items()}
+
+
+@pytest.fixture
+def fixture_transport(monkeypatch):
+    """
+    :return: `FixtureTransport` shared by the apis until the test ends
+    """
+    from api import http_transport
+    from benchmarks import fixtures
+    transport = FixtureTransport(fixtures.load())
+    monkeypatch.setattr(http_transport, 'transport_cache', transport)
+    return transport
+
+
+@pytest.fixture
+def render_assets():
+    """
+    Skips the test unless `scripts/setup.sh` downloaded the fonts and assets the renderer needs
+    """
+    from display.assets import YR_ASSETS_DIR
+    if not os.path.isdir('fonts') or not os.path.isdir(YR_ASSETS_DIR):
+        pytest.skip("rendering needs the fonts and assets of `scripts/setup.sh`")
+
+
+@pytest.fixture
+def rendered(fixture_data, render_assets):
+    """
+    :return: black and red image of the fixtures rendered like on the e-paper display
+    """
+    from config import scoped_config
+    from departures import upcoming
+    from display.bpm_render import render
+
+    with scoped_config(fixture_data['config']):
+        now = fixture_data['now']
+        return render(upcoming(fixture_data['display_data'], now), fixture_data['weather'], now)
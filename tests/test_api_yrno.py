@@ -0,0 +1,79 @@
+import types
+
+import pytest
+
+from api import api_yrno
+from api.api_yrno import DISPLAYED_SLOTS, FORECAST_SLOTS, YRNOApi
+from display.bpm_render import WEATHER_COLUMNS, _upcoming_forecasts
+
+UPDATE_INTERVAL = 7 * 24 * 3600  # longer than the forecast of the fixture, the slots decide
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    :return: `list` with the time the api sees, change `clock[0]` to move it
+    """
+    now = [0.0]
+    monkeypatch.setattr(api_yrno, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def configure(conf, use_config, fixture_transport):
+    def configure(**yrno):
+        conf['api'] = {'yrno': dict(updateInterval=UPDATE_INTERVAL, country='Austria', province='Vienna',
+                                    city='Vienna', **yrno)}
+        use_config(conf)
+    return configure
+
+
+def update(clock, now):
+    clock[0] = now
+    api = YRNOApi()
+    api.update()
+    assert api.exc_info is None
+    return api
+
+
+def test_default_slots_outlast_a_passed_slot(configure, clock):
+    assert DISPLAYED_SLOTS == WEATHER_COLUMNS
+    configure()
+    api = update(clock, 0)
+    forecast = api.data.forecast
+    assert len(forecast) == FORECAST_SLOTS > WEATHER_COLUMNS
+    assert len(_upcoming_forecasts(api.data, forecast[0].time_to)) == WEATHER_COLUMNS  # the first slot passed
+
+
+def test_fetches_before_slots_run_out(configure, clock):
+    configure(forecastSlots=DISPLAYED_SLOTS)
+    forecast = update(clock, 0).data.forecast
+    api = update(clock, forecast[0].time_from)
+
+    run_out = forecast[0].time_to
+    assert api.nextUpdate == run_out < api.data.next_update  # before yr.no's `nextupdate`
+    assert len(_upcoming_forecasts(api.data, run_out - 1)) == WEATHER_COLUMNS
+    assert len(_upcoming_forecasts(api.data, run_out)) < WEATHER_COLUMNS
+
+
+def test_default_slots_last_until_next_update(configure, clock):
+    configure()
+    forecast = update(clock, 0).data.forecast
+    api = update(clock, forecast[0].time_from)
+    assert api.nextUpdate == api.data.next_update
+    assert len(_upcoming_forecasts(api.data, api.nextUpdate - 1)) == WEATHER_COLUMNS
+
+
+def test_too_few_slots_wait_for_next_update(configure, clock):
+    configure(forecastSlots=DISPLAYED_SLOTS - 1)
+    forecast = update(clock, 0).data.forecast
+    api = update(clock, forecast[0].time_from)
+    assert api.nextUpdate == api.data.next_update
+
+
+def test_passed_slots_wait_for_the_interval(configure, clock):
+    configure()
+    forecast = update(clock, 0).data.forecast
+    now = forecast[-1].time_to  # an old forecast, every slot passed
+    api = update(clock, now)
+    assert api.nextUpdate == now + UPDATE_INTERVAL
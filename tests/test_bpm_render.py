@@ -0,0 +1,45 @@
+import io
+
+import pytest
+from PIL import ImageChops
+
+from api.api_yrno import YRNOApi
+from benchmarks import fixtures
+from config import scoped_config
+from departures import upcoming
+from display.bpm_render import WEATHER_COLUMNS, _upcoming_forecasts, render
+
+
+@pytest.fixture
+def weather():
+    """
+    :return: `Weather` of the yr.no fixture with 4 forecast slots of 6 hours
+    """
+    return YRNOApi._parse_stream(io.BytesIO(fixtures.load()['yrno']), 4)
+
+
+def test_upcoming_forecasts(weather):
+    forecast = weather.forecast
+    assert _upcoming_forecasts(weather, forecast[0].time_from) == list(forecast[:WEATHER_COLUMNS])
+    assert _upcoming_forecasts(weather, forecast[0].time_to) == list(forecast[1:1 + WEATHER_COLUMNS])
+    assert _upcoming_forecasts(weather, forecast[-1].time_from) == [forecast[-1]]
+    assert _upcoming_forecasts(weather, forecast[-1].time_to) == []
+    assert _upcoming_forecasts(weather.replace(forecast=forecast[:1]), forecast[0].time_from) == [forecast[0]]
+
+
+def _render(fixture_data, weather, now):
+    with scoped_config(fixture_data['config']):
+        return render(upcoming(fixture_data['display_data'], now), weather, now)
+
+
+@pytest.mark.parametrize('slots', [0, 1])
+def test_fewer_slots_than_columns(render_assets, fixture_data, weather, slots):
+    now = weather.forecast[0].time_from
+    _render(fixture_data, weather.replace(forecast=weather.forecast[:slots]), now)
+
+
+def test_passed_slots_are_not_rendered(render_assets, fixture_data, weather):
+    now = weather.forecast[1].time_from  # the first slot passed
+    image_red = _render(fixture_data, weather, now)[1]
+    expected_red = _render(fixture_data, weather.replace(forecast=weather.forecast[1:]), now)[1]
+    assert ImageChops.difference(image_red, expected_red).getbbox() is None
@@ -0,0 +1,27 @@
+import pytest
+
+from config import Config, ConfigException, REFRESH_POLICIES
+
+
+def test_minimal_config(conf):
+    Config(conf)
+
+
+@pytest.mark.parametrize('policy', REFRESH_POLICIES)
+def test_refresh_policy(conf, policy):
+    conf['display']['refresh'] = {'policy': policy, 'maxAge': 30}
+    assert Config(conf).raw['display']['refresh']['policy'] == policy
+
+
+@pytest.mark.parametrize('refresh', [{'policy': 'sometimes'}, {'policy': 1}, 'changed'])
+def test_invalid_refresh_policy(conf, refresh):
+    conf['display']['refresh'] = refresh
+    with pytest.raises(ConfigException, match='display.refresh'):
+        Config(conf)
+
+
+@pytest.mark.parametrize('max_age', [0, -5, '30', True])
+def test_invalid_refresh_max_age(conf, max_age):
+    conf['display']['refresh'] = {'maxAge': max_age}
+    with pytest.raises(ConfigException, match='display.refresh.maxAge'):
+        Config(conf)
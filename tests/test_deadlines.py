@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+import deadlines
+from api.fault_transport import FaultTransport
+from api.http_transport import HttpTransport
+from deadlines import MIN_SAMPLES, DeadlineExceededException, api_deadline, get_latency_stats, remaining
+
+P95 = 0.1  # seconds, p95 latency of the api before the tests
+SLOW = 1  # seconds the first request of a test takes
+
+
+@pytest.fixture
+def latency_stats(conf, use_config, monkeypatch):
+    """
+    :return: `LatencyStats` of `citybikewien`, a `deadline` of 5 seconds and a p95 latency of `P95`
+    """
+    conf['api'] = {'citybikewien': {'updateInterval': 60, 'deadline': 5, 'stations': [{'id': 207}]}}
+    use_config(conf)
+    monkeypatch.setattr(deadlines, 'latency_stats_cache', {})
+    stats = get_latency_stats('citybikewien')
+    for _ in range(MIN_SAMPLES):
+        stats.record(P95)
+    return stats
+
+
+@pytest.fixture
+def transport(fixture_transport, latency_stats):
+    """
+    :return: `HttpTransport` sending its requests through a `FaultTransport` of the fixtures, without network access
+    """
+    fault_transport = FaultTransport(fixture_transport)
+    transport = HttpTransport()
+    transport._fetch = lambda api_name, url, parse, stream, variant, timeout: fault_transport.fetch(api_name, url, parse)
+    transport.faults = fault_transport
+    yield transport
+    transport.deadline_executor.shutdown(wait=True)
+
+
+def slow_first_request(transport):
+    """
+    Delays the requests starting in the next 50 ms by `SLOW` seconds, a hedged request after the p95 is fast
+    """
+    transport.faults.set_faults('citybikewien', failureRate=0, latency=SLOW, until=time.time() + P95 / 2)
+
+
+def test_api_deadline(latency_stats):
+    assert api_deadline('citybikewien', now=1000) == 1005
+    assert 4.9 < api_deadline('citybikewien') - time.time() <= 5
+
+
+def test_remaining(latency_stats):
+    assert 0 < remaining('citybikewien', time.time() + 1) <= 1
+    with pytest.raises(DeadlineExceededException):
+        remaining('citybikewien', time.time() - 1)
+    assert latency_stats.deadline_misses == 1
+
+
+def test_default_deadline(conf, use_config):
+    conf['api'] = {'citybikewien': {'updateInterval': 60, 'stations': [{'id': 207}]}}
+    conf['display']['updateInterval'] = 60
+    use_config(conf)
+    assert api_deadline('citybikewien', now=0) == 30
+
+
+def test_hedged_fetch_answers_first(transport, latency_stats):
+    slow_first_request(transport)
+    start = time.time()
+    result = transport.fetch('citybikewien', 'http://test', lambda res: res.content, deadline=time.time() + 5,
+                             hedge=True)
+    assert result and time.time() - start < SLOW
+    assert (latency_stats.hedges, latency_stats.hedges_won) == (1, 1)
+
+
+def test_fetch_without_hedge_waits(transport, latency_stats):
+    slow_first_request(transport)
+    start = time.time()
+    transport.fetch('citybikewien', 'http://test', lambda res: res.content, deadline=time.time() + 5)
+    assert time.time() - start >= SLOW
+    assert (latency_stats.hedges, latency_stats.hedges_won) == (0, 0)
+
+
+def test_fast_fetch_is_not_hedged(transport, latency_stats):
+    transport.fetch('citybikewien', 'http://test', lambda res: res.content, deadline=time.time() + 5, hedge=True)
+    assert (latency_stats.hedges, latency_stats.hedges_won) == (0, 0)
+
+
+def test_slow_fetch_misses_deadline(transport, latency_stats):
+    slow_first_request(transport)
+    with pytest.raises(DeadlineExceededException):
+        transport.fetch('citybikewien', 'http://test', lambda res: res.content, deadline=time.time() + SLOW / 2)
+    assert latency_stats.deadline_misses == 1
@@ -0,0 +1,118 @@
+import pytest
+from PIL import Image, ImageDraw
+
+from config import scoped_config
+from departures import upcoming
+from display.bpm_render import CLOCK_BOX, DISPLAY_SIZE, HEADER_HEIGHT, render
+from display.display_driver import Frame, UIDriver
+
+
+@pytest.fixture
+def driver_conf(conf, tmp_path):
+    conf['display']['backend'] = 'simulated'
+    conf['cache'] = {'directory': str(tmp_path)}
+    return conf
+
+
+@pytest.fixture
+def driver(driver_conf, use_config):
+    use_config(driver_conf)
+    return UIDriver()
+
+
+def frame(driver, image_black, image_red):
+    """
+    :return: packed `Frame` of the images, like `UIDriver.render_frame()` and `UIDriver.pack_frame()` build it
+    """
+    return driver.pack_frame(Frame(image_black, image_red, None, None, UIDriver._frame_digests(image_black, image_red)))
+
+
+def drawn(clock=0, departure=0):
+    """
+    Draws a frame like `render()`, with the clock and a departure in the red plane moved by `clock` and `departure`
+
+    :return: black and red image, rotated like `render()` returns them
+    """
+    image_black = Image.new('L', DISPLAY_SIZE, 255)
+    image_red = Image.new('L', DISPLAY_SIZE, 255)
+    draw_red = ImageDraw.Draw(image_red)
+    draw_red.rectangle(((0, 0), (DISPLAY_SIZE[0], HEADER_HEIGHT)), fill=0)
+    draw_red.rectangle(((CLOCK_BOX[0] + clock, 10), (CLOCK_BOX[0] + clock + 20, 30)), fill=255)
+    draw_red.rectangle(((345, 100 + departure), (370, 120 + departure)), fill=0)
+    return image_black.rotate(90, expand=True), image_red.rotate(90, expand=True)
+
+
+def test_clock_alone_is_skipped(driver):
+    driver.push_frame(frame(driver, *drawn()))
+    driver.push_frame(frame(driver, *drawn(clock=30)))
+    assert driver.report() == {'performed': 1, 'skipped': 1}
+
+    driver.push_frame(frame(driver, *drawn(clock=30, departure=25)))
+    assert driver.report() == {'performed': 2, 'skipped': 1}
+
+
+def test_header_outside_clock_is_a_change(driver):
+    image_black, image_red = drawn()
+    driver.push_frame(frame(driver, image_black, image_red))
+    image_red = image_red.copy()
+    image_red.paste(255, (10, 90, 30, 108))  # where the stale marker is drawn, left of the clock
+    driver.push_frame(frame(driver, image_black, image_red))
+    assert driver.report() == {'performed': 2, 'skipped': 0}
+
+
+def test_max_age_redraws_the_clock(driver_conf, use_config, monkeypatch):
+    driver_conf['display']['refresh'] = {'maxAge': 10}
+    use_config(driver_conf)
+    driver = UIDriver()
+    clock = [1000.0]
+    monkeypatch.setattr('display.display_driver.time.time', lambda: clock[0])
+
+    driver.push_frame(frame(driver, *drawn()))
+    clock[0] += 9 * 60
+    driver.push_frame(frame(driver, *drawn(clock=10)))
+    clock[0] += 60
+    driver.push_frame(frame(driver, *drawn(clock=20)))
+    assert driver.report() == {'performed': 2, 'skipped': 1}
+
+
+def test_rendered_minute_is_skipped(driver, fixture_data, render_assets):
+    now = fixture_data['now']
+    traffic_data = upcoming(fixture_data['display_data'].replace(stations=()), now)  # countdowns change each minute
+    with scoped_config(fixture_data['config']):
+        frames = [render(traffic_data, fixture_data['weather'], render_time) for render_time in (now, now + 60)]
+    assert frames[0][1].tobytes() != frames[1][1].tobytes()  # the clock changed
+
+    for images in frames:
+        driver.push_frame(frame(driver, *images))
+    assert driver.report() == {'performed': 1, 'skipped': 1}
+
+
+def test_boot_frame_restores_last_pushed(driver):
+    pushed = frame(driver, *drawn())
+    driver.push_frame(pushed)
+
+    booted = UIDriver().boot_frame()  # after a restart
+    assert booted.image_black is None and booted.image_red is None
+    assert (booted.buffer_black, booted.buffer_red, booted.digests) == \
+        (pushed.buffer_black, pushed.buffer_red, pushed.digests)
+
+
+def test_boot_frame_disabled_keeps_policy_state(driver, driver_conf, use_config):
+    pushed = frame(driver, *drawn())
+    driver.push_frame(pushed)
+    driver_conf['display']['bootFrame'] = False
+    use_config(driver_conf)
+
+    restarted = UIDriver()
+    assert restarted.boot_frame() is None
+    assert restarted.last_digests == pushed.digests
+    assert restarted.last_refresh == driver.last_refresh
+    restarted.push_frame(frame(restarted, *drawn(clock=10)))  # the display still shows the frame
+    assert restarted.report() == {'performed': 0, 'skipped': 1}
+
+
+def test_boot_frame_without_cache(driver, driver_conf, use_config):
+    driver.push_frame(frame(driver, *drawn()))
+    driver_conf['cache']['enabled'] = False
+    use_config(driver_conf)
+    assert UIDriver().boot_frame() is None
@@ -0,0 +1,140 @@
+import math
+import random
+
+import pytest
+
+from display.epd_spi import (EPD_WIDTH, EPD_HEIGHT, DATA_START_TRANSMISSION_1, DISPLAY_REFRESH, POWER_ON,
+                             open_simulated_epd)
+
+BITPLANE_SIZE = EPD_WIDTH // 8 * EPD_HEIGHT
+
+
+def waveshare_display(imageblack, imagered, width=EPD_WIDTH, height=EPD_HEIGHT):
+    """
+    `EPD.display` of the waveshare epd7in5b driver, the reference of the simulated byte stream
+
+    :return: `array` of ('command' or 'data', byte) in the order the driver sends them
+    """
+    sent = [('command', DATA_START_TRANSMISSION_1)]
+    for i in range(0, int(width / 8 * height)):
+        temp1 = imageblack[i]
+        temp2 = imagered[i]
+        j = 0
+        while j < 8:
+            if (temp2 & 0x80) == 0x00:
+                temp3 = 0x04  # red
+            elif (temp1 & 0x80) == 0x00:
+                temp3 = 0x00  # black
+            else:
+                temp3 = 0x03  # white
+            temp3 = (temp3 << 4) & 0xFF
+            temp1 = (temp1 << 1) & 0xFF
+            temp2 = (temp2 << 1) & 0xFF
+            j += 1
+            if (temp2 & 0x80) == 0x00:
+                temp3 |= 0x04
+            elif (temp1 & 0x80) == 0x00:
+                temp3 |= 0x00
+            else:
+                temp3 |= 0x03
+            temp1 = (temp1 << 1) & 0xFF
+            temp2 = (temp2 << 1) & 0xFF
+            sent.append(('data', temp3))
+            j += 1
+    sent += [('command', POWER_ON), ('command', DISPLAY_REFRESH)]
+    return sent
+
+
+def simulated_display(image_black, image_red, chunk_size=4096):
+    """
+    :return: `array` of ('command' or 'data', byte) sent by the simulated SPI backend, and the `SimulatedSpi`
+    """
+    epd = open_simulated_epd(chunk_size, record=True)
+    epd.init()
+    epd.display(image_black, image_red)
+    sent = [('data' if is_data else 'command', byte) for is_data, data in epd.spi.transfers for byte in data]
+    return sent, epd.spi
+
+
+def bitplanes(seed):
+    rand = random.Random(seed)
+    return bytes(rand.getrandbits(8) for _ in range(BITPLANE_SIZE)), \
+        bytes(rand.getrandbits(8) for _ in range(BITPLANE_SIZE))
+
+
+WHITE = bytes([0xFF]) * BITPLANE_SIZE
+BLACK = bytes(BITPLANE_SIZE)
+
+
+@pytest.mark.parametrize('image_black, image_red', [
+    (WHITE, WHITE),
+    (BLACK, WHITE),
+    (WHITE, BLACK),
+    (BLACK, BLACK),
+    bitplanes(1),
+    bitplanes(2),
+], ids=['white', 'black', 'red', 'black-and-red', 'noise-1', 'noise-2'])
+@pytest.mark.parametrize('chunk_size', [1000, 4096, BITPLANE_SIZE * 4])
+def test_stream_matches_waveshare(image_black, image_red, chunk_size):
+    sent, spi = simulated_display(image_black, image_red, chunk_size)
+    assert sent == waveshare_display(image_black, image_red)
+    assert spi.data_stream == bytes(byte for kind, byte in sent if kind == 'data')
+
+
+def test_chunked_writes():
+    sent, spi = simulated_display(WHITE, WHITE, chunk_size=1000)
+    frame_size = BITPLANE_SIZE * 4
+    data_writes = [data for is_data, data in spi.transfers if is_data]
+    assert len(data_writes) == math.ceil(frame_size / 1000)
+    assert all(len(data) == 1000 for data in data_writes[:-1])
+
+
+def test_clear_is_white():
+    epd = open_simulated_epd(record=True)
+    epd.Clear(0x00)
+    assert epd.spi.data_stream == bytes([0x33]) * (BITPLANE_SIZE * 4)
+
+
+def test_counters_only_by_default():
+    epd = open_simulated_epd()
+    epd.init()
+    for _ in range(3):
+        epd.display(WHITE, BLACK)
+    assert epd.spi.transfers == []
+    assert epd.spi.data_stream == b''
+    assert epd.spi.bytes_written > 3 * BITPLANE_SIZE * 4
+
+
+def test_record_keeps_last_frame():
+    epd = open_simulated_epd(record=True)
+    epd.init()
+    epd.display(WHITE, BLACK)
+    epd.display(BLACK, WHITE)
+    assert epd.spi.data_stream == bytes([0x00]) * (BITPLANE_SIZE * 4)
+    assert epd.spi.transfers[0] == (False, bytes([DATA_START_TRANSMISSION_1]))
+
+
+@pytest.mark.parametrize('chunk_size', [512, 4096])
+@pytest.mark.parametrize('speed_hz', [2000000, 4000000, 16000000])
+def test_timing_model(chunk_size, speed_hz):
+    epd = open_simulated_epd(chunk_size, speed_hz)
+    epd.init()
+    spi = epd.spi
+    elapsed, writes, written = spi.elapsed, spi.writes, spi.bytes_written
+    epd.display(WHITE, BLACK)
+
+    frame_size = BITPLANE_SIZE * 4
+    frame_writes = math.ceil(frame_size / chunk_size) + 3  # the data, and data start, power on and refresh commands
+    assert spi.writes - writes == frame_writes
+    assert spi.bytes_written - written == frame_size + 3
+    refresh_delay = 0.1  # `SpiEPD._refresh` waits before polling the busy pin, which reads idle right away
+    assert spi.elapsed - elapsed == pytest.approx(
+        frame_writes * spi.call_overhead + (frame_size + 3) * 8 / speed_hz + refresh_delay)
+
+
+def test_init_delays():
+    epd = open_simulated_epd()
+    epd.init()
+    spi = epd.spi
+    reset_delay = 3 * 0.2  # `SpiEPD.reset` toggles the reset pin three times
+    assert spi.elapsed == pytest.approx(reset_delay + spi.writes * spi.call_overhead + spi.bytes_written * 8 / 4000000)
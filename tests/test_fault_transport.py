@@ -0,0 +1,158 @@
+import pytest
+import requests
+
+from api import http_transport
+from api.api_citybikewien import CitybikeWienApi
+from api.api_wrlinien import WrLinienApi
+from api.fault_transport import FaultTransport
+from benchmarks import fixtures
+from circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from config import BreakerPolicy
+from scheduler import ApiScheduler, stale_apis
+
+BASE_DELAY = 10
+MAX_DELAY = 60
+FAILURE_THRESHOLD = 3
+
+
+@pytest.fixture
+def transport(conf, use_config, fixture_transport, monkeypatch):
+    """
+    :return: `FaultTransport` without faults, shared by the apis until the test ends
+    """
+    raw = fixture_transport.raw
+    _, wanted = fixtures.scale_citybikewien(raw['citybikewien'], 1)
+    breaker = {'failureThreshold': FAILURE_THRESHOLD, 'baseDelay': BASE_DELAY, 'maxDelay': MAX_DELAY}
+    conf['api'] = {
+        'wrlinien': {'updateInterval': 60, 'key': 'TEST', 'rbls': list(range(4000, 4000 + fixtures.SYNTHETIC_RBLS)),
+                     'breaker': breaker},
+        'citybikewien': {'updateInterval': 60, 'stations': [{'id': int(i)} for i in wanted], 'breaker': breaker}
+    }
+    use_config(conf)
+    fault_transport = FaultTransport(fixture_transport, seed=1)
+    monkeypatch.setattr(http_transport, 'transport_cache', fault_transport)
+    return fault_transport
+
+
+def update(api):
+    """
+    Updates `api` right away, like its `Worker` once the api is due
+
+    :return: `True` if the update failed
+    """
+    api.nextUpdate = 0
+    api.update()
+    return api.exc_info is not None
+
+
+def fail(api, breaker, now):
+    """
+    Updates `api`, which has to fail, and records the failure like its `Worker`
+
+    :return: seconds until the `Worker` would update the api again
+    """
+    assert breaker.allow(now)
+    assert update(api)
+    api.exc_info = None
+    return breaker.record_failure(now)
+
+
+def test_breaker_opens_after_failure_threshold(transport):
+    transport.set_faults('citybikewien', failureRate=1)
+    api = CitybikeWienApi()
+    breaker = CircuitBreaker('citybikewien')
+    now = 1000
+
+    for _ in range(FAILURE_THRESHOLD - 1):
+        assert fail(api, breaker, now) == BASE_DELAY  # retried on the base delay
+        assert breaker.state == CLOSED
+
+    delay = fail(api, breaker, now)
+    assert breaker.state == OPEN
+    assert BASE_DELAY / 2 <= delay <= BASE_DELAY
+    assert not breaker.allow(now + delay - 0.001)
+    assert transport.report()['citybikewien']['faultsInjected'] == FAILURE_THRESHOLD
+    assert api.data is None
+
+
+def test_backoff_grows_with_jitter_up_to_max_delay(transport):
+    transport.set_faults('citybikewien', failureRate=1)
+    api = CitybikeWienApi()
+    breakers = [CircuitBreaker('citybikewien', BreakerPolicy(1, BASE_DELAY, MAX_DELAY)) for _ in range(10)]
+    now = 1000
+
+    for opened in range(6):
+        backoff = min(MAX_DELAY, BASE_DELAY * 2 ** opened)
+        delays = []
+        for breaker in breakers:
+            delays.append(fail(api, breaker, now))
+            assert breaker.state == OPEN and breaker.retry_at == now + delays[-1]
+            assert breaker.allow(breaker.retry_at) and breaker.state == HALF_OPEN  # the next update is a trial
+        assert all(backoff / 2 <= delay <= backoff for delay in delays)
+        assert len(set(delays)) > 1  # jittered, the displays do not retry in lockstep
+        now += MAX_DELAY
+    assert max(delays) <= MAX_DELAY
+
+
+def _open(api, breaker, now):
+    """
+    :return: time the open breaker lets a trial update through
+    """
+    for _ in range(FAILURE_THRESHOLD):
+        fail(api, breaker, now)
+    assert breaker.state == OPEN
+    assert breaker.allow(breaker.retry_at) and breaker.state == HALF_OPEN
+    return breaker.retry_at
+
+
+def test_successful_trial_closes_breaker(transport):
+    transport.set_faults('citybikewien', failureRate=1)
+    api = CitybikeWienApi()
+    breaker = CircuitBreaker('citybikewien')
+    _open(api, breaker, 1000)
+
+    transport.set_faults('citybikewien')  # the api works again
+    assert not update(api)
+    assert breaker.record_success() == 0
+    assert breaker.state == CLOSED and breaker.failures == 0
+    assert api.data
+
+
+def test_failed_trial_reopens_breaker(transport):
+    transport.set_faults('citybikewien', failureRate=1)
+    api = CitybikeWienApi()
+    breaker = CircuitBreaker('citybikewien')
+    trial_at = _open(api, breaker, 1000)
+
+    delay = fail(api, breaker, trial_at)
+    assert breaker.state == OPEN
+    assert BASE_DELAY <= delay <= 2 * BASE_DELAY  # twice the backoff
+    assert not breaker.allow(trial_at + delay - 0.001)
+
+
+def test_failing_citybikewien_keeps_last_good_data(transport):
+    apis = {'wrlinien': WrLinienApi(), 'citybikewien': CitybikeWienApi()}
+    scheduler = ApiScheduler(apis)
+    for name, api in apis.items():
+        assert not update(api)
+        scheduler.publish(name, api)
+    before = scheduler.snapshots()
+    assert stale_apis(before) == ()
+
+    transport.set_faults('citybikewien', failureRate=1)
+    for name, api in apis.items():
+        update(api)
+        scheduler.publish(name, api)
+    after = scheduler.snapshots()
+
+    assert stale_apis(after) == ('citybikewien',)
+    citybikewien = after['citybikewien']
+    assert citybikewien.exc_info[0] is requests.ConnectionError
+    assert citybikewien.data is before['citybikewien'].data
+    assert citybikewien.fetched_at == before['citybikewien'].fetched_at
+
+    wrlinien = after['wrlinien']
+    assert wrlinien.exc_info is None
+    assert wrlinien.data is not before['wrlinien'].data and wrlinien.data == before['wrlinien'].data
+    assert wrlinien.fetched_at >= before['wrlinien'].fetched_at
+    assert 'faultsInjected' not in transport.report().get('wrlinien', {})
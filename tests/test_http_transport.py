@@ -0,0 +1,85 @@
+import http.server
+import threading
+
+import pytest
+import requests
+
+from api.api_citybikewien import CitybikeWienApi
+from api.api_yrno import YRNOApi
+from api.http_transport import DRAIN_LIMIT
+from benchmarks import fixtures
+
+# unread bytes after the parsed part and connections for 4 fetches, the parser reads ahead up to 16 KiB
+RESTS = [(DRAIN_LIMIT // 2, 1), (DRAIN_LIMIT * 4, 4)]
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keeps connections alive
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        body = self.server.bodies[self.path]
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except ConnectionError:
+            pass  # the client closed the connection before reading the rest
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    """
+    :return: local HTTP/1.1 server, serves `bodies` of path -> bytes and counts its `connections`
+    """
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+    httpd.daemon_threads = True
+    httpd.bodies = {}
+    httpd.connections = 0
+    httpd.lock = threading.Lock()
+    httpd.url = 'http://127.0.0.1:%d' % httpd.server_address[1]
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def padded(raw, closing_tag, size):
+    """
+    :return: `raw` XML with a comment of `size` bytes before its closing root tag, read after the parsed part
+    """
+    return raw.replace(closing_tag, b'<!--' + b' ' * size + b'-->' + closing_tag)
+
+
+def fetch_repeatedly(server, path, parse, times=4):
+    """
+    :return: connections the server accepted for `times` streamed fetches of `path`
+    """
+    session = requests.Session()
+    connections = server.connections
+    for _ in range(times):
+        with session.get(server.url + path, stream=True) as res:
+            parse(res)
+    return server.connections - connections
+
+
+@pytest.mark.parametrize('size, connections', RESTS, ids=['small-rest', 'large-rest'])
+def test_yrno_releases_connection(server, size, connections):
+    server.bodies['/forecast.xml'] = padded(fixtures.load()['yrno'], b'</weatherdata>', size)
+    assert fetch_repeatedly(server, '/forecast.xml', lambda res: YRNOApi._parse(res, 1)) == connections
+
+
+@pytest.mark.parametrize('size, connections', RESTS, ids=['small-rest', 'large-rest'])
+def test_citybikewien_releases_connection(server, size, connections):
+    raw, wanted = fixtures.scale_citybikewien(fixtures.load()['citybikewien'], 1)
+    server.bodies['/citybike_xml.php'] = padded(raw, raw[raw.rindex(b'</'):].strip(), size)
+    assert fetch_repeatedly(server, '/citybike_xml.php', lambda res: CitybikeWienApi._parse(res, wanted)) == connections
@@ -0,0 +1,88 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from metrics import HISTOGRAM_WINDOW, Histogram, MetricsRegistry, MetricsServer
+
+
+@pytest.fixture
+def registry():
+    """
+    :return: `MetricsRegistry` with a histogram, a counter and a collected gauge, each with labels
+    """
+    registry = MetricsRegistry()
+    for value in range(1, 101):
+        registry.histogram('stage_seconds', stage='render').observe(value / 100)
+    registry.counter('display_refreshes_total', result='skipped').inc(3)
+    registry.add_collector(lambda: [('api_stale', {'api': 'yrno'}, True)])
+    return registry
+
+
+@pytest.fixture
+def server(registry):
+    """
+    :return: base url of a started `MetricsServer` of `registry`
+    """
+    server = MetricsServer(registry, 0)
+    server.start()
+    yield 'http://%s:%d' % server.server.server_address[:2]
+    server.stop()
+
+
+def test_histogram_counts_all_and_keeps_window():
+    histogram = Histogram()
+    assert histogram.snapshot() == {'count': 0, 'sum': 0, 'p50': 0, 'p95': 0, 'max': 0}
+    for value in range(HISTOGRAM_WINDOW * 2):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot['count'] == HISTOGRAM_WINDOW * 2
+    assert snapshot['sum'] == sum(range(HISTOGRAM_WINDOW * 2))
+    # percentiles of the window, the latest `HISTOGRAM_WINDOW` observations
+    assert snapshot['p50'] == HISTOGRAM_WINDOW + HISTOGRAM_WINDOW // 2
+    assert snapshot['p95'] == HISTOGRAM_WINDOW + HISTOGRAM_WINDOW * 95 // 100
+    assert snapshot['max'] == HISTOGRAM_WINDOW * 2 - 1
+
+
+def test_labels_select_metrics():
+    registry = MetricsRegistry()
+    assert registry.counter('refreshes_total', a='1', b='2') is registry.counter('refreshes_total', b='2', a='1')
+    assert registry.counter('refreshes_total', a='1') is not registry.counter('refreshes_total', a='2')
+
+
+def test_broken_collector_is_skipped(registry):
+    registry.add_collector(lambda: 1 / 0)
+    assert [gauge['name'] for gauge in registry.to_dict()['gauges']] == ['api_stale']
+
+
+def test_prometheus_output(registry):
+    registry.counter('escaped_total', path='C:\\"x"').inc()
+    lines = registry.to_prometheus().splitlines()
+    assert lines[:6] == ['# TYPE stage_seconds summary',
+                         'stage_seconds{quantile="0.5",stage="render"} 0.51',
+                         'stage_seconds{quantile="0.95",stage="render"} 0.96',
+                         'stage_seconds{quantile="1",stage="render"} 1.0',
+                         'stage_seconds_count{stage="render"} 100',
+                         'stage_seconds_sum{stage="render"} 50.5']
+    assert 'display_refreshes_total{result="skipped"} 3' in lines
+    assert 'escaped_total{path="C:\\\\\\"x\\""} 1' in lines
+    assert lines[lines.index('# TYPE api_stale gauge') + 1] == 'api_stale{api="yrno"} 1'
+
+
+def test_server_serves_prometheus_and_json(server):
+    with urllib.request.urlopen(server + '/metrics') as res:
+        assert res.headers['Content-Type'].startswith('text/plain')
+        assert 'stage_seconds_count{stage="render"} 100' in res.read().decode('utf-8').splitlines()
+
+    with urllib.request.urlopen(server + '/metrics.json') as res:
+        assert res.headers['Content-Type'] == 'application/json'
+        metrics = json.loads(res.read().decode('utf-8'))
+    histogram, = metrics['histograms']
+    assert (histogram['name'], histogram['labels'], histogram['count']) == ('stage_seconds', {'stage': 'render'}, 100)
+    assert metrics['counters'] == [{'name': 'display_refreshes_total', 'labels': {'result': 'skipped'}, 'value': 3}]
+    assert metrics['gauges'] == [{'name': 'api_stale', 'labels': {'api': 'yrno'}, 'value': True}]
+
+    with pytest.raises(urllib.error.HTTPError) as err:
+        urllib.request.urlopen(server + '/other')
+    assert err.value.code == 404
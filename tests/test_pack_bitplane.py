@@ -0,0 +1,71 @@
+import random
+
+import pytest
+from PIL import Image
+
+from display.display_driver import pack_bitplane
+from display.epd_spi import EPD_WIDTH, EPD_HEIGHT
+
+
+def getbuffer(image, width, height):
+    """
+    `EPD.getbuffer` of the waveshare epd7in5b driver, walks every pixel, the reference of `pack_bitplane`
+    """
+    buf = [0xFF] * (int(width / 8) * height)
+    image_monocolor = image.convert('1')
+    imwidth, imheight = image_monocolor.size
+    pixels = image_monocolor.load()
+    if imwidth == width and imheight == height:
+        for y in range(imheight):
+            for x in range(imwidth):
+                if pixels[x, y] == 0:
+                    buf[int((x + y * width) / 8)] &= ~(0x80 >> (x % 8))
+    elif imwidth == height and imheight == width:
+        for y in range(imheight):
+            for x in range(imwidth):
+                newx = y
+                newy = height - x - 1
+                if pixels[x, y] == 0:
+                    buf[int((newx + newy * width) / 8)] &= ~(0x80 >> (y % 8))
+    return bytes(buf)
+
+
+def noise(size, seed):
+    rand = random.Random(seed)
+    return Image.frombytes('L', size, bytes(rand.getrandbits(8) for _ in range(size[0] * size[1])))
+
+
+PORTRAIT = (EPD_HEIGHT, EPD_WIDTH)  # rotated while packing
+LANDSCAPE = (EPD_WIDTH, EPD_HEIGHT)  # the panel's orientation, `render()` rotates its frames to it
+
+
+@pytest.mark.parametrize('size', [PORTRAIT, LANDSCAPE], ids=['portrait', 'landscape'])
+@pytest.mark.parametrize('frame', [
+    lambda size: Image.new('L', size, 255),
+    lambda size: Image.new('L', size, 0),
+    lambda size: noise(size, 1),
+    lambda size: noise(size, 2),
+], ids=['white', 'black', 'noise-1', 'noise-2'])
+def test_fixed_frames(frame, size):
+    image = frame(size)
+    assert pack_bitplane(image, EPD_WIDTH, EPD_HEIGHT) == getbuffer(image, EPD_WIDTH, EPD_HEIGHT)
+
+
+@pytest.mark.parametrize('landscape', [False, True], ids=['portrait', 'landscape'])
+def test_rendered_frame(rendered, landscape):
+    for image in rendered:
+        if not landscape:
+            image = image.transpose(Image.ROTATE_270)
+        assert image.size == (LANDSCAPE if landscape else PORTRAIT)
+        assert pack_bitplane(image, EPD_WIDTH, EPD_HEIGHT) == getbuffer(image, EPD_WIDTH, EPD_HEIGHT)
+
+
+def test_rendered_frame_not_blank(rendered):
+    white = bytes([0xFF]) * (EPD_WIDTH // 8 * EPD_HEIGHT)
+    assert all(pack_bitplane(image, EPD_WIDTH, EPD_HEIGHT) != white for image in rendered)
+
+
+def test_wrong_size_is_white():
+    image = Image.new('L', (100, 100), 0)
+    assert pack_bitplane(image, EPD_WIDTH, EPD_HEIGHT) == getbuffer(image, EPD_WIDTH, EPD_HEIGHT) == \
+        bytes([0xFF]) * (EPD_WIDTH // 8 * EPD_HEIGHT)
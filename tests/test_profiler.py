@@ -0,0 +1,74 @@
+import os
+import pstats
+import threading
+
+import pytest
+
+from profiler import Profiler
+
+
+@pytest.fixture
+def profiling_conf(conf, tmp_path):
+    conf['profiling'] = {'enabled': True, 'cycles': 1, 'directory': str(tmp_path / 'profiles')}
+    return conf
+
+
+def squares():
+    return sum(i * i for i in range(10000))
+
+
+def work(profiler):
+    with profiler.profile():
+        return squares()
+
+
+def touch(directory, *stamps):
+    for stamp in stamps:
+        for name in ('profile-%s.pstats' % stamp, 'alloc-%s.txt' % stamp):
+            open(os.path.join(directory, name), 'w').close()
+
+
+def test_config_triggers_one_capture(profiling_conf, use_config):
+    use_config(profiling_conf)
+    directory = profiling_conf['profiling']['directory']
+    profiler = Profiler()
+    profiler.cycle()  # starts the capture
+    assert profiler.capture is not None
+    work(profiler)
+    worker = threading.Thread(target=work, args=(profiler,), name='api-test')
+    worker.start()
+    worker.join()
+    profiler.cycle()  # ends it, the profiles are written in the background
+    profiler.writer.join(10)
+
+    alloc, profile = sorted(os.listdir(directory))
+    assert alloc.startswith('alloc-') and profile.startswith('profile-')
+    assert alloc[len('alloc-'):-len('.txt')] == profile[len('profile-'):-len('.pstats')]
+    assert any(function == 'squares' for _, _, function in pstats.Stats(os.path.join(directory, profile)).stats)
+    with open(os.path.join(directory, alloc)) as f:
+        assert 'api-test' in f.readline()
+
+    profiler.cycle()  # `enabled` is still set, but it captured once
+    assert profiler.capture is None
+    assert len(os.listdir(directory)) == 2
+
+
+def test_no_capture_without_request(conf, use_config):
+    use_config(conf)
+    profiler = Profiler()
+    profiler.cycle()
+    assert profiler.capture is None
+
+
+def test_prune_keeps_latest_captures(tmp_path):
+    touch(str(tmp_path), '20190101-120000', '20190101-120100', '20190101-120200')
+    (tmp_path / 'other.txt').write_text('')
+    Profiler._prune(str(tmp_path), 2)
+    assert sorted(os.listdir(str(tmp_path))) == ['alloc-20190101-120100.txt', 'alloc-20190101-120200.txt', 'other.txt',
+                                                 'profile-20190101-120100.pstats', 'profile-20190101-120200.pstats']
+
+
+def test_prune_keeps_nothing(tmp_path):
+    touch(str(tmp_path), '20190101-120000')
+    Profiler._prune(str(tmp_path), 0)
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,71 @@
+import time
+import types
+
+import pytest
+
+import response_cache
+from records import BikeStation
+from response_cache import ResponseCache
+from scheduler import ApiScheduler
+
+DATA = (BikeStation(207, 'Messe-Prater', 5, 'aktiv'),)
+
+
+class RestoredApi:
+    """
+    Api with no data of its own, it is only updated with data restored from the cache
+    """
+
+    def __init__(self):
+        self.exc_info = None
+        self.data = None
+        self.nextUpdate = 0
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    :return: `list` with the time the cache sees, change `clock[0]` to move it
+    """
+    now = [time.time()]
+    monkeypatch.setattr(response_cache, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def cache(conf, use_config, tmp_path):
+    conf['api'] = {'citybikewien': {'updateInterval': 60, 'cacheTtl': 600, 'stations': [{'id': 207}]}}
+    use_config(conf)
+    return ResponseCache(str(tmp_path))
+
+
+def test_entry_expires_after_ttl(cache, clock):
+    cache.store('citybikewien', DATA, clock[0], clock[0] + 60)
+    clock[0] += 599
+    assert cache.load('citybikewien').data == DATA
+    clock[0] += 1
+    assert cache.load('citybikewien') is None
+
+
+def test_config_change_ignores_entry(cache, conf, use_config):
+    cache.store('citybikewien', DATA, time.time(), time.time() + 60)
+    conf['api']['citybikewien']['stations'] = [{'id': 208}]
+    use_config(conf)
+    assert cache.load('citybikewien') is None
+
+
+def test_restored_entry_expires_at_first_ttl(cache, clock):
+    fetched_at = clock[0] - 500
+    cache.store('citybikewien', DATA, fetched_at, clock[0] + 300)  # due after the entry expired
+    api = RestoredApi()
+    api_scheduler = ApiScheduler({'citybikewien': api}, cache)
+    assert api.data == DATA
+
+    for _ in range(3):  # updates of the worker before `nextUpdate` is due
+        clock[0] += 30
+        api_scheduler.publish('citybikewien', api, fetched=False)
+        assert cache.load('citybikewien').expires == fetched_at + 600
+
+    clock[0] = fetched_at + 600
+    assert cache.load('citybikewien') is None
+    assert ApiScheduler({'citybikewien': RestoredApi()}, cache).snapshots()['citybikewien'].data is None
@@ -0,0 +1,166 @@
+import sys
+import time
+import types
+
+import pytest
+
+import scheduler
+from records import BikeStation
+from response_cache import ResponseCache
+from scheduler import ApiScheduler, stale_apis
+
+
+class StaticApi:
+    """
+    Api whose updates return the same data object, like an api after a `304 Not Modified`, once `nextUpdate` is due
+    """
+
+    def __init__(self, data):
+        self.exc_info = None
+        self.data = data
+        self.nextUpdate = 0
+        self.updates = 0  # calls of `update()`
+        self.fetches = 0  # updates that were due
+
+    def update(self):
+        self.updates += 1
+        if self.nextUpdate <= time.time():
+            self.fetches += 1
+            self.nextUpdate = time.time() + 60
+
+    def reset(self):
+        pass
+
+
+def failure():
+    try:
+        raise ConnectionError("injected")
+    except ConnectionError:
+        return sys.exc_info()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    :return: `list` with the time the scheduler sees, change `clock[0]` to move it
+    """
+    now = [time.time()]  # the cache expires entries on the real clock
+    monkeypatch.setattr(scheduler, 'time', types.SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def notifications(monkeypatch):
+    """
+    :return: function returning the number of times `scheduler.changed` was notified
+    """
+    def watch(api_scheduler):
+        count = [0]
+        notify_all = api_scheduler.changed.notify_all
+
+        def counting():
+            count[0] += 1
+            notify_all()
+        monkeypatch.setattr(api_scheduler.changed, 'notify_all', counting)
+        return lambda: count[0]
+    return watch
+
+
+@pytest.fixture
+def cache(conf, use_config, tmp_path):
+    conf['api'] = {'citybikewien': {'updateInterval': 60, 'stations': [{'id': 207}]}}
+    use_config(conf)
+    return ResponseCache(str(tmp_path))
+
+
+@pytest.fixture
+def cached_scheduler(cache):
+    api = StaticApi((BikeStation(207, 'Messe-Prater', 5, 'aktiv'),))
+    return ApiScheduler({'citybikewien': api}, cache), api, cache
+
+
+def test_unchanged_data_is_fresh_again(cached_scheduler, clock, notifications):
+    api_scheduler, api, cache = cached_scheduler
+    notified = notifications(api_scheduler)
+    api_scheduler.publish('citybikewien', api)
+    assert notified() == 1
+
+    clock[0] += 60
+    api.nextUpdate = clock[0] + 60
+    api_scheduler.publish('citybikewien', api)  # same data object, e.g. `304 Not Modified`
+    snapshot = api_scheduler.snapshots()['citybikewien']
+    assert snapshot.data is api.data
+    assert snapshot.fetched_at == clock[0]
+    assert notified() == 1  # nothing new to draw
+
+    entry = cache.load('citybikewien')
+    assert entry.fetched_at == clock[0]
+    assert entry.next_update == api.nextUpdate
+
+
+def test_failure_keeps_last_good_data(cached_scheduler, clock, notifications):
+    api_scheduler, api, cache = cached_scheduler
+    notified = notifications(api_scheduler)
+    api_scheduler.publish('citybikewien', api)
+    fetched_at = clock[0]
+
+    clock[0] += 60
+    api.exc_info = failure()
+    api_scheduler.publish('citybikewien', api)
+    snapshot = api_scheduler.snapshots()['citybikewien']
+    assert snapshot.data is api.data and snapshot.fetched_at == fetched_at and snapshot.exc_info
+    assert api.exc_info is None
+    assert stale_apis(api_scheduler.snapshots()) == ('citybikewien',)
+    assert cache.load('citybikewien').fetched_at == fetched_at
+    assert notified() == 2
+
+    clock[0] += 60
+    api_scheduler.publish('citybikewien', api)  # recovered with the same data
+    snapshot = api_scheduler.snapshots()['citybikewien']
+    assert snapshot.exc_info is None and snapshot.fetched_at == clock[0]
+    assert stale_apis(api_scheduler.snapshots()) == ()
+    assert notified() == 3
+
+
+def test_no_data_yet(cached_scheduler, notifications):
+    api_scheduler, api, cache = cached_scheduler
+    notified = notifications(api_scheduler)
+    api.data = None
+    api_scheduler.publish('citybikewien', api)
+    assert api_scheduler.snapshots()['citybikewien'] == scheduler.EMPTY_SNAPSHOT
+    assert cache.load('citybikewien') is None
+    assert notified() == 0
+
+
+def test_update_before_due_keeps_age(cached_scheduler, clock, notifications):
+    api_scheduler, api, cache = cached_scheduler
+    api_scheduler.publish('citybikewien', api)
+    fetched_at = clock[0]
+
+    clock[0] += 30
+    api_scheduler.publish('citybikewien', api, fetched=False)
+    assert api_scheduler.snapshots()['citybikewien'].fetched_at == fetched_at
+    assert cache.load('citybikewien').fetched_at == fetched_at
+
+
+def test_restored_data_keeps_age(cache):
+    data = (BikeStation(207, 'Messe-Prater', 5, 'aktiv'),)
+    fetched_at = time.time() - 3000
+    cache.store('citybikewien', data, fetched_at, time.time() + 60)  # not due before the next minute
+    api = StaticApi(None)
+    api_scheduler = ApiScheduler({'citybikewien': api}, cache)
+    api_scheduler.start()
+    try:
+        deadline = time.time() + 5
+        while api.updates == 0 and time.time() < deadline:  # the worker's first update, it is not due
+            time.sleep(0.01)
+    finally:
+        api_scheduler.stop()
+        for worker in api_scheduler.workers.values():
+            worker.join(5)  # published the update
+
+    assert api.updates == 1 and api.fetches == 0
+    snapshot = api_scheduler.snapshots()['citybikewien']
+    assert snapshot.data == data and snapshot.fetched_at == fetched_at
+    entry = cache.load('citybikewien')
+    assert entry.fetched_at == fetched_at and entry.expires == fetched_at + 3600
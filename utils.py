@@ -1,33 +1,26 @@
-import json
 import logging
 import sys
 
-conf_cache = None  # caches config.json
-
 
 def get_config():
     """
-    Returns a cached `dict` of `config.json`
-    If the cached `dict` does not exist, will try to load `config.json` from project root
+    Returns the read only `dict` of `config.json`, see `config.get_compiled_config()`
+    `config.json` is loaded from project root on first use and reloaded when the file changes
 
-    :return: cached `dict` of `config.json`
+    :return: read only `dict` of the current `config.json`
     """
-    global conf_cache
-    if conf_cache is None:
-        with open('config.json', 'r') as f:
-            conf_cache = json.load(f)
-    return conf_cache
+    from config import get_compiled_config
+    return get_compiled_config().raw
 
 
 def reload_conf():
     """
-    Reloads the cached `dict` of `config.json`
+    Reloads `config.json` right away
 
-    :return: cached `dict` of `config.json`
+    :return: read only `dict` of `config.json`
     """
-    global conf_cache
-    conf_cache = None
-    return get_config()
+    from config import reload_config
+    return reload_config().raw
 
 
 def get_logger(name):
@@ -1,16 +1,49 @@
 import threading
+import time
+
+from circuit_breaker import CircuitBreaker
+from metrics import get_metrics
+from profiler import get_profiler
 
 
 class Worker(threading.Thread):
     """
     Worker Wrapper, runs on own thread
-    Calls api.update() on thread.start()
+    Calls api.update() whenever the api's `nextUpdate` is due and publishes the result to the scheduler,
+    until the scheduler is stopped. Failed updates are retried as the api's `CircuitBreaker` decides
     """
 
-    def __init__(self, name, api):
-        threading.Thread.__init__(self)
+    def __init__(self, name, api, scheduler):
+        threading.Thread.__init__(self, daemon=True)
         self.name = name
         self.api = api
+        self.scheduler = scheduler
+        self.breaker = CircuitBreaker(name)
+        self.histogram = get_metrics().histogram('api_update_seconds', api=name)
+        self.updates = {failed: get_metrics().counter('api_updates_total', api=name, result='error' if failed else 'ok')
+                        for failed in (False, True)}
+        self.wakeup = threading.Event()  # set to update right away, unless the breaker is open
 
     def run(self):
-        self.api.update()
+        while not self.scheduler.stopped.is_set():
+            self.wakeup.clear()
+            if not self.breaker.allow():
+                self.wakeup.wait(max(0, self.breaker.retry_at - time.time()))
+                continue
+
+            due = self.api.nextUpdate
+            start = time.perf_counter()
+            with get_profiler().profile():
+                self.api.update()
+            self.histogram.observe(time.perf_counter() - start)
+            failed = self.api.exc_info is not None
+            self.updates[failed].inc()
+            # a fetch moves `nextUpdate`, an update before it was due, e.g. of data restored from the cache, does nothing
+            self.scheduler.publish(self.name, self.api, fetched=self.api.nextUpdate != due)
+
+            if failed:
+                delay = self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+                delay = self.api.nextUpdate - time.time()
+            self.wakeup.wait(max(0, delay))